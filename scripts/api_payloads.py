@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Column-wise JSON encoding for Kaspi API payloads
+Turns a frame of payload fields into one JSON object string per row without
+building intermediate dicts; empty fields are left out of the object
+"""
+import json
+import logging
+import pathlib
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+
+
+def _is_empty(value) -> bool:
+    """NaN / <NA> / None and blank strings are dropped from the payload"""
+    if isinstance(value, str):
+        return not value.strip()
+    return bool(pd.isna(value))
+
+
+def _plain(value):
+    """numpy scalars → Python ones, as json.dumps needs"""
+    if isinstance(value, (np.integer, np.floating, np.bool_)):
+        return value.item()
+    return value
+
+
+def _encode_value(value) -> str:
+    return json.dumps(_plain(value), ensure_ascii=False)
+
+
+def _fragments(key: str, values: pd.Series) -> np.ndarray:
+    """`,"key":value` per row ('' where empty); each distinct value is encoded once"""
+    prefix = "," + json.dumps(key, ensure_ascii=False) + ":"
+    codes, uniques = pd.factorize(values)
+    encoded = np.array([("" if _is_empty(u) else prefix + _encode_value(u)) for u in uniques] + [""],
+                       dtype=object)
+    return encoded.take(codes)  # code -1 (missing) picks the trailing ''
+
+
+def encode_records(frame: pd.DataFrame) -> pd.Series:
+    """One JSON object per row, keys = frame columns in order"""
+    if frame.empty:
+        return pd.Series([], index=frame.index, dtype=object)
+    fragments = [_fragments(str(key), frame[key]) for key in frame.columns]
+    # Every fragment starts with ',' – drop the first one
+    objects = ["{" + "".join(parts)[1:] + "}" for parts in zip(*fragments)]
+    return pd.Series(objects, index=frame.index, dtype=object)
+
+
+def to_record(row: pd.Series) -> Dict:
+    """The object encode_records writes for one row, as a dict"""
+    return {str(key): _plain(value) for key, value in row.items() if not _is_empty(value)}
+
+
+def write_ndjson(encoded: pd.Series, path: pathlib.Path, batch_size: int = BATCH_SIZE) -> int:
+    """Append pre-encoded objects to an NDJSON outbox file; returns lines written"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    values = encoded.tolist()
+    with open(path, "a", encoding="utf-8") as fh:
+        for start in range(0, len(values), batch_size):
+            fh.write("\n".join(values[start:start + batch_size]) + "\n")
+    logger.info(f"📤 Wrote {len(values)} payloads to {path}")
+    return len(values)
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Shared loader for M02_SKU_CATALOG
+Parses the semicolon CSV once with the C engine, reports malformed lines and
+memoizes the parsed views on disk keyed by the file's SHA-256
+"""
+import hashlib
+import logging
+import pathlib
+import re
+import warnings
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+# Setup paths
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+RAW_DIR = ROOT / "data_raw"
+CATALOG_PATH = RAW_DIR / "M02_SKU_CATALOG Sample for gpt.csv"
+CACHE_DIR = ROOT / "db" / "cache"
+
+# Bump when parsing or the derived views change – invalidates cached pickles
+LOADER_VERSION = 2
+
+logger = logging.getLogger(__name__)
+
+# Catalog column → products table column
+PRODUCT_COLUMNS = {
+    'SKU_ID': 'sku_id',
+    'Kaspi_name_core': 'kaspi_name_core',
+    'MY_SIZE': 'my_size',
+    'Size_kaspi': 'size_kaspi',
+    'Kaspi_art_1': 'kaspi_art_1',
+    'SKU_ID_KSP': 'sku_id_ksp',
+    'Kaspi_name_source': 'kaspi_name_source',
+    'Initial_KSP_Price': 'initial_ksp_price',
+    'Stock_entered': 'stock_entered',
+    'SKU_key': 'sku_key',
+    'Secondary': 'secondary',
+    'Product_Type': 'product_type',
+    'Sub_Category': 'sub_category',
+    'Brend': 'brand',
+    'Model': 'model',
+    'Color': 'color',
+    'Our_Size': 'our_size',
+    'Gender': 'gender',
+    'Season': 'season',
+    'BaseCost_CNY': 'base_cost_cny',
+    'Weight_kg': 'weight_kg',
+    'Store_name': 'store_name',
+    'Kaspi_art_2': 'kaspi_art_2',
+}
+
+_SKIPPED_LINE = re.compile(r"Skipping line (\d+): (.*)")
+
+# In-process memo: (path, sha256) → views
+_memo: Dict[tuple, Dict] = {}
+
+
+def file_sha256(path: pathlib.Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_catalog_csv(path: pathlib.Path) -> Dict:
+    """Parse the CSV; malformed lines are skipped but reported, never silently dropped"""
+    skipped = []  # (line number or None, reason, raw fields or None)
+    try:
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always", pd.errors.ParserWarning)
+            raw = pd.read_csv(path, sep=';', dtype=str, on_bad_lines='warn')
+        for w in caught:
+            for line in str(w.message).splitlines():
+                match = _SKIPPED_LINE.match(line)
+                if match:
+                    skipped.append((int(match.group(1)), match.group(2), None))
+    except pd.errors.ParserError as e:
+        # Tokenizer errors (e.g. an unterminated quote) – retry with the tolerant parser
+        logger.warning(f"⚠️ C parser failed on {path.name} ({e}) – falling back to the python engine")
+        skipped = []
+        raw = pd.read_csv(path, sep=';', dtype=str, engine='python',
+                          on_bad_lines=lambda fields: skipped.append((None, "unexpected field count", fields)))
+
+    raw.columns = [col.strip() for col in raw.columns]
+    lines, rejected = _source_lines(path, len(raw), skipped)
+    bad_lines = [f"line {ln}: {reason}" if ln else f"fields: {fields}" for ln, reason, fields in skipped]
+    return {'raw': raw, 'products': _products_view(raw), 'bad_lines': bad_lines,
+            'lines': pd.Series(lines, index=raw.index), 'rejected': rejected}
+
+
+def _source_lines(path: pathlib.Path, n_rows: int, skipped: List) -> tuple:
+    """File line of every parsed row, and the skipped lines as (line, reason, payload)
+
+    Rows are numbered over the non-blank lines after the header, minus the skipped
+    ones (a quoted field spanning lines shifts the rows after it).
+    """
+    text = path.read_text(encoding='utf-8', errors='replace').splitlines()
+    skipped_numbers = {ln for ln, _, _ in skipped if ln}
+    data_lines = [i for i, line in enumerate(text, start=1) if line.strip()][1:]
+    lines = [i for i in data_lines if i not in skipped_numbers][:n_rows]
+    lines += [None] * (n_rows - len(lines))
+    rejected = pd.DataFrame(
+        [(ln, reason, text[ln - 1] if ln and ln <= len(text) else ';'.join(fields or []))
+         for ln, reason, fields in skipped],
+        columns=['line', 'reason', 'payload'])
+    return lines, rejected
+
+
+def _products_view(raw: pd.DataFrame) -> pd.DataFrame:
+    """Product columns with '' for blanks and a numeric Weight_kg"""
+    products = raw.reindex(columns=list(PRODUCT_COLUMNS)).fillna('')
+    products['Weight_kg'] = pd.to_numeric(products['Weight_kg'].str.replace(',', '.'), errors='coerce')
+    return products
+
+
+def _views(path: pathlib.Path, use_cache: bool) -> Dict:
+    sha = file_sha256(path)
+    memo_key = (str(path), sha)
+    if memo_key in _memo:
+        return _memo[memo_key]
+
+    slug = re.sub(r'\W+', '_', path.stem)
+    cache_path = CACHE_DIR / f"{slug}_{sha[:16]}_v{LOADER_VERSION}.pkl"
+    views: Optional[Dict] = None
+    if use_cache and cache_path.exists():
+        try:
+            views = pd.read_pickle(cache_path)
+        except Exception as e:
+            logger.warning(f"⚠️ Ignoring unreadable catalog cache {cache_path.name}: {e}")
+
+    if views is None:
+        views = read_catalog_csv(path)
+        if use_cache:
+            CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            for stale in CACHE_DIR.glob(f"{slug}_*.pkl"):
+                stale.unlink()
+            tmp = cache_path.with_suffix(".tmp")
+            pd.to_pickle(views, tmp)
+            tmp.replace(cache_path)
+
+    if views['bad_lines']:
+        logger.warning(f"⚠️ {path.name}: skipped {len(views['bad_lines'])} malformed lines")
+        for line in views['bad_lines'][:5]:
+            logger.warning(f"  {line}")
+
+    _memo[memo_key] = views
+    return views
+
+
+def load_catalog(path: pathlib.Path = CATALOG_PATH, use_cache: bool = True) -> pd.DataFrame:
+    """Every catalog column as text, column names stripped"""
+    return _views(path, use_cache)['raw'].copy()
+
+
+def load_products(path: pathlib.Path = CATALOG_PATH, use_cache: bool = True) -> pd.DataFrame:
+    """The PRODUCT_COLUMNS subset under catalog names: '' for blanks, Weight_kg as float"""
+    return _views(path, use_cache)['products'].copy()
+
+
+def bad_lines(path: pathlib.Path = CATALOG_PATH) -> List[str]:
+    """Malformed lines skipped while parsing the catalog"""
+    return list(_views(path, True)['bad_lines'])
+
+
+def rejected_lines(path: pathlib.Path = CATALOG_PATH) -> pd.DataFrame:
+    """Malformed lines as rejects rows: line, reason, payload (the raw line)"""
+    return _views(path, True)['rejected'].copy()
+
+
+def source_lines(path: pathlib.Path = CATALOG_PATH) -> pd.Series:
+    """File line number per catalog row (aligned with load_catalog's index)"""
+    return _views(path, True)['lines'].copy()
+
+
+def products_for_db(products: pd.DataFrame) -> pd.DataFrame:
+    """Rename to products table columns and apply its numeric types"""
+    db_df = products.rename(columns=PRODUCT_COLUMNS)
+    db_df['stock_entered'] = pd.to_numeric(db_df['stock_entered'], errors='coerce').fillna(0).astype(int)
+    db_df['base_cost_cny'] = pd.to_numeric(db_df['base_cost_cny'], errors='coerce')
+    return db_df
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Customer dimension built from Kaspi order payloads
+Customers are keyed by their E.164 phone (+7XXXXXXXXXX), linked to orders
+through order_customers and filled in bulk from kaspi_orders.customer_json;
+lookup_customers answers order id → customer → past sizes for many orders
+with one query
+
+    python scripts/customers.py --rebuild          # (re)link every stored order
+    python scripts/customers.py --lookup 602121111 601984776
+"""
+import argparse
+import json
+import logging
+import pathlib
+import sqlite3
+from typing import Iterable, Optional
+
+import pandas as pd
+
+# Setup paths
+DB_PATH = pathlib.Path(__file__).resolve().parents[1] / "db" / "erp.db"
+
+COUNTRY_CODE = "7"  # Kazakhstan
+
+# Trailing size token of an order line name: "Комплект 5-beli черный, белый 3XL" → 3XL
+SIZE_TOKEN = r"\s(\d?X{0,3}[SML]|\d{2,3})\s*$"
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def create_customer_tables(con: sqlite3.Connection) -> None:
+    """Create customers / order_customers and index the tables lookups join"""
+    con.executescript("""
+    CREATE TABLE IF NOT EXISTS customers (
+        phone               TEXT PRIMARY KEY,
+        kaspi_customer_id   TEXT,
+        first_name          TEXT,
+        last_name           TEXT,
+        first_order_ms      INTEGER,
+        last_order_ms       INTEGER,
+        updated_at          TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE IF NOT EXISTS order_customers (
+        kaspi_order_id      TEXT PRIMARY KEY,
+        order_id            INTEGER,
+        phone               TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_order_customers_order_id ON order_customers(order_id);
+    CREATE INDEX IF NOT EXISTS idx_order_customers_phone ON order_customers(phone);
+    """)
+    # orders is rebuilt by etl_sales with to_sql, which drops its indexes
+    if con.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='orders'").fetchone():
+        con.execute("CREATE INDEX IF NOT EXISTS idx_orders_order_id ON orders(order_id)")
+
+
+def normalize_phones(values: pd.Series) -> pd.Series:
+    """Phones → E.164 (+7XXXXXXXXXX); <NA> where the number is not a KZ number
+
+    Accepts 10-digit national numbers and 11-digit ones starting with 7 or 8,
+    with any punctuation.
+    """
+    digits = values.astype('string').str.replace(r"\D", "", regex=True)
+    national = digits.where(digits.str.len().eq(10))
+    trunk = digits.str.len().eq(11) & digits.str[0].isin([COUNTRY_CODE, "8"])
+    national = national.mask(trunk, digits.str[1:])
+    return ("+" + COUNTRY_CODE + national).astype('string')
+
+
+def normalize_phone(value) -> Optional[str]:
+    """Single-value form of normalize_phones"""
+    phone = normalize_phones(pd.Series([value])).iloc[0]
+    return None if pd.isna(phone) else str(phone)
+
+
+def customer_rows(kaspi_orders: pd.DataFrame) -> pd.DataFrame:
+    """kaspi_orders rows → one row per order with the customer fields and phone"""
+    docs = [json.loads(doc) if doc else {} for doc in kaspi_orders['customer_json'].tolist()]
+    customers = pd.json_normalize(docs).reindex(
+        columns=['id', 'cellPhone', 'firstName', 'lastName', 'name'])
+    customers.index = kaspi_orders.index
+    first_name = customers['firstName'].fillna(customers['name'])
+    return pd.DataFrame({
+        'kaspi_order_id': kaspi_orders['kaspi_order_id'],
+        'order_id': kaspi_orders['order_id'],
+        'creation_ms': kaspi_orders['creation_ms'],
+        'phone': normalize_phones(customers['cellPhone']),
+        'kaspi_customer_id': customers['id'],
+        'first_name': first_name,
+        'last_name': customers['lastName'],
+    })
+
+
+def upsert_customers(con: sqlite3.Connection, rows: pd.DataFrame) -> int:
+    """Bulk upsert customers and order links from customer_rows (caller commits)"""
+    rows = rows[rows['phone'].notna()]
+    if rows.empty:
+        return 0
+
+    # One row per phone: names and id from the latest order, first/last order times
+    latest = rows.sort_values('creation_ms').groupby('phone', sort=False).last()
+    spans = rows.groupby('phone')['creation_ms'].agg(['min', 'max'])
+    people = latest.join(spans)
+    values = people[['kaspi_customer_id', 'first_name', 'last_name', 'min', 'max']].astype(object)
+    values = values.where(values.notna(), None)
+    con.executemany("""
+        INSERT INTO customers (phone, kaspi_customer_id, first_name, last_name,
+                               first_order_ms, last_order_ms)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(phone) DO UPDATE SET
+            kaspi_customer_id = COALESCE(excluded.kaspi_customer_id, kaspi_customer_id),
+            first_name        = COALESCE(excluded.first_name, first_name),
+            last_name         = COALESCE(excluded.last_name, last_name),
+            first_order_ms    = MIN(COALESCE(first_order_ms, excluded.first_order_ms),
+                                    COALESCE(excluded.first_order_ms, first_order_ms)),
+            last_order_ms     = MAX(COALESCE(last_order_ms, excluded.last_order_ms),
+                                    COALESCE(excluded.last_order_ms, last_order_ms)),
+            updated_at        = CURRENT_TIMESTAMP
+    """, [(phone, *row) for phone, row in zip(values.index, values.values.tolist())])
+
+    links = rows[['kaspi_order_id', 'order_id', 'phone']].astype(object)
+    con.executemany("INSERT OR REPLACE INTO order_customers (kaspi_order_id, order_id, phone) "
+                    "VALUES (?, ?, ?)", links.values.tolist())
+    return len(people)
+
+
+def sync_customers(con: sqlite3.Connection, kaspi_order_ids: Optional[Iterable[str]] = None) -> int:
+    """Fill customers from stored kaspi_orders – the given ones, or every order (caller commits)"""
+    create_customer_tables(con)
+    if not con.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='kaspi_orders'").fetchone():
+        logger.warning("⚠️ No kaspi_orders table yet – run kaspi_orders_poller.py first")
+        return 0
+    query = "SELECT kaspi_order_id, order_id, creation_ms, customer_json FROM kaspi_orders"
+    if kaspi_order_ids is None:
+        kaspi_orders = pd.read_sql(query, con)
+    else:
+        ids = list(kaspi_order_ids)
+        if not ids:
+            return 0
+        con.execute("CREATE TEMP TABLE IF NOT EXISTS sync_order_ids (kaspi_order_id TEXT PRIMARY KEY)")
+        con.execute("DELETE FROM temp.sync_order_ids")
+        con.executemany("INSERT OR IGNORE INTO temp.sync_order_ids VALUES (?)", [(i,) for i in ids])
+        kaspi_orders = pd.read_sql(query + " WHERE kaspi_order_id IN (SELECT kaspi_order_id "
+                                           "FROM temp.sync_order_ids)", con)
+    if kaspi_orders.empty:
+        return 0
+
+    rows = customer_rows(kaspi_orders)
+    no_phone = int(rows['phone'].isna().sum())
+    if no_phone:
+        logger.warning(f"⚠️ {no_phone} orders without a valid customer phone – not linked")
+    count = upsert_customers(con, rows)
+    logger.info(f"👤 Linked {len(rows) - no_phone} orders to {count} customers")
+    return count
+
+
+def lookup_customers(con: sqlite3.Connection, order_ids: Iterable[int]) -> pd.DataFrame:
+    """order_id → phone, name, orders_count and past_sizes for many orders at once
+
+    past_sizes lists the sizes of the customer's other orders, newest first:
+    confirmed size recommendations first, then sizes read from order line names.
+    Orders without a linked customer come back with empty fields.
+    """
+    create_customer_tables(con)
+    con.execute("CREATE TEMP TABLE IF NOT EXISTS lookup_order_ids (order_id INTEGER PRIMARY KEY)")
+    con.execute("DELETE FROM temp.lookup_order_ids")
+    con.executemany("INSERT OR IGNORE INTO temp.lookup_order_ids VALUES (?)",
+                    [(int(i),) for i in order_ids])
+
+    found = pd.read_sql("""
+        SELECT r.order_id, c.phone, c.first_name, c.last_name,
+               (SELECT COUNT(*) FROM order_customers n WHERE n.phone = c.phone) AS orders_count
+        FROM temp.lookup_order_ids r
+        LEFT JOIN order_customers oc ON oc.order_id = r.order_id
+        LEFT JOIN customers c ON c.phone = oc.phone
+        GROUP BY r.order_id
+    """, con)
+
+    tables = {name for (name,) in con.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+    history = []
+    customer_orders = """
+        SELECT DISTINCT oc.phone, oc.order_id FROM order_customers oc
+        WHERE oc.phone IN (SELECT oc2.phone FROM order_customers oc2
+                           JOIN temp.lookup_order_ids r ON r.order_id = oc2.order_id)
+    """
+    if 'size_recommendations' in tables:
+        history.append(pd.read_sql(f"""
+            SELECT h.phone, h.order_id, COALESCE(s.final_size, s.recommended_size) AS size,
+                   s.created_at AS seen_at, 0 AS source
+            FROM ({customer_orders}) h
+            JOIN size_recommendations s ON s.order_id = CAST(h.order_id AS TEXT)
+            WHERE s.customer_confirmed
+        """, con))
+    if 'orders' in tables:
+        lines = pd.read_sql(f"""
+            SELECT h.phone, h.order_id, o.sku_name_raw, o.order_date AS seen_at, 1 AS source
+            FROM ({customer_orders}) h
+            JOIN orders o ON o.order_id = h.order_id
+        """, con)
+        lines['size'] = lines.pop('sku_name_raw').str.extract(SIZE_TOKEN, expand=False)
+        history.append(lines)
+
+    found['past_sizes'] = [[] for _ in range(len(found))]
+    history = pd.concat(history, ignore_index=True) if history else pd.DataFrame()
+    if not history.empty and found['phone'].notna().any():
+        history = history[history['size'].notna()]
+        pairs = found[['order_id', 'phone']].dropna().merge(history, on='phone', suffixes=('', '_past'))
+        pairs = pairs[pairs['order_id_past'] != pairs['order_id']]
+        pairs = pairs.sort_values(['source', 'seen_at'], ascending=[True, False])
+        sizes = pairs.groupby('order_id')['size'].agg(lambda s: list(dict.fromkeys(s)))
+        found['past_sizes'] = found['order_id'].map(sizes).apply(lambda v: v if isinstance(v, list) else [])
+    return found
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Customer dimension from Kaspi orders")
+    ap.add_argument("--rebuild", action="store_true", help="link every stored Kaspi order")
+    ap.add_argument("--lookup", type=int, nargs="+", metavar="ORDER_ID",
+                    help="print customer and past sizes for these orders")
+    args = ap.parse_args()
+
+    con = sqlite3.connect(DB_PATH)
+    try:
+        if args.rebuild:
+            sync_customers(con)
+            con.commit()
+        if args.lookup:
+            print(lookup_customers(con, args.lookup).to_string(index=False))
+    finally:
+        con.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,60 +1,106 @@
 #!/usr/bin/env python3
 # ----------  Streamlit mini‑dashboard ----------
-import streamlit as st, pandas as pd, sqlite3, pathlib, altair as alt, numpy as np
+# Panels query aggregates from SQLite (order_queries) for the selected dates / SKUs
+import streamlit as st, pandas as pd, sqlite3, pathlib, altair as alt
+
+import load_versions
+import order_queries as q
+import replenishment
 
 DB = pathlib.Path(__file__).parents[1] / "db" / "erp.db"
+DEFAULT_DAYS = 30
 
 # ---------- helpers ----------
-def reorder_point(daily, lead, z=1.65):          # 95 % service level ≈ z‑score 1.65
-    safety = z * (daily * 0.2) * np.sqrt(lead)   # assume 20 % demand st.dev. if none given
-    return int(np.ceil(daily * lead + safety))
+def connect():
+    return sqlite3.connect(DB)
 
 # ---------- data loaders ----------
-@st.cache_data(ttl=300)
-def load():
-    con = sqlite3.connect(DB)
-    orders = pd.read_sql("select * from orders", con, parse_dates=["order_date"])
+# Cached until an ETL records a new load version (load_versions) – no timer;
+# the token is one indexed lookup per rerun. Entries are capped so selections
+# under old versions are evicted instead of piling up for the server's lifetime
+TABLES = ("orders", "stock", "purchases", "replenishment")
+MAX_SELECTIONS = 64   # cached (date, SKU selection, version) inventory panels
+
+@st.cache_resource
+def ensure_indexes():
+    con = connect()
     try:
-        stock = pd.read_sql("select * from stock", con)
-    except Exception:
-        stock = pd.DataFrame(columns=["sku_key", "qty_on_hand"])
-    con.close()
-    return orders, stock
+        q.create_order_indexes(con)
+        con.commit()
+    finally:
+        con.close()
 
-orders, stock = load()
+@st.cache_resource
+def order_partitions():
+    return q.OrderPartitions()   # per-day totals shared by sessions, refreshed incrementally
 
-# ---------- KPI tiles ----------
-col1, col2 = st.columns(2)
-col1.metric("Orders", f"{len(orders):,}")
-col2.metric(
-    "Net revenue",
-    f"{(orders['gross_price_kzt']*(1-orders['kaspi_fee_pct'])-orders['delivery_cost_kzt']).sum():,.0f} ₸",
-)
+def load_token():
+    con = connect()
+    try:
+        return load_versions.current_versions(con, TABLES)
+    finally:
+        con.close()
 
-# ---------- Inventory panel ----------
-recent = orders[orders["order_date"] >= orders["order_date"].max() - pd.Timedelta(days=30)]
-daily_demand = (recent.groupby("sku_key")["qty"].sum() / 30).rename("daily_demand")
+@st.cache_data(max_entries=2)   # current orders version, plus the previous during a rollover
+def load_filters(orders_version):
+    con = connect()
+    try:
+        return q.date_bounds(con), q.sku_keys(con)
+    finally:
+        con.close()
 
-inv = stock.merge(daily_demand, on="sku_key", how="left").fillna({"daily_demand": 0})
-inv["rop"] = inv.apply(lambda r: reorder_point(r["daily_demand"], 20), axis=1)
-inv["need_reorder"] = inv["qty_on_hand"] <= inv["rop"]
+@st.cache_data(max_entries=MAX_SELECTIONS)
+def load_inventory(end, skus, token):
+    con = connect()
+    try:
+        # Levels stored by replenishment.py; computed on the fly until it has run
+        inv = replenishment.load_replenishment(con, skus)
+        return inv if len(inv) else replenishment.compute(con, end, skus=skus)
+    finally:
+        con.close()
+
+def load_panels(start, end, skus, token):
+    con = connect()
+    try:
+        totals = order_partitions().totals(con, start, end)
+    finally:
+        con.close()
+    return (*q.summarize(totals, skus), load_inventory(end, skus, token))
 
+ensure_indexes()
+token = load_token()
+(first, last), all_skus = load_filters(token[0])
+if last is None:
+    st.warning("No orders loaded yet")
+    st.stop()
+
+# ---------- filters ----------
+first, last = pd.Timestamp(first).date(), pd.Timestamp(last).date()
+default_start = max(first, last - pd.Timedelta(days=DEFAULT_DAYS - 1))
+picked = st.sidebar.date_input("Order dates", (default_start, last), min_value=first, max_value=last)
+start, end = picked if len(picked) == 2 else (picked[0], picked[0])   # one date while the range is being picked
+skus = tuple(st.sidebar.multiselect("SKUs", all_skus))
+
+totals, rev, pivot, inv = load_panels(start.isoformat(), end.isoformat(), skus, token)
+
+# ---------- KPI tiles ----------
+col1, col2 = st.columns(2)
+col1.metric("Orders", f"{totals['orders']:,}")
+col2.metric("Net revenue", f"{totals['net_revenue']:,.0f} ₸")
+
+# ---------- Inventory panel (replenishment levels) ----------
 st.subheader("Inventory & ROP")
+if len(inv):
+    st.caption(f"Demand up to {inv['as_of'].iloc[0]} · reorder when stock + on order ≤ ROP")
 st.dataframe(
-    inv[["sku_key", "qty_on_hand", "rop", "need_reorder"]]
-        .sort_values("need_reorder", ascending=False),
+    inv[["sku_key", "on_hand", "on_order", "demand_mean",
+         "safety_stock", "reorder_point", "order_up_to", "order_qty", "need_reorder"]]
+        .sort_values(["need_reorder", "order_qty"], ascending=False),
     use_container_width=True,
 )
 
 # ---------- Daily net revenue chart ----------
 st.subheader("Daily Net Revenue")
-rev = (
-    orders.assign(net=lambda d: d["gross_price_kzt"] * (1 - d["kaspi_fee_pct"]) - d["delivery_cost_kzt"])
-          .groupby("order_date")["net"]
-          .sum()
-          .reset_index()
-)
-
 chart = (
     alt.Chart(rev)
        .mark_bar()
@@ -64,12 +110,5 @@ chart = (
 st.altair_chart(chart, use_container_width=True)
 
 # ---------- Gross margin by SKU ----------
-pivot = (
-    orders.assign(net=lambda d: d["gross_price_kzt"] * (1 - d["kaspi_fee_pct"]) - d["delivery_cost_kzt"])
-          .groupby("sku_key")["net"]
-          .sum()
-          .reset_index()
-          .sort_values("net", ascending=False)
-)
 st.subheader("Gross Margin by SKU")
-st.dataframe(pivot, use_container_width=True)
\ No newline at end of file
+st.dataframe(pivot, use_container_width=True)
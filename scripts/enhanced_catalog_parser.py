@@ -3,18 +3,27 @@
 Enhanced Catalog Parser with Data Validation and Kaspi API Mapping
 Handles M02_SKU_CATALOG with Russian columns and comma-separated weights
 """
+import argparse
+import numpy as np
 import pandas as pd
 import sqlite3
 import pathlib
 import logging
-from typing import Dict, List, Optional, Tuple
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
 import re
 
+from api_payloads import encode_records, to_record, write_ndjson
+from catalog_loader import load_catalog, rejected_lines, source_lines
+from rejects import clear_rejects, reject_lines, reject_rows
+
 # Setup paths
 RAW_DIR = pathlib.Path(__file__).resolve().parents[1] / "data_raw"
 DB_PATH = pathlib.Path(__file__).resolve().parents[1] / "db" / "erp.db"
 CATALOG_PATH = RAW_DIR / "M02_SKU_CATALOG Sample for gpt.csv"
 
+INT64_MAX = str(np.iinfo(np.int64).max)  # digit string, compared against cleaned stock text
+
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -49,7 +58,7 @@ class CatalogDataValidator:
             # Remove spaces and non-numeric chars except decimal
             cleaned = re.sub(r'[^\d.]', '', str(price_str))
             return int(float(cleaned)) if cleaned else None
-        except (ValueError, TypeError):
+        except (ValueError, TypeError, OverflowError):
             logger.warning(f"Invalid price format: {price_str}")
             return None
     
@@ -66,6 +75,79 @@ class CatalogDataValidator:
             logger.warning(f"Invalid stock format: {stock_str}")
             return 0
     
+    # ── column-wise versions: same results as the scalar cleaners, None → NaN/<NA> ──
+    # (integers beyond int64 are treated as invalid instead of overflowing the column)
+    # Catalog columns repeat a handful of values, so each distinct value is cleaned
+    # once and broadcast back through the factorize codes.
+    @staticmethod
+    def _by_unique(series: pd.Series, clean, fill) -> pd.Series:
+        codes, uniques = pd.factorize(series)
+        cleaned = clean(pd.Series(uniques, dtype=object)).to_numpy()
+        values = np.append(cleaned, np.array([fill], dtype=cleaned.dtype))  # code -1 = NaN
+        return pd.Series(values.take(codes), index=series.index)
+
+    @staticmethod
+    def _parse_float(values: pd.Series, what: str, comma_decimal: bool = False) -> pd.Series:
+        """float() of each value stripped to [digits.]; unparsable ones (e.g. '1.2.3') become NaN"""
+        # Cells the scalar cleaners treat as empty (`not value`)
+        blank = values.eq('') | values.eq(0)
+        text = values.astype(str)
+        if comma_decimal:
+            text = text.str.replace(',', '.', regex=False)
+        cleaned = text.str.replace(r'[^\d.]', '', regex=True)
+        # After stripping to [digits.], float() accepts exactly: ≥ 1 digit, ≤ 1 dot
+        valid = ~blank & cleaned.str.fullmatch(r'\d+\.?\d*|\.\d+')
+        invalid = int((~blank & ~valid & cleaned.ne('')).sum())
+        if invalid:
+            logger.warning(f"Invalid {what} format in {invalid} distinct values")
+
+        result = pd.Series(np.nan, index=values.index, dtype=float)
+        result[valid] = cleaned[valid].astype(float)
+        return result
+
+    @staticmethod
+    def clean_weight_series(weights: pd.Series) -> pd.Series:
+        """Column-wise clean_weight: '0,95' → 0.95, empty/invalid → NaN"""
+        return CatalogDataValidator._by_unique(
+            weights,
+            lambda u: CatalogDataValidator._parse_float(u, 'weight', comma_decimal=True),
+            np.nan)
+
+    @staticmethod
+    def clean_price_series(prices: pd.Series) -> pd.Series:
+        """Column-wise clean_price: '87 990' → 87990 (Int64), empty/invalid → <NA>"""
+        floats = CatalogDataValidator._by_unique(
+            prices,
+            lambda u: CatalogDataValidator._parse_float(u, 'price'),
+            np.nan)
+        floats = floats.astype(float)
+        # int64 can't hold it (scalar clean_price would give a huge int or overflow)
+        too_large = floats.abs() >= 2.0 ** 63   # also ±inf
+        if too_large.any():
+            logger.warning(f"Out-of-range price in {int(too_large.sum())} rows")
+            floats = floats.mask(too_large)
+        return np.trunc(floats).astype('Int64')
+
+    @staticmethod
+    def clean_stock_series(stock: pd.Series) -> pd.Series:
+        """Column-wise clean_stock: digits only, empty → 0"""
+        def clean(u: pd.Series) -> pd.Series:
+            blank = u.eq('') | u.eq(0)
+            cleaned = u.astype(str).str.replace(r'[^\d]', '', regex=True)
+            present = ~blank & cleaned.ne('')
+            digits = cleaned.str.lstrip('0')
+            too_large = present & (digits.str.len().gt(len(INT64_MAX))
+                                   | digits.str.len().eq(len(INT64_MAX)) & digits.gt(INT64_MAX))
+            if too_large.any():
+                logger.warning(f"Out-of-range stock in {int(too_large.sum())} distinct values")
+                present &= ~too_large
+            # int() per value and a numpy write: pandas' str → int64 paths go through float64
+            result = np.zeros(len(u), dtype=np.int64)
+            result[present.to_numpy()] = [int(v) for v in cleaned[present]]
+            return pd.Series(result, index=u.index)
+
+        return CatalogDataValidator._by_unique(stock, clean, 0).astype('int64')
+    
     @staticmethod
     def validate_sku_id(sku_id: str) -> bool:
         """Validate SKU ID format"""
@@ -79,6 +161,12 @@ class CatalogDataValidator:
         if not text or pd.isna(text):
             return ""
         return str(text).strip()
+    
+    @staticmethod
+    def clean_text_series(texts: pd.Series) -> pd.Series:
+        """Column-wise clean_text_field: stripped text, '' for empty"""
+        return CatalogDataValidator._by_unique(
+            texts, lambda u: u.astype(str).str.strip().astype(object), '')
 
 
 class KaspiApiMapper:
@@ -103,31 +191,92 @@ class KaspiApiMapper:
         'Sub_Category': 'subcategory',
     }
     
+    # Columns that go through a numeric cleaner; everything else is stripped text
+    NUMERIC_CLEANERS = {
+        'Initial_KSP_Price': CatalogDataValidator.clean_price_series,
+        'Stock_entered': CatalogDataValidator.clean_stock_series,
+        'Weight_kg': CatalogDataValidator.clean_weight_series,
+    }
+    
+    @classmethod
+    def map_frame(cls, df: pd.DataFrame) -> pd.DataFrame:
+        """Column-wise map_to_api_format: one API field per column, None/'' where empty"""
+        api_df = pd.DataFrame(index=df.index)
+        for col, field in cls.FIELD_MAPPING.items():
+            if col not in df.columns:
+                api_df[field] = ''
+            elif col in cls.NUMERIC_CLEANERS:
+                api_df[field] = cls.NUMERIC_CLEANERS[col](df[col])
+            else:
+                api_df[field] = CatalogDataValidator.clean_text_series(df[col])
+        if 'SKU_ID' in df.columns:
+            api_df['title'] = api_df['title'].mask(api_df['title'].eq(''), df['SKU_ID'].fillna(''))
+        return api_df
+    
     @classmethod
     def map_to_api_format(cls, row: pd.Series) -> Dict:
         """Convert catalog row to Kaspi API format"""
-        validator = CatalogDataValidator()
-        
-        api_data = {
-            'merchantProductId': validator.clean_text_field(row.get('SKU_ID')),
-            'title': validator.clean_text_field(row.get('Kaspi_name_core')) or row.get('SKU_ID', ''),
-            'masterCode': validator.clean_text_field(row.get('Kaspi_art_1')),
-            'code': validator.clean_text_field(row.get('SKU_ID_KSP')),
-            'price': validator.clean_price(row.get('Initial_KSP_Price')),
-            'availableAmount': validator.clean_stock(row.get('Stock_entered')),
-            'weight': validator.clean_weight(row.get('Weight_kg')),
-            'brand': validator.clean_text_field(row.get('Brend')),
-            'model': validator.clean_text_field(row.get('Model')),
-            'color': validator.clean_text_field(row.get('Color')),
-            'size': validator.clean_text_field(row.get('Our_Size')),
-            'gender': validator.clean_text_field(row.get('Gender')),
-            'season': validator.clean_text_field(row.get('Season')),
-            'category': validator.clean_text_field(row.get('Product_Type')),
-            'subcategory': validator.clean_text_field(row.get('Sub_Category')),
-        }
-        
-        # Remove None values for API compatibility
-        return {k: v for k, v in api_data.items() if v is not None and v != ''}
+        return to_record(cls.map_frame(row.to_frame().T).iloc[0])
+
+
+# ── validation rules ─────────────────────────────────────────
+# Every rule returns a boolean mask over the whole catalog (True = violation);
+# 'error' rows are dropped, 'warning' rows are kept and reported.
+REQUIRED_COLUMNS = ['SKU_ID', 'Store_name']
+ISSUE_COLUMNS = ['row', 'column', 'rule', 'severity', 'value', 'message']
+
+
+@dataclass
+class ValidationRule:
+    """One declarative catalog check"""
+    name: str
+    column: str
+    severity: str
+    message: str
+    check: Callable[[pd.DataFrame, pd.DataFrame], pd.Series]
+
+
+def _text(df: pd.DataFrame, col: str) -> pd.Series:
+    return CatalogDataValidator.clean_text_series(df[col])
+
+
+def _blank(col: str) -> Callable[[pd.DataFrame, pd.DataFrame], pd.Series]:
+    return lambda df, products: _text(df, col).eq('')
+
+
+def _unparsable(col: str, clean: Callable[[pd.Series], pd.Series]):
+    """Filled in, but the cleaner cannot turn it into a number"""
+    return lambda df, products: ~_text(df, col).eq('') & clean(df[col]).isna()
+
+
+def _duplicated(col: str):
+    return lambda df, products: ~_text(df, col).eq('') & _text(df, col).duplicated()
+
+
+def _ksp_conflicts(df: pd.DataFrame, products: pd.DataFrame) -> pd.Series:
+    """SKU_ID_KSP already mapped to a different SKU_ID in the products table"""
+    known = products.dropna(subset=['sku_id_ksp'])
+    known_ksp = known['sku_id_ksp'].astype(str).str.strip()
+    ksp = _text(df, 'SKU_ID_KSP')
+    pairs = pd.MultiIndex.from_arrays([ksp, _text(df, 'SKU_ID')])
+    known_pairs = pd.MultiIndex.from_arrays([known_ksp,
+                                             known['sku_id'].fillna('').astype(str).str.strip()])
+    return pd.Series((ksp.ne('') & ksp.isin(known_ksp)).to_numpy() & ~pairs.isin(known_pairs),
+                     index=df.index)
+
+
+CATALOG_RULES = [
+    ValidationRule('required', 'SKU_ID', 'error', "Invalid SKU_ID", _blank('SKU_ID')),
+    ValidationRule('required', 'Store_name', 'warning', "Missing store name", _blank('Store_name')),
+    ValidationRule('numeric', 'Weight_kg', 'warning', "Invalid weight format",
+                   _unparsable('Weight_kg', CatalogDataValidator.clean_weight_series)),
+    ValidationRule('numeric', 'Initial_KSP_Price', 'warning', "Invalid price format",
+                   _unparsable('Initial_KSP_Price', CatalogDataValidator.clean_price_series)),
+    ValidationRule('unique', 'SKU_ID_KSP', 'warning', "Duplicate Kaspi SKU code",
+                   _duplicated('SKU_ID_KSP')),
+    ValidationRule('referential', 'SKU_ID_KSP', 'warning',
+                   "Kaspi SKU code mapped to another SKU_ID in products", _ksp_conflicts),
+]
 
 
 class EnhancedCatalogParser:
@@ -138,6 +287,7 @@ class EnhancedCatalogParser:
         self.mapper = KaspiApiMapper()
         self.errors = []
         self.warnings = []
+        self.issues = pd.DataFrame(columns=ISSUE_COLUMNS)
     
     def load_catalog(self) -> pd.DataFrame:
         """Load and validate catalog CSV"""
@@ -146,90 +296,117 @@ class EnhancedCatalogParser:
         
         logger.info(f"Loading catalog from {CATALOG_PATH}")
         
-        try:
-            # Load with proper handling of semicolon separator
-            df = pd.read_csv(
-                CATALOG_PATH, 
-                sep=';', 
-                engine='python', 
-                dtype=str, 
-                on_bad_lines='skip'
-            )
-            
-            # Clean column names
-            df.columns = [col.strip() for col in df.columns]
-            
-            logger.info(f"Loaded {len(df)} rows from catalog")
-            return df
-            
-        except Exception as e:
-            logger.error(f"Error loading catalog: {e}")
-            raise
+        df = load_catalog(CATALOG_PATH)
+        logger.info(f"Loaded {len(df)} rows from catalog")
+        return df
     
-    def validate_catalog(self, df: pd.DataFrame) -> Tuple[pd.DataFrame, List[str], List[str]]:
-        """Validate catalog data and return cleaned DataFrame with errors/warnings"""
-        cleaned_df = df.copy()
-        errors = []
-        warnings = []
-        
-        # Required columns check
-        required_cols = ['SKU_ID', 'Store_name']
-        missing_cols = [col for col in required_cols if col not in df.columns]
+    def load_known_products(self) -> pd.DataFrame:
+        """(sku_id, sku_id_ksp) pairs already in the products table, for referential rules"""
+        con = sqlite3.connect(DB_PATH)
+        try:
+            return pd.read_sql("SELECT sku_id, sku_id_ksp FROM products", con)
+        except pd.errors.DatabaseError:
+            logger.warning("products table not found – referential rules skipped")
+            return pd.DataFrame(columns=['sku_id', 'sku_id_ksp'])
+        finally:
+            con.close()
+
+    def validate_catalog(self, df: pd.DataFrame,
+                         products: Optional[pd.DataFrame] = None) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """Run CATALOG_RULES over whole columns.
+
+        Returns the rows without errors and an issues frame with one record per
+        (row, rule) violation; rows with warnings are kept.
+        """
+        missing_cols = [col for col in REQUIRED_COLUMNS if col not in df.columns]
         if missing_cols:
-            errors.append(f"Missing required columns: {missing_cols}")
-            return cleaned_df, errors, warnings
-        
-        # Validate each row
-        valid_rows = []
-        for idx, row in df.iterrows():
-            row_errors = []
-            row_warnings = []
-            
-            # SKU ID validation
-            if not self.validator.validate_sku_id(row.get('SKU_ID')):
-                row_errors.append(f"Row {idx}: Invalid SKU_ID")
+            issues = pd.DataFrame({
+                'row': pd.array([pd.NA] * len(missing_cols), dtype='Int64'),
+                'column': missing_cols,
+                'rule': 'required_column',
+                'severity': 'error',
+                'value': None,
+                'message': 'Missing required column',
+            }, columns=ISSUE_COLUMNS)
+            self._record_issues(issues)
+            return df.copy(), issues
+
+        if products is None:
+            products = self.load_known_products()
+
+        frames = []
+        for rule in CATALOG_RULES:
+            if rule.column not in df.columns:
                 continue
-            
-            # Weight validation
-            weight = self.validator.clean_weight(row.get('Weight_kg'))
-            if weight is None and row.get('Weight_kg'):
-                row_warnings.append(f"Row {idx}: Invalid weight format: {row.get('Weight_kg')}")
-            
-            # Price validation
-            price = self.validator.clean_price(row.get('Initial_KSP_Price'))
-            if price is None and row.get('Initial_KSP_Price'):
-                row_warnings.append(f"Row {idx}: Invalid price format: {row.get('Initial_KSP_Price')}")
-            
-            # Store validation
-            store = self.validator.clean_text_field(row.get('Store_name'))
-            if not store:
-                row_warnings.append(f"Row {idx}: Missing store name")
-            
-            if row_errors:
-                errors.extend(row_errors)
-            else:
-                valid_rows.append(idx)
-                if row_warnings:
-                    warnings.extend(row_warnings)
-        
-        # Filter to valid rows only
-        cleaned_df = df.loc[valid_rows].copy()
-        
-        logger.info(f"Validation complete: {len(valid_rows)} valid rows, {len(errors)} errors, {len(warnings)} warnings")
-        
-        return cleaned_df, errors, warnings
+            mask = rule.check(df, products).fillna(False).astype(bool)
+            if not mask.any():
+                continue
+            rows = df.index[mask.to_numpy()]
+            frames.append(pd.DataFrame({
+                'row': rows,
+                'column': rule.column,
+                'rule': rule.name,
+                'severity': rule.severity,
+                'value': df.loc[rows, rule.column].to_numpy(),
+                'message': rule.message,
+            }, columns=ISSUE_COLUMNS))
+
+        issues = (pd.concat(frames, ignore_index=True) if frames
+                  else pd.DataFrame(columns=ISSUE_COLUMNS))
+        issues['row'] = issues['row'].astype('Int64')
+        self._record_issues(issues)
+
+        error_rows = issues.loc[issues['severity'] == 'error', 'row'].unique()
+        cleaned_df = df.drop(index=error_rows).copy()
+
+        logger.info(f"Validation complete: {len(cleaned_df)} valid rows, "
+                    f"{len(self.errors)} errors, {len(self.warnings)} warnings")
+        return cleaned_df, issues
+
+    def _record_issues(self, issues: pd.DataFrame) -> None:
+        """Keep the issues frame plus message lists for the report"""
+        self.issues = issues
+        cols = [issues[c].tolist() for c in ('row', 'message', 'column', 'value', 'severity')]
+        messages = [(f"Row {row}: {message} ({column}={value})", severity)
+                    for row, message, column, value, severity in zip(*cols)]
+        self.errors = [m for m, severity in messages if severity == 'error']
+        self.warnings = [m for m, severity in messages if severity == 'warning']
+
+    def save_issues(self, issues: pd.DataFrame) -> None:
+        """Replace the catalog_issues table with this run's issues"""
+        db_issues = issues.assign(value=issues['value'].astype('string'),
+                                  checked_at=pd.Timestamp.now().isoformat(timespec='seconds'))
+        con = sqlite3.connect(DB_PATH)
+        try:
+            db_issues.to_sql("catalog_issues", con, if_exists='replace', index=False)
+            con.execute("CREATE INDEX IF NOT EXISTS idx_catalog_issues_rule "
+                        "ON catalog_issues(severity, rule)")
+            logger.info(f"Saved {len(db_issues)} issues to database table 'catalog_issues'")
+        finally:
+            con.close()
     
-    def prepare_for_api(self, df: pd.DataFrame) -> List[Dict]:
-        """Prepare catalog data for Kaspi API calls"""
-        api_products = []
-        
-        for _, row in df.iterrows():
-            try:
-                api_data = self.mapper.map_to_api_format(row)
-                if api_data.get('merchantProductId'):  # Must have product ID
-                    api_products.append(api_data)
-            except Exception as e:
-                logger.warning(f"Error mapping row to API format: {e}")
+    def save_rejects(self, df: pd.DataFrame, issues: pd.DataFrame) -> None:
+        """Quarantine malformed lines and the rows dropped for validation errors"""
+        source = CATALOG_PATH.name
+        lines = source_lines(CATALOG_PATH)
+        errors = issues[issues['severity'].eq('error') & issues['row'].notna()]
+        con = sqlite3.connect(DB_PATH)
+        try:
+            clear_rejects(con, 'enhanced_catalog_parser', source)
+            reject_lines(con, 'enhanced_catalog_parser', source, rejected_lines(CATALOG_PATH))
+            for (column, message), rows in errors.groupby(['column', 'message'], sort=False)['row']:
+                mask = pd.Series(df.index.isin(rows), index=df.index)
+                reject_rows(con, 'enhanced_catalog_parser', source, df, mask,
+                            f"{message} ({column})", lines)
+            con.commit()
+        finally:
+            con.close()
+    
+    def prepare_for_api(self, df: pd.DataFrame) -> pd.Series:
+        """Prepare catalog data for Kaspi API calls: one JSON payload per row"""
+        api_df = self.mapper.map_frame(df)
+        api_df = api_df[api_df['merchantProductId'].ne('')]  # Must have product ID
+        api_products = encode_records(api_df)
         
         logger.info(f"Prepared {len(api_products)} products for API")
         return api_products
@@ -239,18 +416,15 @@ class EnhancedCatalogParser:
         # Clean data for database
         db_df = df.copy()
         
-        # Apply data cleaning
-        for col in ['Weight_kg']:
-            if col in db_df.columns:
-                db_df[f'{col}_cleaned'] = db_df[col].apply(self.validator.clean_weight)
-        
-        for col in ['Initial_KSP_Price']:
-            if col in db_df.columns:
-                db_df[f'{col}_cleaned'] = db_df[col].apply(self.validator.clean_price)
-        
-        for col in ['Stock_entered']:
+        # Apply data cleaning (whole columns at once)
+        cleaners = {
+            'Weight_kg': self.validator.clean_weight_series,
+            'Initial_KSP_Price': self.validator.clean_price_series,
+            'Stock_entered': self.validator.clean_stock_series,
+        }
+        for col, clean in cleaners.items():
             if col in db_df.columns:
-                db_df[f'{col}_cleaned'] = db_df[col].apply(self.validator.clean_stock)
+                db_df[f'{col}_cleaned'] = clean(db_df[col])
         
         # Save to database
         con = sqlite3.connect(DB_PATH)
@@ -260,7 +434,7 @@ class EnhancedCatalogParser:
         finally:
             con.close()
     
-    def generate_report(self, df: pd.DataFrame, api_products: List[Dict]) -> Dict:
+    def generate_report(self, df: pd.DataFrame, api_products: pd.Series) -> Dict:
         """Generate processing report"""
         report = {
             'total_products': len(df),
@@ -271,12 +445,18 @@ class EnhancedCatalogParser:
             'products_with_stock': df['Stock_entered'].notna().sum(),
             'errors': self.errors,
             'warnings': self.warnings,
+            'issues_by_rule': self.issues.groupby(['severity', 'rule', 'column']).size().to_dict(),
         }
         return report
 
 
 def main():
     """Main processing function"""
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--outbox", type=pathlib.Path,
+                    help="append the API payloads to this NDJSON file")
+    args = ap.parse_args()
+    
     logger.info("🚀 Starting enhanced catalog processing")
     
     parser = EnhancedCatalogParser()
@@ -286,15 +466,19 @@ def main():
         df = parser.load_catalog()
         
         # Validate data
-        cleaned_df, errors, warnings = parser.validate_catalog(df)
-        parser.errors = errors
-        parser.warnings = warnings
+        cleaned_df, issues = parser.validate_catalog(df)
+        parser.save_issues(issues)
+        parser.save_rejects(df, issues)
+        errors, warnings = parser.errors, parser.warnings
+        
+        if (issues['rule'] == 'required_column').any():
+            logger.error(f"❌ Catalog is missing required columns: {issues['column'].tolist()}")
+            return
         
         if errors:
-            logger.error(f"❌ Validation errors found: {len(errors)}")
+            logger.error(f"❌ Validation errors found: {len(errors)} (rows skipped)")
             for error in errors[:5]:  # Show first 5 errors
                 logger.error(f"  {error}")
-            return
         
         if warnings:
             logger.warning(f"⚠️ Validation warnings: {len(warnings)}")
@@ -303,6 +487,8 @@ def main():
         
         # Prepare API data
         api_products = parser.prepare_for_api(cleaned_df)
+        if args.outbox:
+            write_ndjson(api_products, args.outbox)
         
         # Save to database
         parser.save_to_database(cleaned_df)
@@ -323,8 +509,10 @@ def main():
         for store, count in report['products_by_store'].items():
             print(f"   {store}: {count}")
         
-        if warnings:
-            print(f"\n⚠️ Warnings: {len(warnings)}")
+        if errors or warnings:
+            print(f"\n⚠️ Issues (see catalog_issues): {len(errors)} errors, {len(warnings)} warnings")
+            for (severity, rule, column), count in report['issues_by_rule'].items():
+                print(f"   {severity:<8} {rule:<12} {column}: {count}")
         
         logger.info("🎉 Enhanced catalog processing completed successfully")
         
@@ -1,16 +1,25 @@
 #!/usr/bin/env python3
 # --- ETL FOR KASPI CATALOG API (v2025‑08‑05) --------------------------------
+import asyncio
+from contextlib import AsyncExitStack
 import pandas as pd
 import sqlite3
 import pathlib
 import httpx
 import os
 from dotenv import load_dotenv
-from tenacity import retry, stop_after_attempt, wait_exponential
+from tenacity import AsyncRetrying, retry_if_exception, stop_after_attempt
 import json
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Union
 import logging
 
+import product_sync
+from api_payloads import encode_records
+from catalog_loader import load_products
+from kaspi_cache import HttpCache
+from kaspi_stores import SyncProgress, assign_stores, store_credentials, store_label
+from kaspi_rate import RateController, is_retryable, wait_retry_after
+
 # Load environment variables
 load_dotenv()
 
@@ -22,48 +31,149 @@ CATALOG_PATH = RAW_DIR / "M02_SKU_CATALOG Sample for gpt.csv"
 # API Configuration
 BASE_URL = "https://kaspi.kz/shop/api/v2"
 KASPI_TOKEN = os.getenv("KASPI_TOKEN")
+MAX_ATTEMPTS = 6
+WRITE_BATCH = 200  # products rows per DB write while POSTs are in flight
+PROGRESS_INTERVAL = 10.0  # seconds between progress lines during a sync
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+_DEFAULT_CACHE = object()  # KaspiAPI(cache=None) disables caching; omitted → a new HttpCache
+
 class KaspiAPI:
-    def __init__(self, token: str, base_url: str = BASE_URL):
+    def __init__(self, token: str, base_url: str = BASE_URL,
+                 rate: Optional[RateController] = None, cache: Optional[HttpCache] = _DEFAULT_CACHE):
         self.token = token
         self.base_url = base_url
         self.headers = {
             "X-Auth-Token": token,
             "Content-Type": "application/json"
         }
-    
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
+        # Shared by every call on this client so bulk jobs back off together
+        self.rate = rate or RateController()
+        self.cache = HttpCache() if cache is _DEFAULT_CACHE else cache
+        self._client: Optional[httpx.AsyncClient] = None
+
+    async def __aenter__(self) -> "KaspiAPI":
+        """Reuse one pooled connection set for every call inside `async with`"""
+        self._client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=int(self.rate.max_limit),
+                                max_keepalive_connections=int(self.rate.max_limit))
+        )
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self._client.aclose()
+        self._client = None
+
+    async def _send(self, method: str, url: str, **kwargs) -> httpx.Response:
+        if self._client is not None:
+            return await self._client.request(method, url, **kwargs)
+        async with httpx.AsyncClient() as client:
+            return await client.request(method, url, **kwargs)
+
+    async def _request(self, method: str, path: str, cacheable: bool = False, **kwargs) -> httpx.Response:
+        """Send one request through the rate controller, retrying throttling/5xx.
+
+        cacheable GETs are served from / revalidated against the on-disk cache.
+        """
+        url = f"{self.base_url}{path}"
+        headers = self.headers
+        key = entry = None
+        if cacheable and self.cache is not None:
+            request = httpx.Request(method, url, params=kwargs.get("params"))
+            key = self.cache.key(self.token, request)
+            entry = self.cache.get(key)
+            if entry is not None:
+                if self.cache.is_fresh(entry):
+                    self.cache.stats["hits"] += 1
+                    return entry.to_response(request)
+                headers = {**self.headers, **entry.conditional_headers()}
+
+        retrying = AsyncRetrying(
+            stop=stop_after_attempt(MAX_ATTEMPTS),
+            wait=wait_retry_after,
+            retry=retry_if_exception(is_retryable),
+            reraise=True,
+        )
+        async for attempt in retrying:
+            with attempt:
+                async with self.rate.slot() as outcome:
+                    try:
+                        response = await self._send(
+                            method,
+                            url,
+                            headers=headers,
+                            timeout=30.0,
+                            **kwargs
+                        )
+                    except httpx.TransportError as e:
+                        outcome.record_error(e)
+                        raise
+                    outcome.record_response(response)
+
+                if response.status_code == 304 and entry is not None:
+                    self.cache.stats["revalidated"] += 1
+                    self.cache.touch(key)
+                    return entry.to_response(response.request)
+                response.raise_for_status()
+                if key is not None:
+                    self.cache.stats["misses"] += 1
+                    self.cache.store(key, response)
+                return response
+
     async def get_products(self) -> List[Dict]:
         """GET /shop/api/v2/products to verify token and get existing products"""
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{self.base_url}/products",
-                headers=self.headers,
-                timeout=30.0
-            )
-            response.raise_for_status()
-            data = response.json()
-            logger.info(f"✅ Retrieved {len(data.get('data', []))} products from Kaspi API")
-            return data.get('data', [])
+        response = await self._request("GET", "/products", cacheable=True)
+        data = response.json()
+        cached = f" ({self.cache.summary()})" if self.cache is not None else ""
+        logger.info(f"✅ Retrieved {len(data.get('data', []))} products from Kaspi API{cached}")
+        return data.get('data', [])
     
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
-    async def create_product(self, product_data: Dict) -> Dict:
-        """POST /shop/api/v2/products/create for new/changed SKUs"""
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{self.base_url}/products/create",
-                headers=self.headers,
-                json=product_data,
-                timeout=30.0
-            )
-            response.raise_for_status()
-            data = response.json()
+    async def create_product(self, product_data: Union[Dict, str, bytes]) -> Dict:
+        """POST /shop/api/v2/products/create for new/changed SKUs
+
+        Accepts a payload dict or an already encoded JSON body (see api_payloads).
+        """
+        if isinstance(product_data, dict):
+            response = await self._request("POST", "/products/create", json=product_data)
             logger.info(f"✅ Created product: {product_data.get('name', 'Unknown')}")
-            return data
+        else:
+            response = await self._request("POST", "/products/create", content=product_data)
+        return response.json()
+
+    async def get_orders(self, params: Dict) -> Dict:
+        """GET /shop/api/v2/orders – one page of orders (full JSON:API document)"""
+        response = await self._request("GET", "/orders", params=params)
+        return response.json()
+
+    async def get_order_entries(self, order_id: str) -> List[Dict]:
+        """GET /shop/api/v2/orders/{id}/entries – line items of one order"""
+        response = await self._request("GET", f"/orders/{order_id}/entries")
+        return response.json().get('data', [])
+
+    async def update_order_status(self, order_id: str, code: str, status: str,
+                                  **attributes) -> Dict:
+        """POST /shop/api/v2/orders – move one order to a new status
+
+        Extra attributes go into the JSON:API body as-is (numberOfSpace for
+        ASSEMBLE, cancellationReason for CANCELLED).
+        """
+        body = {
+            "data": {
+                "type": "orders",
+                "id": order_id,
+                "attributes": {"code": code, "status": status, **attributes},
+            }
+        }
+        response = await self._request("POST", "/orders", json=body)
+        return response.json() if response.content else {}
+
+    async def get_order_label(self, order_id: str) -> bytes:
+        """GET /shop/api/v2/orders/{id}/label – Kaspi Delivery label PDF"""
+        response = await self._request("GET", f"/orders/{order_id}/label")
+        return response.content
 
 def load_catalog_csv() -> pd.DataFrame:
     """Load and parse the M02_SKU_CATALOG CSV file"""
@@ -72,24 +182,7 @@ def load_catalog_csv() -> pd.DataFrame:
         return pd.DataFrame()
     
     try:
-        df = pd.read_csv(CATALOG_PATH, sep=';', engine='python', dtype=str, on_bad_lines='skip')
-        
-        # Clean and standardize column names
-        df.columns = [col.strip() for col in df.columns]
-        
-        # Select and rename relevant columns for new catalog format
-        catalog_df = df[[
-            'SKU_ID', 'Kaspi_name_core', 'MY_SIZE', 'Size_kaspi', 'Kaspi_art_1',
-            'SKU_ID_KSP', 'Kaspi_name_source', 'Initial_KSP_Price', 'Stock_entered',
-            'SKU_key', 'Secondary', 'Product_Type', 'Sub_Category', 'Brend',
-            'Model', 'Color', 'Our_Size', 'Gender', 'Season', 'BaseCost_CNY', 'Weight_kg',
-            'Store_name', 'Kaspi_art_2'
-        ]].copy()
-        
-        # Clean data
-        catalog_df = catalog_df.fillna('')
-        catalog_df['Weight_kg'] = pd.to_numeric(catalog_df['Weight_kg'].str.replace(',', '.'), errors='coerce')
-        
+        catalog_df = load_products(CATALOG_PATH)
         logger.info(f"✅ Loaded {len(catalog_df)} products from catalog CSV")
         return catalog_df
     
@@ -98,176 +191,243 @@ def load_catalog_csv() -> pd.DataFrame:
         return pd.DataFrame()
 
 def create_products_table():
-    """Create the products table in SQLite database"""
+    """Create the products table in SQLite database (see product_sync for the schema)"""
     con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
-    
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS products (
-        sku_id              TEXT PRIMARY KEY,
-        kaspi_name_core     TEXT,
-        my_size             TEXT,
-        size_kaspi          TEXT,
-        kaspi_art_1         TEXT,
-        sku_id_ksp          TEXT,
-        kaspi_name_source   TEXT,
-        initial_ksp_price   TEXT,
-        stock_entered       INTEGER,
-        sku_key             TEXT,
-        secondary           TEXT,
-        product_type        TEXT,
-        sub_category        TEXT,
-        brand               TEXT,
-        model               TEXT,
-        color               TEXT,
-        our_size            TEXT,
-        gender              TEXT,
-        season              TEXT,
-        base_cost_cny       REAL,
-        weight_kg           REAL,
-        store_name          TEXT,
-        kaspi_art_2         TEXT,
-        kaspi_product_id    TEXT,
-        last_updated        TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    );
-    """)
-    
-    con.commit()
-    con.close()
+    try:
+        product_sync.create_products_table(con)
+    finally:
+        con.close()
     logger.info("✅ Products table created/verified")
 
-def save_to_database(catalog_df: pd.DataFrame, kaspi_products: List[Dict]):
-    """Save catalog data and Kaspi API data to database"""
-    con = sqlite3.connect(DB_PATH)
-    
-    # Create a mapping of Kaspi product codes to product IDs
-    kaspi_mapping = {}
-    for product in kaspi_products:
-        code = product.get('code')
-        if code:
-            kaspi_mapping[code] = product.get('id')
-    
-    # Add Kaspi product ID to catalog data
-    catalog_df['kaspi_product_id'] = catalog_df['Kaspi_art_1'].map(kaspi_mapping)
-    
-    # Rename columns to match database schema
-    catalog_df = catalog_df.rename(columns={
-        'SKU_ID': 'sku_id',
-        'Kaspi_name_core': 'kaspi_name_core',
-        'MY_SIZE': 'my_size',
-        'Size_kaspi': 'size_kaspi',
-        'Kaspi_art_1': 'kaspi_art_1',
-        'SKU_ID_KSP': 'sku_id_ksp',
-        'Kaspi_name_source': 'kaspi_name_source',
-        'Initial_KSP_Price': 'initial_ksp_price',
-        'Stock_entered': 'stock_entered',
-        'SKU_key': 'sku_key',
-        'Secondary': 'secondary',
-        'Product_Type': 'product_type',
-        'Sub_Category': 'sub_category',
-        'Brend': 'brand',
-        'Model': 'model',
-        'Color': 'color',
-        'Our_Size': 'our_size',
-        'Gender': 'gender',
-        'Season': 'season',
-        'BaseCost_CNY': 'base_cost_cny',
-        'Weight_kg': 'weight_kg',
-        'Store_name': 'store_name',
-        'Kaspi_art_2': 'kaspi_art_2'
-    })
-    
-    # Convert stock_entered to numeric
-    catalog_df['stock_entered'] = pd.to_numeric(catalog_df['stock_entered'], errors='coerce').fillna(0).astype(int)
-    catalog_df['base_cost_cny'] = pd.to_numeric(catalog_df['base_cost_cny'], errors='coerce')
-    
-    # Save to database
-    catalog_df.to_sql("products", con, if_exists='replace', index=False)
-    con.close()
-    
-    logger.info(f"✅ Saved {len(catalog_df)} products to database")
-
-def prepare_product_for_api(row: pd.Series) -> Dict:
-    """Prepare a catalog row for Kaspi API product creation"""
-    # Basic product structure for Kaspi API
-    product_data = {
-        "name": row['kaspi_name_core'] if row['kaspi_name_core'] else row['sku_id'],
-        "code": row['kaspi_art_1'],
-        "description": f"{row['brand']} {row['model']} {row['color']} {row['our_size']}",
-        "category": row['product_type'],
-        "brand": row['brand'],
-        "model": row['model'],
-        "color": row['color'],
-        "size": row['our_size'],
-        "gender": row['gender'],
-        "season": row['season'],
-        "weight": float(row['weight_kg']) if pd.notna(row['weight_kg']) else 0.0
-    }
+def load_and_diff_catalog():
+    """Blocking half of the pipeline: table setup, CSV parse, hashing and diff
+
+    Returns (catalog_df, products, status, deleted); catalog_df is empty on failure.
+    """
+    create_products_table()
+    catalog_df = load_catalog_csv()
+    if catalog_df.empty:
+        return catalog_df, None, None, []
     
-    # Remove None/empty values
-    return {k: v for k, v in product_data.items() if v and v != ''}
+    products = product_sync.prepare_products(catalog_df)
+    con = sqlite3.connect(DB_PATH)
+    try:
+        status, deleted = product_sync.diff_products(con, products)
+        product_sync.reject_dropped(con, 'etl_catalog_api', catalog_df, products, CATALOG_PATH)
+        con.commit()
+    finally:
+        con.close()
+    return catalog_df, products, status, deleted
+
+def write_product_rows(rows: pd.DataFrame) -> None:
+    """Upsert one batch of products rows on its own connection (runs in a worker thread)"""
+    con = sqlite3.connect(DB_PATH)
+    try:
+        product_sync.write_products(con, rows, [])
+        con.commit()
+    finally:
+        con.close()
+
+def remove_and_refresh(products: pd.DataFrame, status: pd.Series, deleted: List[str]) -> None:
+    """Delete vanished listings and refresh Kaspi ids on unchanged rows
+    (ids are not part of the hash)"""
+    known = products[status.eq('unchanged') & products['kaspi_product_id'].notna()]
+    con = sqlite3.connect(DB_PATH)
+    try:
+        product_sync.write_products(con, products.iloc[:0], deleted)
+        con.executemany(
+            "UPDATE products SET kaspi_product_id=? WHERE product_key=? AND kaspi_product_id IS NOT ?",
+            [(i, k, i) for k, i in zip(known['product_key'], known['kaspi_product_id'])])
+        con.commit()
+    finally:
+        con.close()
+
+async def write_in_batches(queue: asyncio.Queue, products: pd.DataFrame) -> int:
+    """Drain row labels from `queue` (None ends) and write them WRITE_BATCH at a time
+    off the event loop, so the DB keeps up while later POSTs are still in flight"""
+    written = 0
+    pending: List = []
+    done = False
+    while not done:
+        label = await queue.get()
+        if label is None:
+            done = True
+        else:
+            pending.append(label)
+        # Take whatever else has completed meanwhile
+        while not done and not queue.empty() and len(pending) < WRITE_BATCH:
+            label = queue.get_nowait()
+            if label is None:
+                done = True
+            else:
+                pending.append(label)
+        if pending and (done or len(pending) >= WRITE_BATCH):
+            await asyncio.to_thread(write_product_rows, products.loc[pending])
+            written += len(pending)
+            pending = []
+    return written
+
+def prepare_products_for_api(catalog_df: pd.DataFrame) -> pd.DataFrame:
+    """Payload fields for Kaspi API product creation, one row per catalog row
+
+    Empty fields (and a zero/missing weight) are left out when encoded.
+    """
+    text = catalog_df.fillna('').astype(str)
+    name = text['Kaspi_name_core']
+    return pd.DataFrame({
+        "name": name.where(name.ne(''), text['SKU_ID']),
+        "code": text['Kaspi_art_1'],
+        "description": text['Brend'] + " " + text['Model'] + " " + text['Color'] + " " + text['Our_Size'],
+        "category": text['Product_Type'],
+        "brand": text['Brend'],
+        "model": text['Model'],
+        "color": text['Color'],
+        "size": text['Our_Size'],
+        "gender": text['Gender'],
+        "season": text['Season'],
+        "weight": catalog_df['Weight_kg'].where(catalog_df['Weight_kg'] > 0),
+    }, index=catalog_df.index)
 
 async def main():
-    """Main ETL process"""
-    if not KASPI_TOKEN:
-        logger.error("❌ KASPI_TOKEN not found in environment variables")
+    """Main ETL process
+
+    CSV parsing and the catalog diff run in a worker thread while every store's
+    product list is fetched. The diff is then partitioned by Store_name and each
+    store pushes through its own client (token and rate budget, see kaspi_stores)
+    concurrently; finished POSTs are written to the DB in batches by a single
+    writer while the rest are still in flight.
+    """
+    creds = store_credentials()
+    if not creds:
+        logger.error("❌ No Kaspi token found – set KASPI_TOKEN or KASPI_TOKEN_<STORE>")
         return
     
     logger.info("🚀 Starting Kaspi Catalog ETL process")
     
-    # 1. Create database table
-    create_products_table()
-    
-    # 2. Load catalog CSV
-    catalog_df = load_catalog_csv()
-    if catalog_df.empty:
-        logger.error("❌ No catalog data loaded")
-        return
-    
-    # 3. Initialize Kaspi API client
-    api = KaspiAPI(KASPI_TOKEN)
+    # 1. One Kaspi API client per store (one shared HTTP cache, keyed by token)
+    cache = HttpCache()
+    apis = {key: KaspiAPI(token, rate=rate, cache=cache) for key, (token, rate) in creds.items()}
+    logger.info(f"🏪 Stores with credentials: {', '.join(store_label(k) for k in apis)}")
+    progress = SyncProgress()
     
     try:
-        # 4. GET existing products from Kaspi API
-        logger.info("📡 Fetching existing products from Kaspi API...")
-        kaspi_products = await api.get_products()
-        
-        # 5. Compare and identify new/changed products
-        existing_codes = {p.get('code') for p in kaspi_products if p.get('code')}
-        new_products = []
-        
-        for _, row in catalog_df.iterrows():
-            kaspi_code = row['kaspi_art_1']
-            if kaspi_code and kaspi_code not in existing_codes:
-                product_data = prepare_product_for_api(row)
-                if product_data:
-                    new_products.append((row, product_data))
-        
-        logger.info(f"📊 Found {len(new_products)} new products to create")
-        
-        # 6. POST new products to Kaspi API
-        created_count = 0
-        for row, product_data in new_products:
+        async with AsyncExitStack() as stack:
+            for api in apis.values():
+                await stack.enter_async_context(api)
+            
+            # 2. Create table, load catalog CSV and diff it (thread) ∥ GET each store's products
+            # (a store whose listing fails is skipped this run; the others carry on)
+            async def list_store(key: str) -> Optional[List[Dict]]:
+                try:
+                    return await apis[key].get_products()
+                except Exception as e:
+                    logger.error(f"❌ Listing products failed [{store_label(key)}]: {e} – store skipped")
+                    return None
+            
+            logger.info("📡 Fetching existing products from Kaspi API...")
+            (catalog_df, products, status, deleted), *listed = await asyncio.gather(
+                asyncio.to_thread(load_and_diff_catalog), *(list_store(key) for key in apis))
+            failed_stores = [key for key, kaspi_products in zip(apis, listed) if kaspi_products is None]
+            if catalog_df.empty:
+                logger.error("❌ No catalog data loaded")
+                return
+            
+            counts = product_sync.summarize(status, deleted)
+            logger.info(f"📊 Catalog diff: {counts['new']} new, {counts['changed']} changed, "
+                        f"{counts['updated']} updated, {counts['deleted']} deleted, "
+                        f"{counts['unchanged']} unchanged")
+            
+            # 3. Partition by store; send changed listings, and new ones the store does not list yet
+            store = assign_stores(products['store_name'], apis)
+            codes = products['kaspi_art_1']
+            listed_in_store = pd.Series(False, index=products.index)
+            products['kaspi_product_id'] = None
+            for key, kaspi_products in zip(apis, listed):
+                if kaspi_products is None:
+                    continue
+                kaspi_mapping = {p.get('code'): p.get('id') for p in kaspi_products if p.get('code')}
+                in_store = store.eq(key)
+                products.loc[in_store, 'kaspi_product_id'] = codes[in_store].map(kaspi_mapping)
+                listed_in_store[in_store] = codes[in_store].isin(kaspi_mapping)
+            
+            wanted = codes.ne('') & (status.eq('changed') | (status.eq('new') & ~listed_in_store))
+            no_token = wanted & store.isna()
+            if no_token.any():
+                missing = sorted(products.loc[no_token, 'store_name'].replace('', '(blank)').unique())
+                logger.warning(f"⚠️ {int(no_token.sum())} listings not sent (kept for next run) – "
+                               f"no token for: {', '.join(missing)}")
+            unlisted = wanted & store.isin(failed_stores)
+            if unlisted.any():
+                logger.warning(f"⚠️ {int(unlisted.sum())} listings not sent (kept for next run) – "
+                               f"product list failed for: {', '.join(store_label(k) for k in failed_stores)}")
+            to_send = wanted & ~no_token & ~unlisted
+            new_products = prepare_products_for_api(catalog_df.loc[products.index[to_send]])
+            bodies = await asyncio.to_thread(encode_records, new_products)
+            
+            logger.info(f"📊 Found {len(new_products)} new/changed products to send")
+            
+            # 4. DB writer: rows that need no POST go first, the rest as their POST succeeds.
+            # Rows whose POST fails (or that have no token) are not written and keep their
+            # old hash (retried next run).
+            queue: asyncio.Queue = asyncio.Queue()
+            for label in products.index[status.ne('unchanged') & ~wanted]:
+                queue.put_nowait(label)
+            
+            async def write_all() -> int:
+                # One writer for every store keeps SQLite free of lock contention
+                await asyncio.to_thread(remove_and_refresh, products, status, deleted)
+                return await write_in_batches(queue, products)
+            
+            writer = asyncio.create_task(write_all())
+            
+            # 5. POST each store's products through its own client (concurrency set by its rate)
+            async def create(key: str, label, name: str, code: str, body: str) -> bool:
+                try:
+                    await apis[key].create_product(body.encode('utf-8'))
+                    logger.info(f"✅ Created product: {name} ({code}) [{store_label(key)}]")
+                    queue.put_nowait(label)
+                    progress.add(key, 'sent')
+                    return True
+                except Exception as e:
+                    logger.error(f"❌ Failed to create product {code} [{store_label(key)}]: {e}")
+                    progress.add(key, 'failed')
+                    return False
+            
+            async def push_store(key: str) -> List[bool]:
+                labels = new_products.index[store[new_products.index].eq(key)]
+                progress.add(key, 'to_send', len(labels))
+                return await asyncio.gather(*(
+                    create(key, label, name, code, body) for label, name, code, body
+                    in zip(labels, new_products.loc[labels, 'name'], new_products.loc[labels, 'code'],
+                           bodies[labels])))
+            
+            reporter = asyncio.create_task(progress.report_every(PROGRESS_INTERVAL))
             try:
-                await api.create_product(product_data)
-                created_count += 1
-                logger.info(f"✅ Created product: {product_data['name']} ({product_data['code']})")
-            except Exception as e:
-                logger.error(f"❌ Failed to create product {product_data['code']}: {e}")
-        
-        # 7. Save all data to database
-        logger.info("💾 Saving data to database...")
-        save_to_database(catalog_df, kaspi_products)
+                # One store's failure must not cancel the others' POSTs
+                results = []
+                pushed = await asyncio.gather(*(push_store(k) for k in apis), return_exceptions=True)
+                for key, store_results in zip(apis, pushed):
+                    if isinstance(store_results, Exception):
+                        logger.error(f"❌ Push failed [{store_label(key)}]: {store_results}")
+                        continue
+                    results.extend(store_results)
+            finally:
+                reporter.cancel()
+                queue.put_nowait(None)
+                written = await writer
         
+        created_count = sum(results)
         logger.info(f"🎉 ETL completed successfully!")
         logger.info(f"   - Catalog products: {len(catalog_df)}")
-        logger.info(f"   - Existing Kaspi products: {len(kaspi_products)}")
-        logger.info(f"   - New products created: {created_count}")
+        logger.info(f"   - Existing Kaspi products: {sum(len(p) for p in listed if p is not None)} in {len(apis)} store(s)")
+        logger.info(f"   - Products sent: {created_count} ok, {len(results) - created_count} failed")
+        if progress.stores:
+            logger.info("   - Per store:\n" + progress.summary())
+        logger.info(f"   - Products written: {written} ({len(deleted)} removed)")
         
     except Exception as e:
         logger.error(f"❌ ETL process failed: {e}")
         raise
 
 if __name__ == "__main__":
-    import asyncio
     asyncio.run(main())
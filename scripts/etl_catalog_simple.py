@@ -5,6 +5,9 @@ import sqlite3
 import pathlib
 import logging
 
+import product_sync
+from catalog_loader import load_products
+
 # Setup paths
 RAW_DIR = pathlib.Path(__file__).resolve().parents[1] / "data_raw"
 DB_PATH = pathlib.Path(__file__).resolve().parents[1] / "db" / "erp.db"
@@ -15,41 +18,12 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 logger = logging.getLogger(__name__)
 
 def create_products_table():
-    """Create the products table in SQLite database"""
+    """Create the products table in SQLite database (see product_sync for the schema)"""
     con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
-    
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS products (
-        sku_id              TEXT PRIMARY KEY,
-        kaspi_name_core     TEXT,
-        my_size             TEXT,
-        size_kaspi          TEXT,
-        kaspi_art_1         TEXT,
-        sku_id_ksp          TEXT,
-        kaspi_name_source   TEXT,
-        initial_ksp_price   TEXT,
-        stock_entered       INTEGER,
-        sku_key             TEXT,
-        secondary           TEXT,
-        product_type        TEXT,
-        sub_category        TEXT,
-        brand               TEXT,
-        model               TEXT,
-        color               TEXT,
-        our_size            TEXT,
-        gender              TEXT,
-        season              TEXT,
-        base_cost_cny       REAL,
-        weight_kg           REAL,
-        store_name          TEXT,
-        kaspi_art_2         TEXT,
-        last_updated        TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    );
-    """)
-    
-    con.commit()
-    con.close()
+    try:
+        product_sync.create_products_table(con)
+    finally:
+        con.close()
     logger.info("✅ Products table created/verified")
 
 def load_catalog_csv() -> pd.DataFrame:
@@ -59,24 +33,7 @@ def load_catalog_csv() -> pd.DataFrame:
         return pd.DataFrame()
     
     try:
-        df = pd.read_csv(CATALOG_PATH, sep=';', engine='python', dtype=str, on_bad_lines='skip')
-        
-        # Clean and standardize column names
-        df.columns = [col.strip() for col in df.columns]
-        
-        # Select and rename relevant columns for new catalog format
-        catalog_df = df[[
-            'SKU_ID', 'Kaspi_name_core', 'MY_SIZE', 'Size_kaspi', 'Kaspi_art_1',
-            'SKU_ID_KSP', 'Kaspi_name_source', 'Initial_KSP_Price', 'Stock_entered',
-            'SKU_key', 'Secondary', 'Product_Type', 'Sub_Category', 'Brend',
-            'Model', 'Color', 'Our_Size', 'Gender', 'Season', 'BaseCost_CNY', 'Weight_kg',
-            'Store_name', 'Kaspi_art_2'
-        ]].copy()
-        
-        # Clean data
-        catalog_df = catalog_df.fillna('')
-        catalog_df['Weight_kg'] = pd.to_numeric(catalog_df['Weight_kg'].str.replace(',', '.'), errors='coerce')
-        
+        catalog_df = load_products(CATALOG_PATH)
         logger.info(f"✅ Loaded {len(catalog_df)} products from catalog CSV")
         return catalog_df
     
@@ -85,45 +42,14 @@ def load_catalog_csv() -> pd.DataFrame:
         return pd.DataFrame()
 
 def save_to_database(catalog_df: pd.DataFrame):
-    """Save catalog data to database"""
+    """Save catalog data to database (only new/changed listings are written)"""
     con = sqlite3.connect(DB_PATH)
+    try:
+        counts = product_sync.sync_products(con, catalog_df, etl='etl_catalog_simple', path=CATALOG_PATH)
+    finally:
+        con.close()
     
-    # Rename columns to match database schema
-    catalog_df = catalog_df.rename(columns={
-        'SKU_ID': 'sku_id',
-        'Kaspi_name_core': 'kaspi_name_core',
-        'MY_SIZE': 'my_size',
-        'Size_kaspi': 'size_kaspi',
-        'Kaspi_art_1': 'kaspi_art_1',
-        'SKU_ID_KSP': 'sku_id_ksp',
-        'Kaspi_name_source': 'kaspi_name_source',
-        'Initial_KSP_Price': 'initial_ksp_price',
-        'Stock_entered': 'stock_entered',
-        'SKU_key': 'sku_key',
-        'Secondary': 'secondary',
-        'Product_Type': 'product_type',
-        'Sub_Category': 'sub_category',
-        'Brend': 'brand',
-        'Model': 'model',
-        'Color': 'color',
-        'Our_Size': 'our_size',
-        'Gender': 'gender',
-        'Season': 'season',
-        'BaseCost_CNY': 'base_cost_cny',
-        'Weight_kg': 'weight_kg',
-        'Store_name': 'store_name',
-        'Kaspi_art_2': 'kaspi_art_2'
-    })
-    
-    # Convert stock_entered to numeric
-    catalog_df['stock_entered'] = pd.to_numeric(catalog_df['stock_entered'], errors='coerce').fillna(0).astype(int)
-    catalog_df['base_cost_cny'] = pd.to_numeric(catalog_df['base_cost_cny'], errors='coerce')
-    
-    # Save to database
-    catalog_df.to_sql("products", con, if_exists='replace', index=False)
-    con.close()
-    
-    logger.info(f"✅ Saved {len(catalog_df)} products to database")
+    logger.info(f"✅ Saved {counts['new'] + counts['changed'] + counts['updated']} products to database")
 
 def show_summary(catalog_df: pd.DataFrame):
     """Show a summary of the catalog data"""
@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 # ----------  ETL FOR PURCHASE INQUIRY  ----------
 import pandas as pd, sqlite3, pathlib
+from rejects import clear_rejects, reject_rows
+from load_versions import record_load
 
 RAW_DIR = pathlib.Path(__file__).resolve().parents[1] / "data_raw"
 DB_PATH = pathlib.Path(__file__).resolve().parents[1] / "db" / "erp.db"
@@ -25,6 +27,7 @@ CREATE TABLE IF NOT EXISTS purchases (
 
 # 2 ──────────────────────────────────────────────────────────────────────────────
 # Process every Purchase‑Inquiry XLSX
+loaded = 0
 for fp in RAW_DIR.glob("Purchase inquiry*.xlsx"):
     df_raw = pd.read_excel(fp)
 
@@ -43,6 +46,7 @@ for fp in RAW_DIR.glob("Purchase inquiry*.xlsx"):
     df = df_raw.rename(columns=rename_map)
 
     # Convert dates safely
+    raw_dates = df[['order_date','arrival_date']].copy()
     df['order_date']   = pd.to_datetime(df['order_date'],   errors='coerce').dt.date
     df['arrival_date'] = pd.to_datetime(df['arrival_date'], errors='coerce').dt.date
 
@@ -51,8 +55,24 @@ for fp in RAW_DIR.glob("Purchase inquiry*.xlsx"):
             'qty','unit_cogs_kzt','freight_kzt','total_cogs_kzt']
     df = df[cols]
 
-    # Drop duplicate lines inside the same file
-    df = df.drop_duplicates(subset=['po_id','sku_key'])
+    # Rows we cannot load go to the rejects table with the supplier's original row.
+    # Rows without po_id / sku_key used to be appended: NULL never matches the
+    # per-key DELETE below, so each run added them again – they are rejected now
+    clear_rejects(con, 'etl_purchases', fp.name)
+    checks = [
+        (df['po_id'].isna() | df['sku_key'].isna(),                "missing po_id / sku_key"),
+        (raw_dates['order_date'].notna() & df['order_date'].isna(),     "unparsable order_date"),
+        (raw_dates['arrival_date'].notna() & df['arrival_date'].isna(), "unparsable arrival_date"),
+    ]
+    bad = pd.Series(False, index=df.index)
+    for mask, reason in checks:
+        reject_rows(con, 'etl_purchases', fp.name, df_raw, mask & ~bad, reason)
+        bad |= mask
+
+    # Duplicate lines inside the same file: the first one is loaded
+    duplicated = ~bad & df[~bad].duplicated(subset=['po_id','sku_key']).reindex(df.index, fill_value=False)
+    reject_rows(con, 'etl_purchases', fp.name, df_raw, duplicated, "duplicate (po_id, sku_key) in file")
+    df = df[~(bad | duplicated)]
 
     # UPSERT: delete old rows for these (po_id, sku_key) pairs then insert
     ids = list(df[['po_id','sku_key']].itertuples(index=False, name=None))
@@ -62,7 +82,9 @@ for fp in RAW_DIR.glob("Purchase inquiry*.xlsx"):
             ids
         )
     df.to_sql("purchases", con, if_exists='append', index=False)
+    loaded += len(df)
 
+record_load(con, "purchases", rows=loaded)
 con.commit()
 con.close()
 print("✅  Purchases loaded")
\ No newline at end of file
@@ -1,44 +1,25 @@
 #!/usr/bin/env python3
 # --- ETL FOR KASPI ORDERS  (v2025‑08‑03) -----------------------------------
 import pandas as pd, sqlite3, pathlib, re
+from sku_mapping import load_sku_map, map_order_lines
+from rejects import clear_rejects, reject_rows
+from order_queries import create_order_indexes
+from load_versions import record_load
 
 RAW_DIR  = pathlib.Path(__file__).resolve().parents[1] / "data_raw"
 DB_PATH  = pathlib.Path(__file__).resolve().parents[1] / "db" / "erp.db"
-MAP_PATH = RAW_DIR / "M02_SKU_CATALOG Sample for gpt.csv"
 
 # 0 ── Load SKU mapping (semicolon CSV, robust) ──────────────────────────────
-if MAP_PATH.exists():
-    map_df = (
-        pd.read_csv(MAP_PATH, sep=';', engine='python', dtype=str,
-                    on_bad_lines='skip')
-        .rename(columns={'SKU_key':'sku_key',
-                         'Weight_kg':'weight_kg',
-                         'sku_name_raw':'sku_name_raw'})
-        .assign(
-            sku_name_raw=lambda d: d['sku_name_raw'].str.strip(),
-            weight_g=lambda d: pd.to_numeric(
-                d['weight_kg'].str.replace(',', '.'),
-                errors='coerce') * 1000
-        )[["sku_name_raw","sku_key","weight_g"]]
-    )
-else:
-    map_df = pd.DataFrame(columns=["sku_name_raw","sku_key","weight_g"])
-
-# 1 ── Delivery‑fee calculator ───────────────────────────────────────────────
-def calc_delivery(row):
-    price = row["gross_price_kzt"]
-    kg    = row.get("weight_g", 0) / 1000 if pd.notna(row.get("weight_g")) else 0
-    base = 0 if price >= 15000 else 699 if price >= 10000 else 799 if price >= 5000 else 999
-    extra = max(0, int(-(-kg // 1)) - 3) * 399   # charges after 3 kg
-    return base + extra
-
-# 2 ── Read every *orders*.xlsx ──────────────────────────────────────────────
+map_df = load_sku_map()
+
+# 1 ── Read every *orders*.xlsx ──────────────────────────────────────────────
 def order_files():
     for fp in RAW_DIR.iterdir():
         if "orders" in fp.name.lower() and fp.suffix.lower()==".xlsx":
             yield fp
 
 frames=[]
+con=sqlite3.connect(DB_PATH)   # rejects are written per file as it is read
 for fp in order_files():
     df = pd.read_excel(fp)
 
@@ -56,25 +37,73 @@ for fp in order_files():
     df=df[['order_id','order_date','status_date','status',
            'sku_name_raw','qty','gross_price_kzt']]
 
+    raw=df.copy()
     df['order_date']=pd.to_datetime(df['order_date'],dayfirst=True,errors='coerce').dt.date
     df['status_date']=pd.to_datetime(df['status_date'],dayfirst=True,errors='coerce').dt.date
-    df['kaspi_fee_pct']=0.12
-    df['sku_name_raw']=df['sku_name_raw'].astype(str).str.strip()
 
-    df=df.merge(map_df,on='sku_name_raw',how='left')
-    df['sku_key']=df['sku_key'].fillna(df['sku_name_raw'].str.upper())
-    df['delivery_cost_kzt']=df.apply(calc_delivery,axis=1)
+    # Dates that were present but did not parse → quarantine, don't load as NULL
+    clear_rejects(con,'etl_sales',fp.name)
+    bad=pd.Series(False,index=df.index)
+    for col in ['order_date','status_date']:
+        unparsable=raw[col].notna() & df[col].isna() & ~bad
+        reject_rows(con,'etl_sales',fp.name,raw,unparsable,f"unparsable {col}")
+        bad|=unparsable
+    con.commit()
+    df=map_order_lines(df[~bad],map_df)
 
     frames.append(df)
 
 if not frames:
+    con.close()
     raise SystemExit("⚠️  No *orders* files found in data_raw/")
 
 orders=pd.concat(frames,ignore_index=True)
 
-# 3 ── Write / replace table ────────────────────────────────────────────────
-sqlite3.connect(DB_PATH).execute("DROP TABLE IF EXISTS orders;").close()
-con=sqlite3.connect(DB_PATH)
-orders.to_sql("orders",con,if_exists='replace',index=False)
+# 2 ── Upsert per order_id ──────────────────────────────────────────────────
+# Lines of the exported orders are replaced; orders the exports don't contain stay.
+# Orders tracked by kaspi_orders_poller (kaspi_orders) keep the poller's lines
+# unless the export's status_date is newer, so an older export never reverts them
+def day_hashes(frame):
+    rows=frame.astype(object).where(frame.notna(),None).astype(str)
+    return pd.util.hash_pandas_object(rows,index=False).groupby(rows['order_date'].values).sum()
+
+def table_exists(name):
+    return con.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?",(name,)).fetchone() is not None
+
+if table_exists('kaspi_orders') and table_exists('orders'):
+    polled=pd.read_sql("SELECT order_id, MAX(status_date) AS status_date FROM orders "
+                       "WHERE order_id IN (SELECT order_id FROM kaspi_orders) GROUP BY order_id",con)
+    polled_date=orders['order_id'].map(polled.set_index('order_id')['status_date'])
+    newer=orders['status_date'].notna() & (orders['status_date'].astype(str)>polled_date.astype(str))
+    skipped=polled_date.notna() & ~newer
+    if skipped.any():
+        print(f"↩️  {orders.loc[skipped,'order_id'].nunique():,} orders kept from the API poller")
+    orders=orders[~skipped]
+
+# Earliest day whose lines differ from the loaded ones: dashboard caches keep the days
+# before it, and a reload that changes nothing leaves the load version alone
+changed,changed_from=True,None
+con.execute("CREATE TEMP TABLE export_ids (order_id PRIMARY KEY)")
+con.executemany("INSERT OR IGNORE INTO export_ids VALUES (?)",((i,) for i in orders['order_id'].unique().tolist()))
+if table_exists('orders'):
+    create_order_indexes(con)
+    try:
+        old=pd.read_sql(f"SELECT {', '.join(orders.columns)} FROM orders "
+                        f"WHERE order_id IN (SELECT order_id FROM export_ids)",con)
+    except pd.errors.DatabaseError:   # columns changed – rebuild the table
+        old=None
+        con.execute("DROP TABLE orders;")
+    if old is not None:
+        old_days,new_days=day_hashes(old).align(day_hashes(orders))
+        differs=old_days.index[old_days.ne(new_days)]
+        changed,changed_from=len(differs)>0,(differs.min() if len(differs) else None)
+        if changed:
+            con.execute("DELETE FROM orders WHERE order_id IN (SELECT order_id FROM export_ids)")
+
+if changed:
+    orders.to_sql("orders",con,if_exists='append',index=False)
+    create_order_indexes(con)
+    record_load(con,"orders",changed_from,len(orders))
+con.commit()
 con.close()
-print(f"✅  Orders loaded: {len(orders):,} rows")
\ No newline at end of file
+print(f"✅  Orders loaded: {len(orders):,} rows")
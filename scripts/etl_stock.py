@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 # ----------  ETL FOR PHYSICAL STOCK SNAPSHOT ----------
 import pandas as pd, sqlite3, pathlib, sys
+from load_versions import record_load
 
 ROOT     = pathlib.Path(__file__).resolve().parents[1]
 RAW_DIR  = ROOT / "data_raw"
@@ -19,5 +20,7 @@ df["sku_key"] = df["sku_key"].str.strip().str.upper()
 # ── write to SQLite ─────────────────────────────────────
 con = sqlite3.connect(DB_PATH)
 df.to_sql("stock", con, if_exists="replace", index=False)
+record_load(con, "stock", rows=len(df))
+con.commit()
 con.close()
 print(f"✅  Stock loaded: {len(df):,} rows from {stock_fp.name}")
\ No newline at end of file
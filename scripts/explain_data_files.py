@@ -1,103 +1,121 @@
 #!/usr/bin/env python3
 # --- EXPLAIN DATA FILES (v2025‑08‑05) --------------------------------
-import pandas as pd
+import argparse
+import logging
 import pathlib
 import sqlite3
 
+from file_profiles import column, profile_files
+
 # Setup paths
 RAW_DIR = pathlib.Path(__file__).resolve().parents[1] / "data_raw"
 DB_PATH = pathlib.Path(__file__).resolve().parents[1] / "db" / "erp.db"
 
-def explain_catalog_file():
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+CATALOG_FILE = "M02_SKU_CATALOG Sample for gpt.csv"
+STOCK_FILE = "stock_on_hand.csv"
+ORDER_FILES = ["ActiveOrders 31.7.25.xlsx", "ArchiveOrders since 1.7.25.xlsx"]
+PURCHASE_FILE = "Purchase inquiry made by me.xlsx"
+
+def _status(profile):
+    """'(cached)' for profiles answered from file_profiles"""
+    return " (cached)" if profile.get('cached') else ""
+
+def _dates(profile):
+    """'col: min → max' for every date column in a profile"""
+    return [f"{c['name']}: {str(c['min'])[:10]} → {str(c['max'])[:10]}"
+            for c in profile['columns']
+            if c.get('min') is not None and (c.get('parsed_as') == 'date' or c['dtype'].startswith('datetime'))]
+
+def explain_catalog_file(profiles):
     """Explain the main catalog file"""
-    print("📊 M02_SKU_CATALOG Sample for gpt.csv")
+    print(f"📊 {CATALOG_FILE}")
     print("=" * 50)
     
-    try:
-        df = pd.read_csv(RAW_DIR / "M02_SKU_CATALOG Sample for gpt.csv", sep=';', engine='python', dtype=str, on_bad_lines='skip')
-        df.columns = [col.strip() for col in df.columns]
-        
-        print(f"✅ Total products: {len(df)}")
-        
-        # Count by store
-        store_counts = df['Store_name'].value_counts()
-        print(f"\n🏪 Products by store:")
-        for store, count in store_counts.items():
-            print(f"   {store}: {count} products")
-        
-        # Count products with Kaspi codes
-        with_codes = df['Kaspi_art_1'].notna() & (df['Kaspi_art_1'] != '')
-        print(f"\n🔗 Products with Kaspi codes: {with_codes.sum()}")
-        print(f"   Products without Kaspi codes: {(~with_codes).sum()}")
-        
-        # Show sample
-        print(f"\n📋 Sample products:")
-        sample = df[['SKU_ID', 'Kaspi_name_core', 'Store_name', 'Kaspi_art_1']].head(3)
-        for _, row in sample.iterrows():
-            name = row['Kaspi_name_core'] if row['Kaspi_name_core'] else row['SKU_ID']
-            kaspi_code = row['Kaspi_art_1'] if row['Kaspi_art_1'] else "No code"
-            print(f"   {name} → Store: {row['Store_name']} → Kaspi: {kaspi_code}")
-            
-    except Exception as e:
-        print(f"❌ Error reading catalog: {e}")
+    profile = profiles.get(CATALOG_FILE)
+    if profile is None:
+        print("❌ Error reading catalog")
+        return
+    
+    print(f"✅ Total products: {profile['rows']}{_status(profile)}")
+    
+    # Count by store
+    stores = column(profile, 'Store_name') or {}
+    print(f"\n🏪 Products by store:")
+    for store, count in stores.get('top', {}).items():
+        print(f"   {store}: {count} products")
+    
+    # Count products with Kaspi codes
+    codes = column(profile, 'Kaspi_art_1')
+    if codes:
+        print(f"\n🔗 Products with Kaspi codes: {profile['rows'] - codes['nulls']}")
+        print(f"   Products without Kaspi codes: {codes['nulls']}")
+    
+    # Show sample
+    print(f"\n📋 Sample products:")
+    for row in profile['sample']:
+        name = row.get('Kaspi_name_core') or row.get('SKU_ID')
+        kaspi_code = row.get('Kaspi_art_1') or "No code"
+        print(f"   {name} → Store: {row.get('Store_name')} → Kaspi: {kaspi_code}")
 
-def explain_stock_file():
+def explain_stock_file(profiles):
     """Explain the stock file"""
-    print(f"\n📦 stock_on_hand.csv")
+    print(f"\n📦 {STOCK_FILE}")
     print("=" * 50)
     
-    try:
-        df = pd.read_csv(RAW_DIR / "stock_on_hand.csv")
-        print(f"✅ Total stock items: {len(df)}")
-        
-        total_stock = df['qty_on_hand'].sum()
-        print(f"   Total quantity in stock: {total_stock}")
-        
-        print(f"\n📋 Sample stock items:")
-        for _, row in df.head(3).iterrows():
-            print(f"   {row['sku_key']}: {row['qty_on_hand']} units")
-            
-    except Exception as e:
-        print(f"❌ Error reading stock: {e}")
+    profile = profiles.get(STOCK_FILE)
+    if profile is None:
+        print("❌ Error reading stock")
+        return
+    
+    print(f"✅ Total stock items: {profile['rows']}{_status(profile)}")
+    qty = column(profile, 'qty_on_hand') or {}
+    print(f"   Total quantity in stock: {qty.get('total')}")
+    
+    print(f"\n📋 Sample stock items:")
+    for row in profile['sample']:
+        print(f"   {row.get('sku_key')}: {row.get('qty_on_hand')} units")
 
-def explain_orders():
+def explain_orders(profiles):
     """Explain the orders files"""
     print(f"\n🛒 Orders Files")
     print("=" * 50)
     
-    # Check active orders
-    active_file = RAW_DIR / "ActiveOrders 31.7.25.xlsx"
-    if active_file.exists():
-        try:
-            df = pd.read_excel(active_file)
-            print(f"✅ ActiveOrders 31.7.25.xlsx: {len(df)} orders")
-            print(f"   Columns: {list(df.columns)}")
-        except Exception as e:
-            print(f"❌ Error reading active orders: {e}")
-    
-    # Check archive orders
-    archive_file = RAW_DIR / "ArchiveOrders since 1.7.25.xlsx"
-    if archive_file.exists():
-        try:
-            df = pd.read_excel(archive_file)
-            print(f"✅ ArchiveOrders since 1.7.25.xlsx: {len(df)} orders")
-            print(f"   Columns: {list(df.columns)}")
-        except Exception as e:
-            print(f"❌ Error reading archive orders: {e}")
+    for name in ORDER_FILES:
+        profile = profiles.get(name)
+        if profile is None:
+            continue
+        print(f"✅ {name}: {profile['rows']} orders{_status(profile)}")
+        for dates in _dates(profile):
+            print(f"   {dates}")
+        amount = column(profile, 'Сумма')
+        if amount and amount.get('total') is not None:
+            print(f"   Total amount: {amount['total']:,} KZT")
+        print(f"   Columns: {[c['name'] for c in profile['columns']]}")
 
-def explain_purchases():
+def explain_purchases(profiles):
     """Explain the purchase file"""
-    print(f"\n📋 Purchase inquiry made by me.xlsx")
+    print(f"\n📋 {PURCHASE_FILE}")
     print("=" * 50)
     
-    purchase_file = RAW_DIR / "Purchase inquiry made by me.xlsx"
-    if purchase_file.exists():
-        try:
-            df = pd.read_excel(purchase_file)
-            print(f"✅ Purchase orders: {len(df)} items")
-            print(f"   Columns: {list(df.columns)}")
-        except Exception as e:
-            print(f"❌ Error reading purchases: {e}")
+    profile = profiles.get(PURCHASE_FILE)
+    if profile is None:
+        return
+    print(f"✅ Purchase orders: {profile['rows']} items{_status(profile)}")
+    for dates in _dates(profile):
+        print(f"   {dates}")
+    print(f"   Columns: {[c['name'] for c in profile['columns']]}")
+
+def show_alerts(profiles):
+    """Data-quality alerts recorded with the profiles"""
+    alerts = [(name, alert) for name, profile in profiles.items() for alert in profile['alerts']]
+    if not alerts:
+        return
+    print(f"\n🚨 Data-quality alerts")
+    print("=" * 50)
+    for name, alert in alerts:
+        print(f"   {name}: {alert}")
 
 def show_database_status():
     """Show what's in the database"""
@@ -126,13 +144,26 @@ def show_database_status():
 
 def main():
     """Main explanation function"""
+    ap = argparse.ArgumentParser(description="Explain the files in data_raw/")
+    ap.add_argument("--refresh", action="store_true",
+                    help="re-profile every file even if it has not changed")
+    args = ap.parse_args()
+    
+    # Profiles are computed once per file content and kept in file_profiles
+    con = sqlite3.connect(DB_PATH)
+    try:
+        profiles = profile_files(con, refresh=args.refresh, raw_dir=RAW_DIR)
+    finally:
+        con.close()
+    
     print("🚀 KASPI ETL DATA FILES EXPLANATION")
     print("=" * 60)
     
-    explain_catalog_file()
-    explain_stock_file()
-    explain_orders()
-    explain_purchases()
+    explain_catalog_file(profiles)
+    explain_stock_file(profiles)
+    explain_orders(profiles)
+    explain_purchases(profiles)
+    show_alerts(profiles)
     show_database_status()
     
     print(f"\n" + "=" * 60)
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Cached per-file profiles of data_raw/
+Each file is parsed once per content hash into a profile (rows, per-column
+nulls / distinct counts / min-max / totals, top values and a sample) stored in
+the file_profiles table; unchanged files are answered from the table without
+importing pandas
+"""
+import json
+import logging
+import pathlib
+import re
+import sqlite3
+from typing import Dict, List, Optional
+
+RAW_DIR = pathlib.Path(__file__).resolve().parents[1] / "data_raw"
+DB_PATH = pathlib.Path(__file__).resolve().parents[1] / "db" / "erp.db"
+
+# Bump when the profile layout changes – invalidates every stored profile
+PROFILE_VERSION = 2
+
+SAMPLE_ROWS = 3
+TOP_VALUES = 10           # value counts kept for columns with at most this many distinct values
+COUNTED_COLUMNS = {'Store_name'}   # value counts always kept in full (explain_data_files lists them)
+NULL_ALERT_RATIO = 0.5    # alert when a column becomes more than half empty
+ROW_DROP_ALERT = 0.2      # alert when a file lost more than 20% of its rows
+
+SUFFIXES = {".csv", ".xlsx"}
+
+# Text dates as Kaspi exports them (31.07.2025) or ISO (2025-07-31)
+_DATE_TEXT = re.compile(r"^\s*\d{1,4}[./-]\d{1,2}[./-]\d{1,4}")
+
+logger = logging.getLogger(__name__)
+
+
+def read_file(path: pathlib.Path):
+    """The file as a DataFrame (the catalog through the shared loader)"""
+    import pandas as pd
+    from catalog_loader import CATALOG_PATH, load_catalog
+
+    if path.suffix.lower() == ".xlsx":
+        return pd.read_excel(path)
+    if path.name == CATALOG_PATH.name:
+        return load_catalog(path)
+    return pd.read_csv(path)
+
+
+def create_profiles_table(con: sqlite3.Connection) -> None:
+    con.executescript("""
+    CREATE TABLE IF NOT EXISTS file_profiles (
+        file_name       TEXT PRIMARY KEY,
+        sha256          TEXT NOT NULL,
+        size_bytes      INTEGER,
+        mtime_ns        INTEGER,
+        version         INTEGER,
+        rows            INTEGER,
+        profile         TEXT,
+        alerts          TEXT,
+        profiled_at     TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE INDEX IF NOT EXISTS idx_file_profiles_sha ON file_profiles(sha256);
+    """)
+
+
+def _plain(value):
+    """numpy / pandas scalars → JSON-friendly Python values"""
+    import numpy as np
+    import pandas as pd
+
+    if value is None or (not isinstance(value, (list, dict, str)) and pd.isna(value)):
+        return None
+    if isinstance(value, (pd.Timestamp, np.datetime64)):
+        return pd.Timestamp(value).isoformat()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _text_dates(series):
+    """Parsed dates of a text column whose every value looks like a date, else None"""
+    import pandas as pd
+
+    values = pd.Series(series.dropna().unique())
+    if values.empty or not values.map(lambda v: isinstance(v, str) and bool(_DATE_TEXT.match(v))).all():
+        return None
+    parsed = pd.to_datetime(values, dayfirst=True, errors='coerce', format='mixed')
+    return parsed if parsed.notna().all() else None
+
+
+def profile_frame(df) -> Dict:
+    """Stats per column: dtype, nulls, distinct, min/max (numbers, dates), total, value counts"""
+    import pandas as pd
+
+    columns = []
+    nulls = df.isna().sum()
+    for col in df.columns:
+        series = df[col]
+        stats = {'name': str(col), 'dtype': str(series.dtype),
+                 'nulls': int(nulls[col]), 'distinct': int(series.nunique(dropna=True))}
+        if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+            stats.update(min=_plain(series.min()), max=_plain(series.max()), total=_plain(series.sum()))
+        elif pd.api.types.is_datetime64_any_dtype(series):
+            stats.update(min=_plain(series.min()), max=_plain(series.max()))
+        elif (dates := _text_dates(series)) is not None:
+            stats.update(min=_plain(dates.min()), max=_plain(dates.max()), parsed_as='date')
+        if 0 < stats['distinct'] <= TOP_VALUES or str(col) in COUNTED_COLUMNS:
+            stats['top'] = {str(k): int(v) for k, v in series.value_counts().items()}
+        columns.append(stats)
+
+    sample = json.loads(df.head(SAMPLE_ROWS).to_json(orient='records', date_format='iso',
+                                                     force_ascii=False, default_handler=str))
+    return {'rows': len(df), 'columns': columns, 'sample': sample}
+
+
+def quality_alerts(profile: Dict, previous: Optional[Dict] = None) -> List[str]:
+    """Data-quality findings for a new profile of a file
+
+    Compared with the file's previous profile: lost rows, missing columns and
+    columns that became mostly empty. A first profile only reports empty columns.
+    """
+    rows = profile['rows']
+    if previous is None:
+        return [f"column {c['name']} is empty" for c in profile['columns'] if rows and c['nulls'] == rows]
+
+    alerts = []
+    if rows < previous['rows'] * (1 - ROW_DROP_ALERT):
+        alerts.append(f"rows dropped from {previous['rows']} to {rows}")
+    before = {c['name']: c for c in previous['columns']}
+    now = {c['name'] for c in profile['columns']}
+    alerts += [f"column {name} disappeared" for name in before if name not in now]
+    for col in profile['columns']:
+        old = before.get(col['name'])
+        if not rows or old is None:
+            continue
+        ratio = col['nulls'] / rows
+        old_ratio = old['nulls'] / previous['rows'] if previous['rows'] else 0.0
+        if ratio > NULL_ALERT_RATIO >= old_ratio:
+            alerts.append(f"column {col['name']} is now {ratio:.0%} empty (was {old_ratio:.0%})")
+    return alerts
+
+
+def _sha256(path: pathlib.Path) -> str:
+    from catalog_loader import file_sha256  # imports pandas – only reached for changed files
+    return file_sha256(path)
+
+
+def get_profile(con: sqlite3.Connection, path: pathlib.Path, refresh: bool = False) -> Dict:
+    """Stored profile of `path`, recomputed only when the file (or PROFILE_VERSION) changed
+
+    The file is re-hashed only when its size or mtime moved.
+    """
+    create_profiles_table(con)
+    stat = path.stat()
+    stored = con.execute("SELECT sha256, size_bytes, mtime_ns, version, rows, profile, alerts "
+                         "FROM file_profiles WHERE file_name=?", (path.name,)).fetchone()
+
+    if stored and not refresh and stored[3] == PROFILE_VERSION:
+        sha, size, mtime_ns = stored[:3]
+        unchanged = (size, mtime_ns) == (stat.st_size, stat.st_mtime_ns)
+        if not unchanged and _sha256(path) == sha:
+            # Touched but identical – remember the new mtime, keep the profile
+            con.execute("UPDATE file_profiles SET size_bytes=?, mtime_ns=? WHERE file_name=?",
+                        (stat.st_size, stat.st_mtime_ns, path.name))
+            con.commit()
+            unchanged = True
+        if unchanged:
+            return {**json.loads(stored[5]), 'alerts': json.loads(stored[6]), 'cached': True}
+
+    logger.info(f"🔎 Profiling {path.name}")
+    profile = profile_frame(read_file(path))
+    alerts = quality_alerts(profile, json.loads(stored[5]) if stored else None)
+
+    con.execute("""
+        INSERT OR REPLACE INTO file_profiles
+            (file_name, sha256, size_bytes, mtime_ns, version, rows, profile, alerts, profiled_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+    """, (path.name, _sha256(path), stat.st_size, stat.st_mtime_ns, PROFILE_VERSION,
+          profile['rows'], json.dumps(profile, ensure_ascii=False, default=str),
+          json.dumps(alerts, ensure_ascii=False)))
+    con.commit()
+    if alerts:
+        logger.warning(f"⚠️ {path.name}: {len(alerts)} data-quality alerts")
+    return {**profile, 'alerts': alerts, 'cached': False}
+
+
+def profile_files(con: sqlite3.Connection, refresh: bool = False,
+                  raw_dir: pathlib.Path = RAW_DIR) -> Dict[str, Dict]:
+    """Profiles of every readable file in data_raw/, keyed by file name"""
+    profiles = {}
+    for path in sorted(raw_dir.iterdir()):
+        if path.suffix.lower() in SUFFIXES and not path.name.startswith("~$"):
+            try:
+                profiles[path.name] = get_profile(con, path, refresh)
+            except Exception as e:
+                logger.error(f"❌ Could not profile {path.name}: {e}")
+    return profiles
+
+
+def column(profile: Dict, name: str) -> Optional[Dict]:
+    """One column's stats from a profile"""
+    return next((c for c in profile['columns'] if c['name'] == name), None)
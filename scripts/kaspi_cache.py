@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Persistent HTTP cache for Kaspi API GET calls
+Revalidates with ETag / Last-Modified when the server sends them and falls
+back to a fixed TTL when it does not
+"""
+import hashlib
+import json
+import logging
+import pathlib
+import sqlite3
+import time
+from typing import Dict, Optional
+
+import httpx
+
+# Setup paths
+CACHE_PATH = pathlib.Path(__file__).resolve().parents[1] / "db" / "http_cache.db"
+
+DEFAULT_TTL = 15 * 60  # seconds, only for responses without validators
+
+logger = logging.getLogger(__name__)
+
+
+class CachedEntry:
+    """One stored response"""
+
+    def __init__(self, url: str, etag: Optional[str], last_modified: Optional[str],
+                 headers: Dict[str, str], body: bytes, stored_at: float):
+        self.url = url
+        self.etag = etag
+        self.last_modified = last_modified
+        self.headers = headers
+        self.body = body
+        self.stored_at = stored_at
+
+    @property
+    def has_validators(self) -> bool:
+        return bool(self.etag or self.last_modified)
+
+    def conditional_headers(self) -> Dict[str, str]:
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+    def to_response(self, request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, headers=self.headers, content=self.body, request=request)
+
+
+class HttpCache:
+    """SQLite-backed response cache keyed by token, URL and query string"""
+
+    def __init__(self, path: pathlib.Path = CACHE_PATH, ttl: float = DEFAULT_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.stats = {"hits": 0, "revalidated": 0, "misses": 0}
+        self._con: Optional[sqlite3.Connection] = None
+
+    @property
+    def con(self) -> sqlite3.Connection:
+        if self._con is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._con = sqlite3.connect(self.path)
+            self._con.execute("""
+                CREATE TABLE IF NOT EXISTS http_cache (
+                    cache_key      TEXT PRIMARY KEY,
+                    url            TEXT,
+                    etag           TEXT,
+                    last_modified  TEXT,
+                    headers        TEXT,
+                    body           BLOB,
+                    stored_at      REAL
+                )
+            """)
+        return self._con
+
+    @staticmethod
+    def key(token: str, request: httpx.Request) -> str:
+        # Token fingerprint keeps stores with different credentials apart
+        fingerprint = hashlib.sha256(token.encode()).hexdigest()[:16]
+        return f"{fingerprint}:{request.method}:{request.url}"
+
+    def get(self, key: str) -> Optional[CachedEntry]:
+        row = self.con.execute(
+            "SELECT url, etag, last_modified, headers, body, stored_at FROM http_cache WHERE cache_key=?",
+            (key,)).fetchone()
+        if row is None:
+            return None
+        url, etag, last_modified, headers, body, stored_at = row
+        return CachedEntry(url, etag, last_modified, json.loads(headers), body, stored_at)
+
+    def is_fresh(self, entry: CachedEntry) -> bool:
+        """TTL check, only used when the server gave no validators"""
+        return not entry.has_validators and time.time() - entry.stored_at < self.ttl
+
+    def store(self, key: str, response: httpx.Response) -> None:
+        # Keep only what is needed to rebuild the response; drop transfer headers
+        headers = {k: v for k, v in response.headers.items()
+                   if k.lower() in ("content-type", "etag", "last-modified")}
+        self.con.execute("""
+            INSERT OR REPLACE INTO http_cache
+            (cache_key, url, etag, last_modified, headers, body, stored_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (key, str(response.request.url), response.headers.get("ETag"),
+              response.headers.get("Last-Modified"), json.dumps(headers),
+              response.content, time.time()))
+        self.con.commit()
+
+    def touch(self, key: str) -> None:
+        self.con.execute("UPDATE http_cache SET stored_at=? WHERE cache_key=?", (time.time(), key))
+        self.con.commit()
+
+    def clear(self) -> None:
+        self.con.execute("DELETE FROM http_cache")
+        self.con.commit()
+
+    def close(self) -> None:
+        if self._con is not None:
+            self._con.close()
+            self._con = None
+
+    def summary(self) -> str:
+        s = self.stats
+        return f"cache hits={s['hits']} revalidated={s['revalidated']} misses={s['misses']}"
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Kaspi Delivery label downloader
+Fetches labels for the day's ASSEMBLE orders concurrently, keeps every PDF in
+a content-addressed cache and merges them into one print file per courier wave
+"""
+import argparse
+import asyncio
+import hashlib
+import logging
+import pathlib
+import sqlite3
+from collections import defaultdict
+from datetime import date, datetime, timezone
+from typing import Dict, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from pypdf import PdfWriter
+
+from etl_catalog_api import KaspiAPI, KASPI_TOKEN
+from kaspi_order_transitions import create_history_table
+from kaspi_orders_poller import LOCAL_TZ, create_tables
+
+# Setup paths
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+DB_PATH = ROOT / "db" / "erp.db"
+LABEL_DIR = ROOT / "labels"
+CACHE_DIR = LABEL_DIR / "cache"
+BATCH_DIR = LABEL_DIR / "batches"
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# ASSEMBLE is set on kaspi_orders by kaspi_order_transitions, which also logs the
+# successful transition (UTC changed_at) in order_status_history
+ASSEMBLE_ORDERS_SQL = """
+    SELECT k.kaspi_order_id, k.order_id, k.planned_pickup, MAX(h.changed_at) AS assembled_at
+    FROM kaspi_orders k
+    JOIN order_status_history h
+      ON h.kaspi_order_id = k.kaspi_order_id AND h.status = 'ASSEMBLE' AND h.result = 'ok'
+    WHERE k.status = 'ASSEMBLE'
+    GROUP BY k.kaspi_order_id
+    ORDER BY k.planned_pickup, k.order_id
+"""
+
+
+def create_label_table(con: sqlite3.Connection) -> None:
+    """order → label hash index for the content-addressed cache"""
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS label_cache (
+            kaspi_order_id  TEXT PRIMARY KEY,
+            sha256          TEXT,
+            fetched_at      TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+def assemble_orders(con: sqlite3.Connection, day: date) -> List[Tuple[str, int, Optional[int]]]:
+    """(kaspi_order_id, order_id, planned_pickup_ms) for the orders assembled on `day`"""
+    create_tables(con)
+    create_history_table(con)
+    orders = []
+    for kaspi_id, order_id, planned_pickup, assembled_at in con.execute(ASSEMBLE_ORDERS_SQL):
+        local = datetime.fromisoformat(assembled_at).replace(tzinfo=timezone.utc).astimezone(ZoneInfo(LOCAL_TZ))
+        if local.date() == day:
+            orders.append((kaspi_id, order_id, planned_pickup))
+    return orders
+
+
+def cached_labels(con: sqlite3.Connection, ids: List[str]) -> Dict[str, pathlib.Path]:
+    """Labels already on disk, keyed by Kaspi order id"""
+    found = {}
+    con.execute("CREATE TEMP TABLE IF NOT EXISTS label_order_ids (kaspi_order_id TEXT PRIMARY KEY)")
+    con.execute("DELETE FROM temp.label_order_ids")
+    con.executemany("INSERT OR IGNORE INTO temp.label_order_ids VALUES (?)", [(i,) for i in ids])
+    for kaspi_id, sha in con.execute(
+            "SELECT kaspi_order_id, sha256 FROM label_cache "
+            "WHERE kaspi_order_id IN (SELECT kaspi_order_id FROM temp.label_order_ids)"):
+        path = CACHE_DIR / f"{sha}.pdf"
+        if path.exists():
+            found[kaspi_id] = path
+    return found
+
+
+def store_label(pdf: bytes) -> Tuple[str, pathlib.Path]:
+    """Write a label under its content hash; identical PDFs share one file"""
+    sha = hashlib.sha256(pdf).hexdigest()
+    path = CACHE_DIR / f"{sha}.pdf"
+    if not path.exists():
+        tmp = path.with_suffix(".tmp")
+        tmp.write_bytes(pdf)
+        tmp.replace(path)
+    return sha, path
+
+
+async def download_labels(api: KaspiAPI, ids: List[str]) -> Dict[str, Tuple[str, pathlib.Path]]:
+    """Fetch labels concurrently over the client's pooled connections"""
+    async def fetch(kaspi_id: str):
+        try:
+            return kaspi_id, store_label(await api.get_order_label(kaspi_id))
+        except Exception as e:
+            logger.error(f"❌ Label for order {kaspi_id} failed: {e}")
+            return kaspi_id, None
+
+    async with api:
+        results = await asyncio.gather(*(fetch(i) for i in ids))
+    return {kaspi_id: stored for kaspi_id, stored in results if stored}
+
+
+def wave_name(planned_pickup: Optional[int]) -> str:
+    """Courier wave label from the planned hand-over time"""
+    if not planned_pickup:
+        return "unplanned"
+    return datetime.fromtimestamp(planned_pickup / 1000, ZoneInfo(LOCAL_TZ)).strftime("%H%M")
+
+
+def merge_wave(paths: List[pathlib.Path], out_path: pathlib.Path) -> None:
+    """Concatenate label PDFs into one print-ready file"""
+    writer = PdfWriter()
+    for path in paths:
+        writer.append(str(path))
+    with open(out_path, "wb") as fh:
+        writer.write(fh)
+
+
+async def run(day: date, api: Optional[KaspiAPI]) -> Dict[str, pathlib.Path]:
+    """Download missing labels and write one batch per wave; returns wave → file"""
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    BATCH_DIR.mkdir(parents=True, exist_ok=True)
+
+    con = sqlite3.connect(DB_PATH)
+    try:
+        create_label_table(con)
+        orders = assemble_orders(con, day)
+        if not orders:
+            logger.info(f"No ASSEMBLE orders for {day}")
+            return {}
+
+        ids = [kaspi_id for kaspi_id, _, _ in orders]
+        paths = cached_labels(con, ids)
+        missing = [i for i in ids if i not in paths]
+        logger.info(f"🏷️ {len(orders)} orders: {len(paths)} labels cached, {len(missing)} to download")
+
+        if missing:
+            if api is None:
+                raise SystemExit("KASPI_TOKEN not set – cannot download missing labels")
+            downloaded = await download_labels(api, missing)
+            con.executemany("""
+                INSERT OR REPLACE INTO label_cache (kaspi_order_id, sha256, fetched_at)
+                VALUES (?, ?, CURRENT_TIMESTAMP)
+            """, [(i, sha) for i, (sha, _) in downloaded.items()])
+            con.commit()
+            paths.update({i: path for i, (_, path) in downloaded.items()})
+    finally:
+        con.close()
+
+    waves: Dict[str, List[pathlib.Path]] = defaultdict(list)
+    for kaspi_id, _, planned_pickup in orders:
+        if kaspi_id in paths:
+            waves[wave_name(planned_pickup)].append(paths[kaspi_id])
+
+    batches = {}
+    for wave, wave_paths in sorted(waves.items()):
+        out_path = BATCH_DIR / f"{day.isoformat()}_wave_{wave}.pdf"
+        merge_wave(wave_paths, out_path)
+        batches[wave] = out_path
+        logger.info(f"✅ Wave {wave}: {len(wave_paths)} labels → {out_path.name}")
+
+    return batches
+
+
+def main():
+    """Build today's label batches"""
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--date", type=date.fromisoformat, default=datetime.now(ZoneInfo(LOCAL_TZ)).date(),
+                    help="day the orders were moved to ASSEMBLE (YYYY-MM-DD)")
+    args = ap.parse_args()
+
+    api = KaspiAPI(KASPI_TOKEN) if KASPI_TOKEN else None
+    asyncio.run(run(args.date, api))
+
+
+if __name__ == "__main__":
+    main()
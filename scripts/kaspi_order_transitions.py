@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Bulk Kaspi order status transitions (accept / assemble / cancel)
+Selects orders with a query on erp.db, posts the transitions concurrently with
+bounded parallelism and records every outcome in order_status_history
+"""
+import argparse
+import asyncio
+import logging
+import pathlib
+import sqlite3
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from etl_catalog_api import KaspiAPI, KASPI_TOKEN
+from kaspi_orders_poller import LOCAL_TZ, create_tables, export_status
+from kaspi_rate import RateController
+
+# Setup paths
+DB_PATH = pathlib.Path(__file__).resolve().parents[1] / "db" / "erp.db"
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+TRANSITIONS = {
+    'accept': 'ACCEPTED_BY_MERCHANT',
+    'assemble': 'ASSEMBLE',
+    'cancel': 'CANCELLED',
+}
+
+# Default selections; every query must return (kaspi_order_id, order_id)
+DEFAULT_QUERIES = {
+    'accept': "SELECT kaspi_order_id, order_id FROM kaspi_orders "
+              "WHERE state = 'NEW' AND status = 'APPROVED_BY_BANK'",
+    'assemble': "SELECT kaspi_order_id, order_id FROM kaspi_orders "
+                "WHERE status = 'ACCEPTED_BY_MERCHANT'",
+}
+
+
+def create_history_table(con: sqlite3.Connection) -> None:
+    """Status history written by every transition attempt"""
+    con.executescript("""
+    CREATE TABLE IF NOT EXISTS order_status_history (
+        kaspi_order_id  TEXT,
+        order_id        INTEGER,
+        status          TEXT,
+        result          TEXT,
+        detail          TEXT,
+        changed_at      TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE INDEX IF NOT EXISTS idx_status_history_order
+        ON order_status_history(kaspi_order_id, status, result);
+    """)
+
+
+def select_orders(con: sqlite3.Connection, sql: str, status: str) -> List[Tuple[str, int]]:
+    """Run the selection query and drop orders already moved to `status`"""
+    rows = con.execute(sql).fetchall()
+    done = {r[0] for r in con.execute(
+        "SELECT kaspi_order_id FROM order_status_history WHERE status=? AND result='ok'",
+        (status,))}
+    todo = [(str(kaspi_id), order_id) for kaspi_id, order_id in rows if str(kaspi_id) not in done]
+    skipped = len(rows) - len(todo)
+    if skipped:
+        logger.info(f"↩️ {skipped} orders already {status} – skipped")
+    return todo
+
+
+async def transition_orders(api: KaspiAPI, orders: List[Tuple[str, int]], status: str,
+                            attributes: Dict) -> List[Tuple[str, int, str, str]]:
+    """Post every transition concurrently; returns (kaspi_id, order_id, result, detail)"""
+    async def post(kaspi_id: str, order_id: int):
+        try:
+            await api.update_order_status(kaspi_id, str(order_id), status, **attributes)
+            return kaspi_id, order_id, 'ok', ''
+        except Exception as e:
+            logger.error(f"❌ Order {order_id} → {status} failed: {e}")
+            return kaspi_id, order_id, 'error', str(e)[:500]
+
+    async with api:
+        return await asyncio.gather(*(post(k, o) for k, o in orders))
+
+
+def record_results(con: sqlite3.Connection, status: str,
+                   results: List[Tuple[str, int, str, str]]) -> None:
+    """Append history rows and move successful orders to the new status (the
+    export's name for it in `orders`)"""
+    con.executemany("""
+        INSERT INTO order_status_history (kaspi_order_id, order_id, status, result, detail)
+        VALUES (?, ?, ?, ?, ?)
+    """, [(k, o, status, result, detail) for k, o, result, detail in results])
+
+    ok = [(k, o) for k, o, result, _ in results if result == 'ok']
+    today = datetime.now(ZoneInfo(LOCAL_TZ)).date().isoformat()
+    con.executemany("UPDATE kaspi_orders SET status=? WHERE kaspi_order_id=?",
+                    [(status, k) for k, _ in ok])
+    if con.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='orders'").fetchone():
+        con.executemany("UPDATE orders SET status=?, status_date=? WHERE order_id=?",
+                        [(export_status(None, status), today, o) for _, o in ok])
+    con.commit()
+
+
+async def run(action: str, sql: Optional[str], api: Optional[KaspiAPI],
+              attributes: Dict, dry_run: bool = False) -> Dict[str, int]:
+    """Select, transition and record; returns counts by result"""
+    status = TRANSITIONS[action]
+    sql = sql or DEFAULT_QUERIES.get(action)
+    if not sql:
+        raise SystemExit(f"'{action}' has no default selection – pass --sql")
+
+    con = sqlite3.connect(DB_PATH)
+    try:
+        create_tables(con)
+        create_history_table(con)
+        orders = select_orders(con, sql, status)
+        logger.info(f"📋 {len(orders)} orders to move to {status}")
+        if not orders or dry_run:
+            return {'selected': len(orders)}
+
+        if api is None:
+            raise SystemExit("KASPI_TOKEN not set")
+        results = await transition_orders(api, orders, status, attributes)
+        record_results(con, status, results)
+    finally:
+        con.close()
+
+    counts = {'ok': 0, 'error': 0}
+    for _, _, result, _ in results:
+        counts[result] += 1
+    logger.info(f"✅ {counts['ok']} orders moved to {status}, {counts['error']} failed")
+    return counts
+
+
+def main():
+    """CLI entry point"""
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("action", choices=sorted(TRANSITIONS))
+    ap.add_argument("--sql", help="selection query returning (kaspi_order_id, order_id)")
+    ap.add_argument("--spaces", type=int, default=1, help="numberOfSpace for assemble")
+    ap.add_argument("--reason", default="BUYER_CANCELLATION_BY_MERCHANT",
+                    help="cancellationReason for cancel")
+    ap.add_argument("--max-parallel", type=int, default=16, help="upper bound on in-flight requests")
+    ap.add_argument("--dry-run", action="store_true", help="only report the selection")
+    args = ap.parse_args()
+
+    attributes = {}
+    if args.action == 'assemble':
+        attributes['numberOfSpace'] = args.spaces
+    elif args.action == 'cancel':
+        attributes['cancellationReason'] = args.reason
+
+    api = None
+    if KASPI_TOKEN:
+        api = KaspiAPI(KASPI_TOKEN, rate=RateController(max_limit=args.max_parallel))
+    asyncio.run(run(args.action, args.sql, api, attributes, args.dry_run))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+"""
+Incremental orders poller for the Kaspi API
+Re-reads every tracked order state over the Kaspi creation window, compares it
+with the last pass stored in erp.db and upserts the lines of new and modified
+orders into the `orders` table with the etl_sales SKU mapping and the export's
+status names; order customers are linked into the customers table as they arrive
+"""
+import argparse
+import asyncio
+import json
+import logging
+import pathlib
+import sqlite3
+import time
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from customers import sync_customers
+from etl_catalog_api import KaspiAPI, KASPI_TOKEN
+from load_versions import record_load
+from order_queries import create_order_indexes
+from sku_mapping import load_sku_map, map_order_lines
+
+# Setup paths
+DB_PATH = pathlib.Path(__file__).resolve().parents[1] / "db" / "erp.db"
+
+CURSOR_NAME = "orders_modified"
+PAGE_SIZE = 100                        # Kaspi maximum for page[size]
+MAX_WINDOW_MS = 14 * 24 * 3600 * 1000  # Kaspi rejects creationDate ranges > 14 days
+LOCAL_TZ = "Asia/Almaty"
+
+# Order states still moving; older orders are left to the export ETL
+TRACKED_STATES = ('NEW', 'SIGN_REQUIRED', 'PICKUP', 'DELIVERY', 'KASPI_DELIVERY', 'ARCHIVE')
+
+# API status order: a re-poll never moves an order back to an earlier status
+# (ASSEMBLE is only set by kaspi_order_transitions – the API keeps reporting
+# ACCEPTED_BY_MERCHANT for assembled orders)
+STATUS_RANK = {
+    'APPROVED_BY_BANK': 0,
+    'ACCEPTED_BY_MERCHANT': 1,
+    'ASSEMBLE': 2,
+    'CANCELLING': 3,
+    'COMPLETED': 3,
+    'CANCELLED': 4,
+    'KASPI_DELIVERY_RETURN_REQUESTED': 4,
+    'RETURN_ACCEPTED_BY_MERCHANT': 5,
+    'RETURNED': 6,
+}
+
+# API status → `orders.status` value used by the Kaspi order exports
+EXPORT_STATUS = {
+    'APPROVED_BY_BANK': 'Новый',
+    'ACCEPTED_BY_MERCHANT': 'Принят',
+    'ASSEMBLE': 'Ожидает передачи курьеру',
+    'CANCELLING': 'Ожидает отмены',
+    'COMPLETED': 'Выдан',
+    'CANCELLED': 'Отменен',
+    'KASPI_DELIVERY_RETURN_REQUESTED': 'Возврат',
+    'RETURN_ACCEPTED_BY_MERCHANT': 'Возврат',
+    'RETURNED': 'Возврат',
+}
+# Accepted orders out with the courier
+COURIER_STATES = {'DELIVERY', 'KASPI_DELIVERY'}
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def create_tables(con: sqlite3.Connection) -> None:
+    """Create the cursor and raw-order tables"""
+    con.executescript("""
+    CREATE TABLE IF NOT EXISTS sync_cursors (
+        name            TEXT PRIMARY KEY,
+        cursor_value    INTEGER,
+        updated_at      TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE IF NOT EXISTS kaspi_orders (
+        kaspi_order_id  TEXT PRIMARY KEY,
+        order_id        INTEGER,
+        state           TEXT,
+        status          TEXT,
+        creation_ms     INTEGER,
+        planned_pickup  INTEGER,
+        customer_json   TEXT,
+        payload         TEXT,
+        fetched_at      TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE INDEX IF NOT EXISTS idx_kaspi_orders_order_id ON kaspi_orders(order_id);
+    """)
+
+
+def load_cursor(con: sqlite3.Connection, name: str = CURSOR_NAME) -> Optional[int]:
+    """Return the stored high-water mark (epoch ms) or None on first run"""
+    row = con.execute("SELECT cursor_value FROM sync_cursors WHERE name=?", (name,)).fetchone()
+    return row[0] if row else None
+
+
+def save_cursor(con: sqlite3.Connection, value: int, name: str = CURSOR_NAME) -> None:
+    """Persist the high-water mark"""
+    con.execute("""
+        INSERT INTO sync_cursors (name, cursor_value, updated_at)
+        VALUES (?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT(name) DO UPDATE SET cursor_value=excluded.cursor_value,
+                                        updated_at=CURRENT_TIMESTAMP
+    """, (name, value))
+
+
+def export_status(state: Optional[str], status: Optional[str]) -> Optional[str]:
+    """The export's status name for an API state/status (unknown codes pass through)"""
+    if state in COURIER_STATES and status in ('ACCEPTED_BY_MERCHANT', 'ASSEMBLE'):
+        return 'Передан курьеру'
+    return EXPORT_STATUS.get(status, status)
+
+
+def order_params(state: str, since_ms: int, until_ms: int, page: int) -> Dict:
+    """Query string for one page of `state` orders created in [since_ms, until_ms]"""
+    return {
+        "page[number]": page,
+        "page[size]": PAGE_SIZE,
+        "filter[orders][state]": state,
+        "filter[orders][creationDate][$ge]": since_ms,
+        "filter[orders][creationDate][$le]": until_ms,
+        "include[orders]": "user",
+    }
+
+
+async def fetch_state(api: KaspiAPI, state: str, since_ms: int,
+                      until_ms: int) -> Tuple[List[Dict], List[Dict]]:
+    """Fetch every page of one state; pages after the first run concurrently
+    (in-flight requests are bounded by the client's rate controller)"""
+    first = await api.get_orders(order_params(state, since_ms, until_ms, 0))
+    orders = list(first.get('data', []))
+    included = list(first.get('included', []))
+    page_count = int(first.get('meta', {}).get('pageCount', 1) or 1)
+
+    if page_count > 1:
+        pages = await asyncio.gather(*(api.get_orders(order_params(state, since_ms, until_ms, p))
+                                       for p in range(1, page_count)))
+        for doc in pages:
+            orders.extend(doc.get('data', []))
+            included.extend(doc.get('included', []))
+
+    logger.info(f"📡 Fetched {len(orders)} {state} orders over {page_count} page(s)")
+    return orders, included
+
+
+async def fetch_orders(api: KaspiAPI, since_ms: int, until_ms: int) -> Tuple[List[Dict], List[Dict]]:
+    """Fetch every tracked state concurrently"""
+    results = await asyncio.gather(*(fetch_state(api, state, since_ms, until_ms)
+                                     for state in TRACKED_STATES))
+    orders, included = {}, []
+    for state_orders, state_included in results:
+        # An order moving between states mid-pass may show up twice
+        orders.update((o['id'], o) for o in state_orders)
+        included.extend(state_included)
+    return list(orders.values()), included
+
+
+def stored_orders(con: sqlite3.Connection, ids: List[str]) -> Dict[str, Tuple[str, str]]:
+    """kaspi_order_id → (state, status) as stored by the previous passes"""
+    con.execute("CREATE TEMP TABLE IF NOT EXISTS poll_order_ids (kaspi_order_id TEXT PRIMARY KEY)")
+    con.execute("DELETE FROM temp.poll_order_ids")
+    con.executemany("INSERT OR IGNORE INTO temp.poll_order_ids VALUES (?)", [(i,) for i in ids])
+    return {k: (state, status) for k, state, status in con.execute(
+        "SELECT kaspi_order_id, state, status FROM kaspi_orders "
+        "WHERE kaspi_order_id IN (SELECT kaspi_order_id FROM temp.poll_order_ids)")}
+
+
+def resolve_status(incoming: Optional[str], stored: Optional[str]) -> Optional[str]:
+    """Incoming API status unless the stored one is further along"""
+    if stored is not None and STATUS_RANK.get(stored, -1) > STATUS_RANK.get(incoming, -1):
+        return stored
+    return incoming
+
+
+def modified_orders(orders: List[Dict], stored: Dict[str, Tuple[str, str]]
+                    ) -> Tuple[List[Dict], Dict[str, str]]:
+    """Orders that are new or whose state/status changed since the last pass,
+    plus the resolved status of every order"""
+    modified, statuses = [], {}
+    for order in orders:
+        attrs = order.get('attributes', {})
+        old_state, old_status = stored.get(order['id'], (None, None))
+        statuses[order['id']] = resolve_status(attrs.get('status'), old_status)
+        if order['id'] not in stored or (attrs.get('state'), statuses[order['id']]) != (old_state, old_status):
+            modified.append(order)
+    return modified, statuses
+
+
+async def fetch_entries(api: KaspiAPI, orders: List[Dict]) -> Dict[str, List[Dict]]:
+    """Fetch line items for every order concurrently"""
+    ids = [o['id'] for o in orders]
+    results = await asyncio.gather(*(api.get_order_entries(i) for i in ids))
+    return dict(zip(ids, results))
+
+
+def build_order_lines(orders: List[Dict], entries: Dict[str, List[Dict]],
+                      statuses: Dict[str, str]) -> pd.DataFrame:
+    """Flatten orders + entries into the etl_sales `orders` schema"""
+    records = []
+    for order in orders:
+        attrs = order.get('attributes', {})
+        for entry in entries.get(order['id'], []):
+            e = entry.get('attributes', {})
+            records.append({
+                'order_id': int(attrs['code']),
+                'creation_ms': attrs.get('creationDate'),
+                'status': export_status(attrs.get('state'), statuses[order['id']]),
+                'sku_name_raw': (e.get('offer') or {}).get('name', ''),
+                'qty': e.get('quantity'),
+                'gross_price_kzt': e.get('totalPrice'),
+            })
+
+    cols = ['order_id', 'order_date', 'status_date', 'status',
+            'sku_name_raw', 'qty', 'gross_price_kzt']
+    if not records:
+        return pd.DataFrame(columns=cols)
+
+    df = pd.DataFrame.from_records(records)
+    created = pd.to_datetime(df['creation_ms'], unit='ms', utc=True).dt.tz_convert(LOCAL_TZ)
+    df['order_date'] = created.dt.date
+    df['status_date'] = pd.Timestamp.now(tz=LOCAL_TZ).date()
+    return df[cols]
+
+
+def order_rows(orders: List[Dict], included: List[Dict], statuses: Dict[str, str]) -> List[Tuple]:
+    """Rows for kaspi_orders, with the included user document as the customer"""
+    users = {(i.get('type'), i.get('id')): i.get('attributes', {}) for i in included}
+    rows = []
+    for order in orders:
+        attrs = order.get('attributes', {})
+        user_ref = (order.get('relationships', {}).get('user') or {}).get('data') or {}
+        customer = users.get((user_ref.get('type'), user_ref.get('id'))) or attrs.get('customer') or {}
+        delivery = attrs.get('kaspiDelivery') or {}
+        rows.append((
+            order['id'],
+            int(attrs['code']),
+            attrs.get('state'),
+            statuses[order['id']],
+            attrs.get('creationDate'),
+            delivery.get('courierTransmissionPlanningDate'),
+            json.dumps(customer, ensure_ascii=False),
+            json.dumps(order, ensure_ascii=False),
+        ))
+    return rows
+
+
+def upsert_orders(con: sqlite3.Connection, lines: pd.DataFrame, rows: List[Tuple]) -> None:
+    """UPSERT: refresh kaspi_orders, delete old lines for these order ids then insert
+    (rows carry statuses already resolved against the stored ones)"""
+    con.executemany("""
+        INSERT INTO kaspi_orders
+        (kaspi_order_id, order_id, state, status, creation_ms, planned_pickup,
+         customer_json, payload, fetched_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT(kaspi_order_id) DO UPDATE SET
+            order_id=excluded.order_id, state=excluded.state, status=excluded.status,
+            creation_ms=excluded.creation_ms, planned_pickup=excluded.planned_pickup,
+            customer_json=excluded.customer_json, payload=excluded.payload,
+            fetched_at=CURRENT_TIMESTAMP
+    """, rows)
+
+    if lines.empty:
+        return
+    ids = [(i,) for i in lines['order_id'].unique().tolist()]
+    changed_from = str(lines['order_date'].min())
+    table_exists = con.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='orders'").fetchone()
+    if table_exists:
+        create_order_indexes(con)
+        # Replaced lines may sit on older days than the new ones
+        oldest = con.execute(f"SELECT MIN(order_date) FROM orders WHERE order_id IN ({','.join('?' * len(ids))})",
+                             [i for i, in ids]).fetchone()[0]
+        changed_from = min(filter(None, [changed_from, oldest]))
+        con.executemany("DELETE FROM orders WHERE order_id=?", ids)
+    lines.to_sql("orders", con, if_exists='append', index=False)
+    record_load(con, "orders", changed_from, len(lines))
+
+
+async def poll_once(api: KaspiAPI, map_df: pd.DataFrame) -> int:
+    """One incremental pass; returns the number of new or modified orders upserted
+
+    Kaspi filters orders by creation date only, so each pass re-reads the tracked
+    states over the whole creation window and the modification cursor is the
+    previous pass: orders whose state/status differ from it are the changes.
+    """
+    con = sqlite3.connect(DB_PATH)
+    try:
+        create_tables(con)
+        until_ms = int(time.time() * 1000)
+        cursor = load_cursor(con)
+
+        orders, included = await fetch_orders(api, until_ms - MAX_WINDOW_MS, until_ms)
+        modified, statuses = modified_orders(orders, stored_orders(con, [o['id'] for o in orders]))
+        entries = await fetch_entries(api, modified) if modified else {}
+
+        lines = build_order_lines(modified, entries, statuses)
+        if not lines.empty:
+            lines = map_order_lines(lines, map_df)
+        upsert_orders(con, lines, order_rows(orders, included, statuses))
+        sync_customers(con, [o['id'] for o in modified])
+        save_cursor(con, until_ms)
+        con.commit()
+
+        since = "first pass" if cursor is None else f"since {pd.Timestamp(cursor, unit='ms', tz=LOCAL_TZ):%Y-%m-%d %H:%M}"
+        logger.info(f"✅ {len(modified)} of {len(orders)} orders new or modified {since} ({len(lines)} lines)")
+        return len(modified)
+    finally:
+        con.close()
+
+
+async def main():
+    """Poll once, or keep polling with --loop"""
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--loop", action="store_true", help="keep polling")
+    ap.add_argument("--interval", type=int, default=120, help="seconds between polls")
+    args = ap.parse_args()
+
+    if not KASPI_TOKEN:
+        logger.error("❌ KASPI_TOKEN not found in environment variables")
+        return
+
+    api = KaspiAPI(KASPI_TOKEN)
+    map_df = load_sku_map()
+
+    while True:
+        try:
+            await poll_once(api, map_df)
+        except Exception as e:
+            logger.error(f"❌ Poll failed: {e}")
+            if not args.loop:
+                raise
+        if not args.loop:
+            break
+        await asyncio.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
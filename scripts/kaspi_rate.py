@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+Adaptive rate control for Kaspi API calls
+AIMD concurrency limit, Retry-After handling and a circuit breaker shared by
+every request a KaspiAPI client makes
+"""
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+import httpx
+from tenacity import RetryCallState, wait_exponential_jitter
+
+logger = logging.getLogger(__name__)
+
+THROTTLE_STATUSES = {429, 503}
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+# Failures before the request left the client – safe to resend even for a POST
+UNSENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+MAX_PAUSE = 300.0             # cap on any Retry-After / rate-limit reset pause (s)
+EPOCH_SECONDS_FLOOR = 1e9     # larger numeric values are epoch timestamps, not deltas
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised while the breaker is open after a sustained outage"""
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After / X-RateLimit-Reset header → seconds, capped at MAX_PAUSE
+
+    Accepts delta-seconds, an epoch timestamp (seconds or milliseconds) or an
+    HTTP date.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        seconds = float(value)
+        if seconds > EPOCH_SECONDS_FLOOR * 1000:   # epoch milliseconds
+            seconds = seconds / 1000 - time.time()
+        elif seconds > EPOCH_SECONDS_FLOOR:
+            seconds -= time.time()
+    except ValueError:
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    if seconds != seconds:   # NaN
+        return None
+    return min(MAX_PAUSE, max(0.0, seconds))
+
+
+def _idempotent(exc: httpx.HTTPError) -> bool:
+    """Whether the failed request can be repeated without side effects"""
+    try:
+        return exc.request.method in IDEMPOTENT_METHODS
+    except RuntimeError:   # no request attached
+        return False
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """Retry throttling, server errors and transport failures – never other 4xx.
+
+    A non-idempotent request (POST) may already have been applied when it fails
+    with a 5xx or mid-flight, so it is only retried on 429 or when it never
+    reached the server.
+    """
+    if isinstance(exc, httpx.HTTPStatusError):
+        status = exc.response.status_code
+        return status in RETRYABLE_STATUSES if _idempotent(exc) else status == 429
+    if isinstance(exc, UNSENT_ERRORS):
+        return True
+    return isinstance(exc, httpx.TransportError) and _idempotent(exc)
+
+
+_backoff = wait_exponential_jitter(initial=1, max=30)
+
+
+def wait_retry_after(retry_state: RetryCallState) -> float:
+    """tenacity wait: honour Retry-After when the server sent one, else jittered backoff"""
+    exc = retry_state.outcome.exception() if retry_state.outcome else None
+    if isinstance(exc, httpx.HTTPStatusError):
+        delay = parse_retry_after(exc.response.headers.get("Retry-After"))
+        if delay is not None:
+            return delay
+    return _backoff(retry_state)
+
+
+class RateController:
+    """Additive-increase / multiplicative-decrease concurrency limiter.
+
+    The limit grows by ``increase`` per window of successful responses and is
+    halved once per congestion event (429/503); other 4xx leave it alone.
+    Retry-After and exhausted rate-limit headers pause every caller (for at
+    most MAX_PAUSE); ``failure_threshold`` consecutive server or transport
+    failures open the breaker for ``reset_timeout`` seconds.
+    """
+
+    def __init__(self,
+                 initial: float = 4,
+                 min_limit: float = 1,
+                 max_limit: float = 32,
+                 increase: float = 1,
+                 decrease: float = 0.5,
+                 failure_threshold: int = 10,
+                 reset_timeout: float = 30.0):
+        self.min_limit = float(min_limit)
+        self.max_limit = float(max(max_limit, min_limit))
+        # A small budget (--max-parallel 1, KASPI_MAX_PARALLEL_*) caps the start too
+        self.limit = min(self.max_limit, max(self.min_limit, float(initial)))
+        self.increase = increase
+        self.decrease = decrease
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.epoch = 0                 # bumped on every decrease
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self._probe_in_flight = False
+        self._cond: Optional[asyncio.Condition] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+        self.stats = {"success": 0, "throttled": 0, "rejected": 0, "failed": 0}
+
+    @property
+    def cond(self) -> asyncio.Condition:
+        # Created lazily (and per event loop) so one controller can outlive asyncio.run()
+        loop = asyncio.get_running_loop()
+        if self._cond is None or self._loop is not loop:
+            self._cond = asyncio.Condition()
+            self._loop = loop
+        return self._cond
+
+    # ── breaker ─────────────────────────────────────────────
+    def _check_breaker(self) -> bool:
+        """Return True if this caller is the half-open probe"""
+        if self.opened_at is None:
+            return False
+        if time.monotonic() - self.opened_at < self.reset_timeout or self._probe_in_flight:
+            raise CircuitOpenError(
+                f"Kaspi API circuit open after {self.consecutive_failures} consecutive failures")
+        self._probe_in_flight = True
+        return True
+
+    # ── slots ───────────────────────────────────────────────
+    @asynccontextmanager
+    async def slot(self):
+        """Hold one concurrency slot for the duration of a request"""
+        async with self.cond:
+            while True:
+                probe = self._check_breaker()
+                delay = self.paused_until - time.monotonic()
+                if delay <= 0 and (probe or self.in_flight < int(self.limit)):
+                    break
+                if probe:
+                    self._probe_in_flight = False
+                if delay > 0:
+                    try:
+                        await asyncio.wait_for(self.cond.wait(), timeout=delay)
+                    except asyncio.TimeoutError:
+                        pass
+                else:
+                    await self.cond.wait()
+            self.in_flight += 1
+            epoch = self.epoch
+
+        outcome = _Outcome(epoch)
+        try:
+            yield outcome
+        finally:
+            async with self.cond:
+                self.in_flight -= 1
+                if probe:
+                    self._probe_in_flight = False
+                self._apply(outcome)
+                self.cond.notify_all()
+
+    def _apply(self, outcome: "_Outcome") -> None:
+        now = time.monotonic()
+        if outcome.pause:
+            self.paused_until = max(self.paused_until, now + outcome.pause)
+
+        if outcome.kind == "success":
+            self.stats["success"] += 1
+            self.consecutive_failures = 0
+            self.opened_at = None
+            self.limit = min(self.max_limit, self.limit + self.increase / self.limit)
+        elif outcome.kind == "rejected":
+            # 401/404/…: the API is up, but the response says nothing about capacity
+            self.stats["rejected"] += 1
+            self.consecutive_failures = 0
+            self.opened_at = None
+        elif outcome.kind == "throttled":
+            self.stats["throttled"] += 1
+            # One decrease per congestion event: responses to requests started
+            # before the last decrease do not shrink the window again
+            if outcome.epoch == self.epoch:
+                self.limit = max(self.min_limit, self.limit * self.decrease)
+                self.epoch += 1
+                logger.warning(f"⚠️ Kaspi API throttled – concurrency limit now {self.limit:.1f}")
+        elif outcome.kind == "failed":
+            self.stats["failed"] += 1
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.error(f"❌ Kaspi API circuit opened for {self.reset_timeout:.0f}s")
+                self.opened_at = now
+
+
+class _Outcome:
+    """What happened to one request, recorded by the caller"""
+
+    def __init__(self, epoch: int):
+        self.epoch = epoch
+        self.kind: Optional[str] = None
+        self.pause = 0.0
+
+    def record_response(self, response: httpx.Response) -> None:
+        status = response.status_code
+        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+        if status in THROTTLE_STATUSES:
+            self.kind = "throttled"
+            self.pause = retry_after or 0.0
+        elif status >= 500:
+            self.kind = "failed"
+        else:
+            self.kind = "rejected" if status >= 400 else "success"
+            if response.headers.get("X-RateLimit-Remaining") == "0":
+                self.pause = parse_retry_after(response.headers.get("X-RateLimit-Reset")) or 0.0
+
+    def record_error(self, exc: BaseException) -> None:
+        if isinstance(exc, httpx.TransportError):
+            self.kind = "failed"
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Per-store Kaspi credentials, rate budgets and sync progress
+Each storefront authenticates with KASPI_TOKEN_<STORE> (falling back to
+KASPI_TOKEN) and gets its own RateController, sized by KASPI_MAX_PARALLEL_<STORE>
+"""
+import asyncio
+import logging
+import os
+import re
+import time
+from typing import Dict, Mapping, Optional, Tuple
+
+import pandas as pd
+
+from kaspi_rate import RateController
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PREFIX = "KASPI_TOKEN_"
+PARALLEL_PREFIX = "KASPI_MAX_PARALLEL_"
+DEFAULT_STORE = ""  # key of the KASPI_TOKEN fallback
+
+
+def store_key(store_name) -> str:
+    """Store_name → env suffix: 'M_GROUP' → 'M_GROUP', 'Universal 2' → 'UNIVERSAL_2'"""
+    if store_name is None or pd.isna(store_name):
+        return DEFAULT_STORE
+    return re.sub(r'[^0-9A-Za-z]+', '_', str(store_name)).strip('_').upper()
+
+
+def store_credentials(environ: Optional[Mapping[str, str]] = None) -> Dict[str, Tuple[str, RateController]]:
+    """store key → (token, rate controller) for every configured store, plus the
+    KASPI_TOKEN fallback under DEFAULT_STORE"""
+    environ = os.environ if environ is None else environ
+    tokens = {name[len(TOKEN_PREFIX):]: value for name, value in environ.items()
+              if name.startswith(TOKEN_PREFIX) and value}
+    if environ.get("KASPI_TOKEN"):
+        tokens[DEFAULT_STORE] = environ["KASPI_TOKEN"]
+
+    creds = {}
+    for key, token in tokens.items():
+        budget = environ.get(f"{PARALLEL_PREFIX}{key}") if key else environ.get("KASPI_MAX_PARALLEL")
+        rate = RateController(max_limit=int(budget)) if budget else RateController()
+        creds[key] = (token, rate)
+    return creds
+
+
+def assign_stores(store_names: pd.Series, configured: Mapping) -> pd.Series:
+    """Credential key per row: its own store's if configured, else the fallback, else None"""
+    def resolve(name) -> Optional[str]:
+        key = store_key(name)
+        if key in configured:
+            return key
+        return DEFAULT_STORE if DEFAULT_STORE in configured else None
+
+    keys = {name: resolve(name) for name in store_names.dropna().unique()}
+    assigned = store_names.map(keys)
+    if store_names.isna().any():
+        assigned = assigned.where(store_names.notna(), resolve(None))
+    return assigned
+
+
+def store_label(key: str) -> str:
+    return key or "default"
+
+
+class SyncProgress:
+    """Counters shared by every store's sync task"""
+
+    FIELDS = ("to_send", "sent", "failed")
+
+    def __init__(self):
+        self.stores: Dict[str, Dict[str, int]] = {}
+        self.started = time.monotonic()
+
+    def add(self, key: str, field: str, n: int = 1) -> None:
+        counts = self.stores.setdefault(key, dict.fromkeys(self.FIELDS, 0))
+        counts[field] += n
+
+    def line(self) -> str:
+        parts = [f"{store_label(k)} {c['sent'] + c['failed']}/{c['to_send']}"
+                 + (f" ({c['failed']} failed)" if c['failed'] else "")
+                 for k, c in sorted(self.stores.items())]
+        return f"⏳ {time.monotonic() - self.started:.0f}s – " + ", ".join(parts)
+
+    async def report_every(self, interval: float) -> None:
+        """Log one progress line every `interval` seconds until cancelled"""
+        while True:
+            await asyncio.sleep(interval)
+            logger.info(self.line())
+
+    def summary(self) -> str:
+        rows = [f"   {store_label(k):<16} sent {c['sent']:>5}  failed {c['failed']:>4}"
+                for k, c in sorted(self.stores.items())]
+        return "\n".join(rows)
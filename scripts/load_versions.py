@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Per-table load versions
+Every ETL that writes a table the dashboard reads records one row here per
+load: a version that only grows, plus the earliest date partition the load
+touched (NULL = anything may have changed). Readers key their caches on the
+version – one indexed lookup – and refresh only the partitions from
+`changed_from` on instead of reloading on a timer
+
+    python scripts/load_versions.py          # latest version per table
+"""
+import argparse
+import pathlib
+import sqlite3
+from typing import Dict, Iterable, Optional, Tuple
+
+DB_PATH = pathlib.Path(__file__).resolve().parents[1] / "db" / "erp.db"
+
+
+def create_load_versions_table(con: sqlite3.Connection) -> None:
+    con.executescript("""
+    CREATE TABLE IF NOT EXISTS load_versions (
+        table_name    TEXT NOT NULL,
+        version       INTEGER NOT NULL,
+        changed_from  TEXT,                 -- earliest date partition touched; NULL = whole table
+        rows          INTEGER,
+        loaded_at     TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (table_name, version)
+    );
+    """)
+
+
+def record_load(con: sqlite3.Connection, table: str, changed_from=None,
+                rows: Optional[int] = None) -> int:
+    """Bump `table`'s version in the caller's transaction; returns the new version"""
+    create_load_versions_table(con)
+    version = con.execute("SELECT COALESCE(MAX(version), 0) + 1 FROM load_versions WHERE table_name=?",
+                          (table,)).fetchone()[0]
+    con.execute("INSERT INTO load_versions (table_name, version, changed_from, rows) VALUES (?, ?, ?, ?)",
+                (table, version, None if changed_from is None else str(changed_from), rows))
+    return version
+
+
+def current_versions(con: sqlite3.Connection, tables: Iterable[str]) -> Tuple[int, ...]:
+    """Latest version of each table (0 if never recorded) – the cache token"""
+    tables = tuple(tables)
+    if not con.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='load_versions'").fetchone():
+        return (0,) * len(tables)
+    versions = dict(con.execute(
+        f"SELECT table_name, MAX(version) FROM load_versions "
+        f"WHERE table_name IN ({','.join('?' * len(tables))}) GROUP BY table_name", tables).fetchall())
+    return tuple(versions.get(t, 0) for t in tables)
+
+
+def changed_since(con: sqlite3.Connection, table: str, version: int) -> Tuple[bool, Optional[str]]:
+    """(changed?, earliest partition changed) for loads after `version`;
+    the partition is None when a load may have touched everything"""
+    loads = con.execute("SELECT COUNT(*), MIN(changed_from), SUM(changed_from IS NULL) FROM load_versions "
+                        "WHERE table_name=? AND version > ?", (table, version)).fetchone()
+    if not loads[0]:
+        return False, None
+    return True, None if loads[2] else loads[1]
+
+
+def latest(con: sqlite3.Connection) -> Dict[str, Tuple]:
+    create_load_versions_table(con)
+    return {row[0]: row[1:] for row in con.execute("""
+        SELECT table_name, version, changed_from, rows, loaded_at FROM load_versions v
+        WHERE version = (SELECT MAX(version) FROM load_versions WHERE table_name = v.table_name)
+        ORDER BY table_name
+    """)}
+
+
+def main():
+    argparse.ArgumentParser(description="Show the latest load version per table").parse_args()
+    con = sqlite3.connect(DB_PATH)
+    try:
+        versions = latest(con)
+        if not versions:
+            print("No loads recorded yet")
+        for table, (version, changed_from, rows, loaded_at) in versions.items():
+            print(f"   {table:<16} v{version:<5} from {changed_from or 'all':<10} "
+                  f"{rows if rows is not None else '–':>8} rows  {loaded_at}")
+    finally:
+        con.close()
+
+
+if __name__ == "__main__":
+    main()
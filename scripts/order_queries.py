@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Aggregate queries over orders for the dashboard
+Every panel asks SQLite for exactly the rows it shows – date range and SKU
+filters go into the WHERE clause and the grouping happens in the query, over a
+covering index – so a page load reads the selected window instead of the whole
+order history. Net revenue is defined once, in NET_REVENUE. OrderPartitions
+keeps per-day totals across page loads and, when load_versions shows a new
+orders load, refetches only the days from the earliest one it changed
+
+    python scripts/order_queries.py --days 30   # print the panels for the latest 30 days
+"""
+import argparse
+import pathlib
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+import pandas as pd
+
+from load_versions import changed_since, current_versions
+
+DB_PATH = pathlib.Path(__file__).resolve().parents[1] / "db" / "erp.db"
+
+# Per order line; rows with a missing component drop out of SUM (as pandas' sum skipped NaN)
+NET_REVENUE = "gross_price_kzt * (1 - kaspi_fee_pct) - delivery_cost_kzt"
+
+MAX_CACHED_DAYS = 400  # beyond this OrderPartitions keeps only the latest requested range
+
+
+def create_order_indexes(con: sqlite3.Connection) -> None:
+    """Indexes the panels and the per-order upserts run on; plain statements, so a
+    caller's open transaction is not committed"""
+    if not con.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='orders'").fetchone():
+        return
+    # Covering: date-range scans and per-day / per-SKU sums never touch the table
+    con.execute("""CREATE INDEX IF NOT EXISTS idx_orders_date_sku ON orders(
+        order_date, sku_key, qty, gross_price_kzt, kaspi_fee_pct, delivery_cost_kzt)""")
+    # A short SKU selection seeks per SKU instead of scanning the whole range
+    con.execute("""CREATE INDEX IF NOT EXISTS idx_orders_sku_date ON orders(
+        sku_key, order_date, qty, gross_price_kzt, kaspi_fee_pct, delivery_cost_kzt)""")
+    # etl_sales and kaspi_orders_poller replace lines per order_id
+    if any(col[1] == 'order_id' for col in con.execute("PRAGMA table_info(orders)")):
+        con.execute("CREATE INDEX IF NOT EXISTS idx_orders_order_id ON orders(order_id)")
+
+
+def _filters(start: Optional[str], end: Optional[str],
+             skus: Optional[Sequence[str]]) -> Tuple[str, List]:
+    """WHERE clause + parameters for an inclusive ISO date range and SKU list"""
+    clauses, params = [], []
+    if start:
+        clauses.append("order_date >= ?")
+        params.append(str(start))
+    if end:
+        clauses.append("order_date <= ?")
+        params.append(str(end))
+    if skus:
+        clauses.append(f"sku_key IN ({','.join('?' * len(skus))})")
+        params.extend(skus)
+    return ("WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+
+def date_bounds(con: sqlite3.Connection) -> Tuple[Optional[str], Optional[str]]:
+    """First and last order_date (two index seeks)"""
+    return con.execute("SELECT MIN(order_date), MAX(order_date) FROM orders").fetchone()
+
+
+def sku_keys(con: sqlite3.Connection) -> List[str]:
+    return [r[0] for r in con.execute(
+        "SELECT DISTINCT sku_key FROM orders WHERE sku_key IS NOT NULL ORDER BY sku_key")]
+
+
+def kpis(con: sqlite3.Connection, start: Optional[str] = None, end: Optional[str] = None,
+         skus: Optional[Sequence[str]] = None) -> Dict[str, float]:
+    where, params = _filters(start, end, skus)
+    orders, net = con.execute(f"SELECT COUNT(*), SUM({NET_REVENUE}) FROM orders {where}", params).fetchone()
+    return {'orders': orders, 'net_revenue': net or 0.0}
+
+
+def daily_revenue(con: sqlite3.Connection, start: Optional[str] = None, end: Optional[str] = None,
+                  skus: Optional[Sequence[str]] = None) -> pd.DataFrame:
+    where, params = _filters(start, end, skus)
+    return pd.read_sql(f"""
+        SELECT order_date, SUM({NET_REVENUE}) AS net
+        FROM orders {where}
+        GROUP BY order_date
+        ORDER BY order_date
+    """, con, params=params, parse_dates=["order_date"])
+
+
+def revenue_by_sku(con: sqlite3.Connection, start: Optional[str] = None, end: Optional[str] = None,
+                   skus: Optional[Sequence[str]] = None, limit: Optional[int] = None) -> pd.DataFrame:
+    where, params = _filters(start, end, skus)
+    return pd.read_sql(f"""
+        SELECT sku_key, SUM({NET_REVENUE}) AS net
+        FROM orders {where}
+        GROUP BY sku_key
+        ORDER BY net DESC
+        LIMIT ?
+    """, con, params=params + [limit if limit else -1])
+
+
+def day_sku_totals(con: sqlite3.Connection, start: str, end: str) -> pd.DataFrame:
+    """Order lines, qty and net revenue per day and SKU in [start, end]"""
+    where, params = _filters(start, end, None)
+    return pd.read_sql(f"""
+        SELECT order_date, sku_key, COUNT(*) AS lines, SUM(qty) AS qty, SUM({NET_REVENUE}) AS net
+        FROM orders {where}
+        GROUP BY order_date, sku_key
+    """, con, params=params)
+
+
+def summarize(totals: pd.DataFrame, skus: Optional[Sequence[str]] = None):
+    """KPIs, daily net revenue and revenue by SKU from day_sku_totals rows"""
+    if skus:
+        totals = totals[totals['sku_key'].isin(skus)]
+    kpi = {'orders': int(totals['lines'].sum()), 'net_revenue': float(totals['net'].sum())}
+    daily = (totals.groupby('order_date', as_index=False)['net'].sum()
+                   .sort_values('order_date')
+                   .assign(order_date=lambda d: pd.to_datetime(d['order_date'])))
+    by_sku = (totals.groupby('sku_key', as_index=False, dropna=False)['net'].sum()
+                    .sort_values('net', ascending=False, ignore_index=True))
+    return kpi, daily, by_sku
+
+
+class OrderPartitions:
+    """day_sku_totals cached per day across page loads and sessions
+
+    Each call compares the orders load version with the cached one: days from
+    the earliest partition the newer loads touched are dropped (everything if
+    a load did not say), then only days of the requested range that are not
+    cached are fetched. Thread-safe.
+    """
+
+    def __init__(self, max_days: int = MAX_CACHED_DAYS):
+        self.max_days = max_days
+        self.version: Optional[int] = None
+        self.frame = pd.DataFrame(columns=['order_date', 'sku_key', 'lines', 'qty', 'net'])
+        self.days: Set[str] = set()  # fetched days, with or without orders
+        self.fetched_rows = 0
+        self._lock = threading.Lock()
+
+    def _invalidate(self, con: sqlite3.Connection, version: int) -> None:
+        if self.version is None or version == self.version:
+            return
+        changed, since = changed_since(con, 'orders', self.version)
+        if (changed and since is None) or version < self.version:  # unknown extent, or table reset
+            self.frame, self.days = self.frame.iloc[0:0], set()
+        elif changed:
+            self.frame = self.frame[self.frame['order_date'] < since]
+            self.days = {day for day in self.days if day < since}
+
+    def totals(self, con: sqlite3.Connection, start: str, end: str) -> pd.DataFrame:
+        with self._lock:
+            # Version first: a load landing mid-fetch is picked up on the next call
+            version, = current_versions(con, ['orders'])
+            self._invalidate(con, version)
+            self.version = version
+
+            wanted = pd.date_range(start, end).strftime('%Y-%m-%d')
+            missing = [day for day in wanted if day not in self.days]
+            if missing:
+                fetched = day_sku_totals(con, missing[0], missing[-1])
+                fetched = fetched[fetched['order_date'].isin(missing)]
+                self.frame = pd.concat([self.frame, fetched], ignore_index=True) if len(self.frame) else fetched
+                self.days.update(missing)
+                self.fetched_rows += len(fetched)
+            if len(self.days) > self.max_days:
+                self.frame = self.frame[self.frame['order_date'].between(start, end)]
+                self.days = set(wanted)
+            return self.frame[self.frame['order_date'].between(start, end)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dashboard aggregates from erp.db")
+    parser.add_argument("--days", type=int, default=30, help="window ending at the latest order")
+    parser.add_argument("--sku", action="append", help="restrict to SKU (repeatable)")
+    args = parser.parse_args()
+
+    con = sqlite3.connect(DB_PATH)
+    try:
+        create_order_indexes(con)
+        first, last = date_bounds(con)
+        if last is None:
+            print("⚠️ No orders loaded")
+            return
+        start = (pd.Timestamp(last) - pd.Timedelta(days=args.days - 1)).date().isoformat()
+        totals = kpis(con, start, last, args.sku)
+        print(f"📊 {start} – {last}: {totals['orders']:,} order lines, net revenue {totals['net_revenue']:,.0f} ₸")
+        print(daily_revenue(con, start, last, args.sku).to_string(index=False))
+        print(revenue_by_sku(con, start, last, args.sku, limit=20).to_string(index=False))
+    finally:
+        con.close()
+
+
+if __name__ == "__main__":
+    main()
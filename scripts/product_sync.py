@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Incremental sync of the products table
+Each listing carries a content hash over its API-relevant fields (row_hash)
+and one over the remaining columns (attr_hash); a run diffs the catalog
+against the stored hashes and writes only new / changed rows
+"""
+import logging
+import pathlib
+import sqlite3
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from catalog_loader import (CATALOG_PATH, PRODUCT_COLUMNS, load_catalog, products_for_db,
+                            rejected_lines, source_lines)
+from rejects import clear_rejects, reject_lines, reject_rows
+
+logger = logging.getLogger(__name__)
+
+# One products row per store listing – SKU_ID alone repeats across listings
+KEY_COLUMNS = ['store_name', 'sku_id_ksp', 'sku_id']
+
+# Exactly the fields prepare_products_for_api sends; edits to anything else do not resync a row
+HASH_COLUMNS = [
+    'sku_id', 'kaspi_name_core', 'kaspi_art_1', 'product_type',
+    'brand', 'model', 'color', 'our_size', 'gender', 'season', 'weight_kg',
+]
+# Everything else is stored too; edits there are written but not sent
+ATTR_COLUMNS = [col for col in PRODUCT_COLUMNS.values() if col not in HASH_COLUMNS]
+COLUMN_TYPES = {'stock_entered': 'INTEGER', 'base_cost_cny': 'REAL', 'weight_kg': 'REAL'}
+
+TABLE_COLUMNS = ['product_key', *PRODUCT_COLUMNS.values(), 'kaspi_product_id', 'row_hash', 'attr_hash']
+
+
+def create_products_table(con: sqlite3.Connection) -> None:
+    """Create the products table, rebuilding a legacy one (no row_hash) in place"""
+    existing = [row[1] for row in con.execute("PRAGMA table_info(products)")]
+    legacy = None
+    if existing and 'row_hash' not in existing:
+        legacy = pd.read_sql("SELECT * FROM products", con)
+        con.execute("DROP TABLE products")
+
+    column_defs = "".join(f"        {col:<20}{COLUMN_TYPES.get(col, 'TEXT')},\n"
+                          for col in TABLE_COLUMNS[1:])
+    con.executescript(f"""
+    CREATE TABLE IF NOT EXISTS products (
+        product_key         TEXT PRIMARY KEY,
+{column_defs}        last_updated        TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE INDEX IF NOT EXISTS idx_products_sku_id ON products(sku_id);
+    CREATE INDEX IF NOT EXISTS idx_products_kaspi_art_1 ON products(kaspi_art_1);
+    """)
+
+    if legacy is not None:
+        rows = _with_keys(legacy.reindex(columns=TABLE_COLUMNS[1:-2]))
+        write_products(con, rows, [])
+        logger.info(f"🔧 Rebuilt legacy products table with row hashes ({len(rows)} rows)")
+    else:
+        rehash_stored(con)
+    con.commit()
+
+
+def rehash_stored(con: sqlite3.Connection) -> int:
+    """Recompute stored hashes from the stored columns (caller commits)
+
+    Only rows hashed under an older HASH_COLUMNS differ, so a change to the hashed
+    fields does not by itself mark every listing as changed.
+    """
+    stored = pd.read_sql(f"SELECT {', '.join(TABLE_COLUMNS)} FROM products", con)
+    if stored.empty:
+        return 0
+    stale = stored[row_hashes(stored).ne(stored['row_hash']) |
+                   row_hashes(stored, ATTR_COLUMNS).ne(stored['attr_hash'])]
+    if not stale.empty:
+        con.executemany("UPDATE products SET row_hash=?, attr_hash=? WHERE product_key=?",
+                        zip(row_hashes(stale), row_hashes(stale, ATTR_COLUMNS), stale['product_key']))
+        logger.info(f"🔧 Re-hashed {len(stale)} stored products")
+    return len(stale)
+
+
+def _canonical(df: pd.DataFrame, columns: List[str]) -> pd.DataFrame:
+    """Text form that survives a SQLite round trip: numbers as float repr, NULL as ''"""
+    out = {}
+    for col in columns:
+        if col in COLUMN_TYPES:
+            out[col] = pd.to_numeric(df[col], errors='coerce').astype(float).astype(str)
+        else:
+            out[col] = df[col].astype(object).where(df[col].notna(), '').astype(str)
+    return pd.DataFrame(out, index=df.index)
+
+
+def row_hashes(df: pd.DataFrame, columns: List[str] = HASH_COLUMNS) -> pd.Series:
+    """Stable 64-bit content hash per row over `columns`, as 16 hex digits"""
+    hashes = pd.util.hash_pandas_object(_canonical(df, columns), index=False)
+    return hashes.map('{:016x}'.format)
+
+
+def _with_keys(db_df: pd.DataFrame) -> pd.DataFrame:
+    """Add product_key and hashes; drop rows without a SKU_ID and repeated keys"""
+    keys = _canonical(db_df, KEY_COLUMNS)
+    db_df = db_df.assign(product_key=keys['store_name'] + '|' + keys['sku_id_ksp'] + '|' + keys['sku_id'],
+                         row_hash=row_hashes(db_df),
+                         attr_hash=row_hashes(db_df, ATTR_COLUMNS))
+    db_df = db_df[keys['sku_id'].str.strip().ne('')]
+    duplicated = db_df['product_key'].duplicated()
+    if duplicated.any():
+        logger.warning(f"⚠️ {int(duplicated.sum())} repeated listings ignored: "
+                       f"{db_df.loc[duplicated, 'product_key'].head(3).tolist()}")
+        db_df = db_df[~duplicated]
+    return db_df
+
+
+def prepare_products(catalog_df: pd.DataFrame) -> pd.DataFrame:
+    """Catalog rows (loader column names) → products table rows, index preserved"""
+    db_df = products_for_db(catalog_df)
+    if 'kaspi_product_id' not in db_df.columns:
+        db_df['kaspi_product_id'] = None
+    return _with_keys(db_df)[TABLE_COLUMNS]
+
+
+def diff_products(con: sqlite3.Connection, products: pd.DataFrame) -> Tuple[pd.Series, List[str]]:
+    """Status per row and the product keys that disappeared
+
+    new / changed (API fields differ – resend) / updated (only stored
+    attributes differ – rewrite) / unchanged
+    """
+    stored = pd.read_sql("SELECT product_key, row_hash, attr_hash FROM products", con)
+    deleted = stored.loc[~stored['product_key'].isin(products['product_key']), 'product_key'].tolist()
+
+    matched = stored.set_index('product_key').reindex(products['product_key'])
+    status = pd.Series(
+        np.select([matched['row_hash'].isna().to_numpy(),
+                   matched['row_hash'].ne(products['row_hash'].to_numpy()).to_numpy(),
+                   matched['attr_hash'].ne(products['attr_hash'].to_numpy()).to_numpy()],
+                  ['new', 'changed', 'updated'], 'unchanged'),
+        index=products.index)
+    return status, deleted
+
+
+def write_products(con: sqlite3.Connection, rows: pd.DataFrame, deleted: List[str]) -> None:
+    """Upsert `rows` and delete `deleted` keys (caller commits)"""
+    if deleted:
+        con.executemany("DELETE FROM products WHERE product_key=?", [(k,) for k in deleted])
+    if rows.empty:
+        return
+    values = rows[TABLE_COLUMNS].astype(object)
+    values = values.where(values.notna(), None).values.tolist()
+    updates = ", ".join(f"{col}=excluded.{col}" for col in TABLE_COLUMNS[1:])
+    con.executemany(f"""
+        INSERT INTO products ({', '.join(TABLE_COLUMNS)})
+        VALUES ({', '.join('?' * len(TABLE_COLUMNS))})
+        ON CONFLICT(product_key) DO UPDATE SET {updates}, last_updated=CURRENT_TIMESTAMP
+    """, values)
+
+
+def reject_dropped(con: sqlite3.Connection, etl: str, catalog_df: pd.DataFrame,
+                   products: pd.DataFrame, path: pathlib.Path = CATALOG_PATH) -> int:
+    """Quarantine the catalog's malformed lines and the listings prepare_products
+    left out (caller commits); returns rows rejected"""
+    source = path.name
+    clear_rejects(con, etl, source)
+    rejected = reject_lines(con, etl, source, rejected_lines(path))
+
+    raw, lines = load_catalog(path), source_lines(path)
+    dropped = pd.Series(~catalog_df.index.isin(products.index), index=catalog_df.index)
+    blank = catalog_df['SKU_ID'].astype(str).str.strip().eq('')
+    rejected += reject_rows(con, etl, source, raw, dropped & blank, "blank SKU_ID", lines)
+    rejected += reject_rows(con, etl, source, raw, dropped & ~blank,
+                            "repeated listing (Store_name, SKU_ID_KSP, SKU_ID)", lines)
+    return rejected
+
+
+def summarize(status: pd.Series, deleted: List[str]) -> Dict[str, int]:
+    counts = {s: int((status == s).sum()) for s in ('new', 'changed', 'updated', 'unchanged')}
+    counts['deleted'] = len(deleted)
+    return counts
+
+
+def sync_products(con: sqlite3.Connection, catalog_df: pd.DataFrame,
+                  etl: Optional[str] = None, path: pathlib.Path = CATALOG_PATH) -> Dict[str, int]:
+    """Diff the catalog against products and write only what changed
+
+    With `etl` set, listings that cannot be stored go to the rejects table.
+    """
+    products = prepare_products(catalog_df)
+    status, deleted = diff_products(con, products)
+    write_products(con, products[status.ne('unchanged')], deleted)
+    if etl:
+        reject_dropped(con, etl, catalog_df, products, path)
+    con.commit()
+    counts = summarize(status, deleted)
+    logger.info(f"📊 Products: {counts['new']} new, {counts['changed']} changed, "
+                f"{counts['updated']} updated, {counts['deleted']} deleted, "
+                f"{counts['unchanged']} unchanged")
+    return counts
@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+"""
+Buffered writes to size_recommendations
+Recommendations and customer confirmations are queued in memory and written
+in one transaction per batch (executemany) – when the batch fills, every
+flush interval from a background thread, and on close / interpreter exit –
+instead of one connection and commit per recommendation
+
+    python scripts/recommendation_writer.py --benchmark 5000   # per-row commit vs buffered
+"""
+import argparse
+import asyncio
+import atexit
+import logging
+import pathlib
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Iterable, List, Optional, Tuple
+
+DB_PATH = pathlib.Path(__file__).resolve().parents[1] / "db" / "erp.db"
+
+BATCH_SIZE = 500
+FLUSH_INTERVAL = 1.0  # seconds a queued row may wait before it is written
+MAX_QUEUED = 100_000  # rows kept for retry while the database refuses writes; older ones are dropped
+UNMATCHED_TTL = 3600.0  # seconds a confirmation waits for its recommendation row to be written
+
+INSERT_SQL = """
+    INSERT INTO size_recommendations
+    (order_id, recommended_size, confidence_score, reasoning,
+     customer_height, customer_weight, alternative_sizes, gender, product_type, brand)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+CONFIRM_SQL = """
+    UPDATE size_recommendations
+    SET final_size = ?, customer_confirmed = TRUE,
+        confirmed_at = strftime('%Y-%m-%d %H:%M:%f', 'now')
+    WHERE order_id = ?
+"""
+
+# Columns added after the table was first shipped: what the size was for and when it was confirmed
+ADDED_COLUMNS = {
+    'gender': 'TEXT',
+    'product_type': 'TEXT',
+    'brand': 'TEXT',
+    'confirmed_at': 'TIMESTAMP',
+}
+
+logger = logging.getLogger(__name__)
+
+
+def create_recommendations_table(con: sqlite3.Connection) -> None:
+    con.executescript("""
+    CREATE TABLE IF NOT EXISTS size_recommendations (
+        order_id TEXT,
+        recommended_size TEXT,
+        confidence_score REAL,
+        reasoning TEXT,
+        customer_height INTEGER,
+        customer_weight INTEGER,
+        alternative_sizes TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        final_size TEXT,
+        customer_confirmed BOOLEAN DEFAULT FALSE
+    );
+    CREATE INDEX IF NOT EXISTS idx_size_recommendations_order ON size_recommendations(order_id);
+    """)
+    existing = {row[1] for row in con.execute("PRAGMA table_info(size_recommendations)")}
+    for column, declaration in ADDED_COLUMNS.items():
+        if column not in existing:
+            con.execute(f"ALTER TABLE size_recommendations ADD COLUMN {column} {declaration}")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_size_recommendations_confirmed "
+                "ON size_recommendations(confirmed_at)")
+
+
+class RecommendationWriter:
+    """Queue of size_recommendations inserts and confirmations, written in batches
+
+    Thread-safe; `add` / `confirm` never touch the database unless the batch
+    is full, async callers use `add_async` / `confirm_async` to flush off the
+    event loop. Use as a (async) context manager or call `close()`.
+
+    A batch the database refuses (e.g. locked by an ETL) goes back to the
+    queue for the next flush. A confirmation whose order has no row yet stays
+    queued until the row is written, for up to UNMATCHED_TTL seconds.
+    """
+
+    def __init__(self, db_path: pathlib.Path = DB_PATH, batch_size: int = BATCH_SIZE,
+                 flush_interval: Optional[float] = FLUSH_INTERVAL):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.rows: List[Tuple] = []
+        self.confirmations: dict = {}  # order_id → final size, latest wins
+        self.waiting: dict = {}        # order_id → (final size, queued at) not yet applied
+        self.written = 0
+        self.confirmed = 0
+        self._lock = threading.Lock()        # guards the queues
+        self._write_lock = threading.Lock()  # one transaction at a time
+        self._con: Optional[sqlite3.Connection] = None
+        self._closed = threading.Event()
+        self._flusher = None
+        if flush_interval:
+            self._flusher = threading.Thread(target=self._flush_every, args=(flush_interval,),
+                                             name="recommendation-writer", daemon=True)
+            self._flusher.start()
+
+    # --- queueing -----------------------------------------------------------
+
+    def _queue_row(self, order_id, recommendation, customer_height, customer_weight,
+                   gender=None, product_type=None, brand=None) -> bool:
+        row = (str(order_id), recommendation.recommended_size, float(recommendation.confidence_score),
+               recommendation.reasoning, customer_height, customer_weight,
+               ','.join(recommendation.alternative_sizes), gender, product_type, brand)
+        with self._lock:
+            self.rows.append(row)
+            return len(self.rows) >= self.batch_size
+
+    def _queue_confirmations(self, confirmations: Iterable[Tuple[str, str]]) -> bool:
+        with self._lock:
+            for order_id, final_size in confirmations:
+                self.confirmations[str(order_id)] = final_size
+            return len(self.confirmations) >= self.batch_size
+
+    def add(self, order_id, recommendation, customer_height, customer_weight,
+            gender=None, product_type=None, brand=None) -> None:
+        """Queue one SizeRecommendation for an order (gender / product_type / brand let
+        size_knn learn from the confirmed outcome)"""
+        if self._queue_row(order_id, recommendation, customer_height, customer_weight,
+                           gender, product_type, brand):
+            self.flush()
+
+    def confirm(self, order_id, final_size: str) -> None:
+        """Queue the size a customer confirmed for an order"""
+        self.confirm_sizes([(order_id, final_size)])
+
+    def confirm_sizes(self, confirmations: Iterable[Tuple[str, str]]) -> None:
+        """Queue many (order_id, final_size) confirmations"""
+        if self._queue_confirmations(confirmations):
+            self.flush()
+
+    async def add_async(self, order_id, recommendation, customer_height, customer_weight,
+                        gender=None, product_type=None, brand=None) -> None:
+        if self._queue_row(order_id, recommendation, customer_height, customer_weight,
+                           gender, product_type, brand):
+            await asyncio.to_thread(self.flush)
+
+    async def confirm_async(self, order_id, final_size: str) -> None:
+        if self._queue_confirmations([(order_id, final_size)]):
+            await asyncio.to_thread(self.flush)
+
+    # --- writing ------------------------------------------------------------
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._con is None:
+            self._con = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            create_recommendations_table(self._con)
+        return self._con
+
+    def flush(self) -> int:
+        """Write everything queued in one transaction; returns rows written"""
+        with self._write_lock:
+            now = time.monotonic()
+            with self._lock:
+                rows, self.rows = self.rows, []
+                confirmations, self.confirmations = self.confirmations, {}
+                pending, self.waiting = self.waiting, {}
+            pending.update((order_id, (size, now)) for order_id, size in confirmations.items())
+            if not rows and not pending:
+                return 0
+            unmatched = {}
+            try:
+                con = self._connection()
+                with con:
+                    # Inserts first so a confirmation can land on a row queued in the same batch
+                    con.executemany(INSERT_SQL, rows)
+                    for order_id, (size, queued_at) in pending.items():
+                        if not con.execute(CONFIRM_SQL, (size, order_id)).rowcount:
+                            unmatched[order_id] = (size, queued_at)
+            except sqlite3.Error as e:
+                logger.warning(f"⚠️ Could not save {len(rows)} size recommendations "
+                               f"and {len(pending)} confirmations, retrying on the next flush: {e}")
+                self._requeue(rows, pending)
+                return 0
+
+            expired = [order_id for order_id, (_, queued_at) in unmatched.items()
+                       if now - queued_at > UNMATCHED_TTL]
+            if expired:
+                logger.error(f"❌ Dropped {len(expired)} confirmations with no size recommendation "
+                             f"after {UNMATCHED_TTL:.0f}s (e.g. order {expired[0]})")
+            with self._lock:
+                self.waiting = {order_id: value for order_id, value in unmatched.items()
+                                if order_id not in expired}
+            self.written += len(rows)
+            self.confirmed += len(pending) - len(unmatched)
+            return len(rows)
+
+    def _requeue(self, rows: List[Tuple], pending: dict) -> None:
+        """Put a failed batch back in front of whatever was queued meanwhile"""
+        with self._lock:
+            self.rows[:0] = rows
+            if len(self.rows) > MAX_QUEUED:
+                dropped = len(self.rows) - MAX_QUEUED
+                del self.rows[:dropped]
+                logger.error(f"❌ Dropped {dropped} oldest size recommendations – "
+                             f"more than {MAX_QUEUED} waiting for the database")
+            # Confirmations queued meanwhile are newer and win at the next flush
+            self.waiting = pending
+
+    def _flush_every(self, interval: float) -> None:
+        while not self._closed.wait(interval):
+            self.flush()
+
+    def close(self) -> None:
+        """Flush what is left and release the connection"""
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        self.flush()
+        if self.rows or self.waiting:
+            logger.error(f"❌ {len(self.rows)} size recommendations and {len(self.waiting)} "
+                         f"confirmations not saved at close")
+        if self._con is not None:
+            self._con.close()
+            self._con = None
+
+    def __enter__(self) -> "RecommendationWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    async def __aenter__(self) -> "RecommendationWriter":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await asyncio.to_thread(self.close)
+
+
+_default_writer: Optional[RecommendationWriter] = None
+_default_lock = threading.Lock()
+
+
+def default_writer() -> RecommendationWriter:
+    """Process-wide writer for DB_PATH, flushed at interpreter exit"""
+    global _default_writer
+    with _default_lock:
+        if _default_writer is None:
+            _default_writer = RecommendationWriter()
+            atexit.register(_default_writer.close)
+        return _default_writer
+
+
+def benchmark(rows: int) -> None:
+    """Rows per second: one connection and commit per row vs the buffered writer"""
+    from size_recommendation_engine import SizeRecommendation
+
+    rec = SizeRecommendation("M", 0.9, "benchmark", ["S", "L"])
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        for i in range(rows):
+            con = sqlite3.connect(pathlib.Path(tmp) / "per_row.db")
+            create_recommendations_table(con)
+            con.execute(INSERT_SQL, (str(i), rec.recommended_size, rec.confidence_score, rec.reasoning,
+                                     175, 80, ','.join(rec.alternative_sizes), 'Men', 'CL', None))
+            con.commit()
+            con.close()
+        per_row = rows / (time.perf_counter() - start)
+
+        db = pathlib.Path(tmp) / "buffered.db"
+        start = time.perf_counter()
+        with RecommendationWriter(db) as writer:
+            for i in range(rows):
+                writer.add(i, rec, 175, 80)
+            writer.confirm_sizes((i, "L") for i in range(0, rows, 2))
+        buffered = rows / (time.perf_counter() - start)
+
+        con = sqlite3.connect(db)
+        total, confirmed = con.execute("SELECT COUNT(*), SUM(customer_confirmed) "
+                                       "FROM size_recommendations").fetchone()
+        con.close()
+    print(f"   per-row commit {per_row:>10,.0f} rows/s")
+    print(f"   buffered       {buffered:>10,.0f} rows/s ({buffered / per_row:.0f}x)")
+    print(f"   buffered run stored {total} rows, {confirmed} confirmed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Buffered size_recommendations writer")
+    parser.add_argument("--benchmark", type=int, metavar="ROWS", help="compare write throughput")
+    args = parser.parse_args()
+    if args.benchmark:
+        benchmark(args.benchmark)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Shared quarantine for rows an ETL could not load
+ETLs route failing rows here in bulk (one boolean mask per reason) with the
+source file, line and raw payload instead of dropping them; each run replaces
+the previous rejects of the files it loaded
+
+    python scripts/rejects.py            # summary per ETL / file / reason
+    python scripts/rejects.py --show 20  # latest rejected rows
+"""
+import argparse
+import logging
+import pathlib
+import sqlite3
+from typing import Optional
+
+import pandas as pd
+
+DB_PATH = pathlib.Path(__file__).resolve().parents[1] / "db" / "erp.db"
+
+logger = logging.getLogger(__name__)
+
+REJECT_COLUMNS = ['etl', 'source_file', 'line', 'reason', 'payload']
+
+# Spreadsheet / CSV row of DataFrame index 0: the header is line 1
+FIRST_DATA_LINE = 2
+
+
+def create_rejects_table(con: sqlite3.Connection) -> None:
+    con.executescript("""
+    CREATE TABLE IF NOT EXISTS rejects (
+        id              INTEGER PRIMARY KEY AUTOINCREMENT,
+        etl             TEXT NOT NULL,
+        source_file     TEXT NOT NULL,
+        line            INTEGER,
+        reason          TEXT NOT NULL,
+        payload         TEXT,
+        rejected_at     TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE INDEX IF NOT EXISTS idx_rejects_source ON rejects(etl, source_file);
+    """)
+
+
+def clear_rejects(con: sqlite3.Connection, etl: str, source_file: str) -> None:
+    """Forget the previous run's rejects for one file (caller commits)"""
+    create_rejects_table(con)
+    con.execute("DELETE FROM rejects WHERE etl=? AND source_file=?", (etl, source_file))
+
+
+def _payloads(rows: pd.DataFrame) -> list:
+    """Each row as a JSON object, dates in ISO format, values that JSON lacks as text"""
+    if rows.empty:
+        return []
+    return rows.to_json(orient='records', lines=True, force_ascii=False,
+                        date_format='iso', default_handler=str).splitlines()
+
+
+def reject_rows(con: sqlite3.Connection, etl: str, source_file: str,
+                frame: pd.DataFrame, mask: pd.Series, reason: str,
+                lines: Optional[pd.Series] = None) -> int:
+    """Quarantine `frame[mask]` under `reason` (caller commits); returns rows rejected
+
+    `lines` maps frame index → source line; by default the index is taken as the
+    0-based data row of a file with one header line.
+    """
+    rows = frame[mask.reindex(frame.index, fill_value=False).astype(bool)]
+    if rows.empty:
+        return 0
+    if lines is None:
+        line_numbers = (pd.Series(rows.index, index=rows.index) + FIRST_DATA_LINE).tolist()
+    else:
+        line_numbers = lines.reindex(rows.index).astype(object).where(lambda s: s.notna(), None).tolist()
+    con.executemany(
+        f"INSERT INTO rejects ({', '.join(REJECT_COLUMNS)}) VALUES (?, ?, ?, ?, ?)",
+        [(etl, source_file, line, reason, payload)
+         for line, payload in zip(line_numbers, _payloads(rows))])
+    logger.warning(f"⚠️ {source_file}: {len(rows)} rows rejected – {reason}")
+    return len(rows)
+
+
+def reject_lines(con: sqlite3.Connection, etl: str, source_file: str, bad: pd.DataFrame) -> int:
+    """Quarantine unparsable source lines: `bad` has line, reason and payload (raw text)"""
+    if bad.empty:
+        return 0
+    values = bad[['line', 'reason', 'payload']].astype(object)
+    values = values.where(values.notna(), None)
+    con.executemany(
+        f"INSERT INTO rejects ({', '.join(REJECT_COLUMNS)}) VALUES (?, ?, ?, ?, ?)",
+        [(etl, source_file, *row) for row in values.itertuples(index=False, name=None)])
+    logger.warning(f"⚠️ {source_file}: {len(bad)} malformed lines rejected")
+    return len(bad)
+
+
+def summary(con: sqlite3.Connection) -> pd.DataFrame:
+    """Rejected rows per ETL, file and reason"""
+    create_rejects_table(con)
+    return pd.read_sql("""
+        SELECT etl, source_file, reason,
+               COUNT(*)          AS rows,
+               MIN(line)         AS first_line,
+               MAX(rejected_at)  AS last_rejected
+        FROM rejects
+        GROUP BY etl, source_file, reason
+        ORDER BY etl, source_file, rows DESC
+    """, con)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show rows quarantined by the ETLs")
+    parser.add_argument("--show", type=int, metavar="N", help="print the N latest rejected rows")
+    args = parser.parse_args()
+
+    con = sqlite3.connect(DB_PATH)
+    try:
+        report = summary(con)
+        if report.empty:
+            print("✅ No rejected rows")
+            return
+        print("\n🚫 REJECTED ROWS:")
+        print(report.to_string(index=False))
+        if args.show:
+            latest = pd.read_sql("SELECT etl, source_file, line, reason, payload FROM rejects "
+                                 "ORDER BY id DESC LIMIT ?", con, params=(args.show,))
+            print(f"\n   Latest {len(latest)}:")
+            print(latest.to_string(index=False, max_colwidth=80))
+    finally:
+        con.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+Replenishment levels for every SKU at once
+Daily demand mean / std come from per-SKU daily order totals aggregated in
+SQLite (days without sales count as zero, days before a SKU's first sale
+don't count) and are finished in NumPy for all SKUs at once; lead times
+from purchases (arrival − order date) unless set per SKU. With both
+variabilities the safety stock is z·√(L·σd² + d²·σL²); the reorder point is
+d·L + safety stock and the order-up-to level covers lead time plus review
+period. Results replace the `replenishment` table read by the dashboard and
+buyers
+
+    python scripts/replenishment.py                         # compute and store
+    python scripts/replenishment.py --set SKU --lead 14 --service 0.98
+    python scripts/replenishment.py --benchmark 5000        # synthetic SKUs
+"""
+import argparse
+import logging
+import pathlib
+import sqlite3
+import tempfile
+import time
+from statistics import NormalDist
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from load_versions import record_load
+from order_queries import create_order_indexes
+
+DB_PATH = pathlib.Path(__file__).resolve().parents[1] / "db" / "erp.db"
+
+WINDOW_DAYS = 90        # demand history used for mean / std
+LEAD_DAYS = 20.0        # when neither settings nor purchases give one
+SERVICE_LEVEL = 0.95    # probability of no stock-out during a lead time
+REVIEW_DAYS = 7.0       # time between orders; order-up-to covers lead + review
+
+RESULT_COLUMNS = [
+    'sku_key', 'as_of', 'demand_days', 'demand_mean', 'demand_std', 'lead_days', 'lead_std',
+    'service_level', 'review_days', 'safety_stock', 'reorder_point', 'order_up_to',
+    'on_hand', 'on_order', 'order_qty', 'need_reorder',
+]
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def create_replenishment_tables(con: sqlite3.Connection) -> None:
+    con.executescript("""
+    -- Per-SKU overrides; NULL falls back to purchases history / defaults
+    CREATE TABLE IF NOT EXISTS replenishment_settings (
+        sku_key        TEXT PRIMARY KEY,
+        lead_days      REAL,
+        service_level  REAL,
+        review_days    REAL
+    );
+    CREATE TABLE IF NOT EXISTS replenishment (
+        sku_key        TEXT PRIMARY KEY,
+        as_of          TEXT,
+        demand_days    INTEGER,
+        demand_mean    REAL,
+        demand_std     REAL,
+        lead_days      REAL,
+        lead_std       REAL,
+        service_level  REAL,
+        review_days    REAL,
+        safety_stock   REAL,
+        reorder_point  INTEGER,
+        order_up_to    INTEGER,
+        on_hand        INTEGER,
+        on_order       INTEGER,
+        order_qty      INTEGER,
+        need_reorder   BOOLEAN,
+        computed_at    TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    """)
+
+
+def z_scores(service_levels: np.ndarray) -> np.ndarray:
+    """Standard normal quantiles, one inv_cdf per distinct service level"""
+    levels, index = np.unique(np.clip(service_levels, 0.5, 0.9999), return_inverse=True)
+    return np.array([NormalDist().inv_cdf(p) for p in levels])[index]
+
+
+def demand_stats(total: np.ndarray, total_sq: np.ndarray, first_day: np.ndarray, window_days: int):
+    """Mean / std of daily demand per SKU from Σq and Σq² over its sale days
+
+    `first_day` counts back from as_of to the SKU's first sale (-1: none in the
+    window); days without sales count as zero demand, days before the first
+    sale don't count at all.
+    """
+    observed = np.where(first_day < 0, window_days, np.minimum(first_day + 1, window_days))
+    mean = total / observed
+    variance = np.maximum(total_sq - observed * mean ** 2, 0.0) / np.maximum(observed - 1, 1)
+    return observed, mean, np.sqrt(variance)
+
+
+def levels(mean: np.ndarray, std: np.ndarray, lead: np.ndarray, lead_std: np.ndarray,
+           z: np.ndarray, review: np.ndarray, on_hand: np.ndarray, on_order: np.ndarray) -> Dict:
+    """Safety stock, ROP, order-up-to level and order quantity (all arrays)"""
+    safety = z * np.sqrt(lead * std ** 2 + mean ** 2 * lead_std ** 2)
+    reorder_point = np.ceil(mean * lead + safety)
+    cover = lead + review
+    order_up_to = np.ceil(mean * cover + z * np.sqrt(cover * std ** 2 + mean ** 2 * lead_std ** 2))
+    position = on_hand + on_order
+    order_qty = np.where(position <= reorder_point, np.maximum(order_up_to - position, 0), 0).astype(int)
+    return {
+        'safety_stock': safety,
+        'reorder_point': reorder_point.astype(int),
+        'order_up_to': order_up_to.astype(int),
+        'order_qty': order_qty,
+        'need_reorder': order_qty > 0,  # at or below ROP with something to order (not a dead SKU)
+    }
+
+
+def _table_exists(con: sqlite3.Connection, name: str) -> bool:
+    return con.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (name,)).fetchone() is not None
+
+
+def compute(con: sqlite3.Connection, as_of: Optional[str] = None, window_days: int = WINDOW_DAYS,
+            skus: Optional[Sequence[str]] = None, lead_days: float = LEAD_DAYS,
+            service_level: float = SERVICE_LEVEL, review_days: float = REVIEW_DAYS) -> pd.DataFrame:
+    """Replenishment levels for every SKU in stock, sold in the window, ordered or configured"""
+    create_replenishment_tables(con)
+    has_orders, has_stock, has_purchases = (_table_exists(con, t) for t in ('orders', 'stock', 'purchases'))
+    if as_of is None:
+        as_of = con.execute("SELECT MAX(order_date) FROM orders").fetchone()[0] if has_orders else None
+        as_of = as_of or pd.Timestamp.today().date().isoformat()
+    start = (pd.Timestamp(as_of) - pd.Timedelta(days=window_days - 1)).date().isoformat()
+    sku_filter = f"AND sku_key IN ({','.join('?' * len(skus))})" if skus else ""
+    sku_params = list(skus or [])
+
+    # Daily totals per SKU inside the window, reduced to Σq, Σq² and the first sale ever –
+    # one row per SKU comes back instead of one per SKU and day
+    sales = pd.read_sql(f"""
+        SELECT sku_key, SUM(qty) AS total, SUM(qty * qty) AS total_sq,
+               (SELECT MIN(o.order_date) FROM orders o WHERE o.sku_key = d.sku_key) AS first_date
+        FROM (
+            SELECT sku_key, order_date, SUM(qty) AS qty FROM orders
+            WHERE order_date >= ? AND order_date <= ? AND sku_key IS NOT NULL {sku_filter}
+            GROUP BY order_date, sku_key
+        ) d
+        GROUP BY sku_key
+    """, con, params=[start, as_of, *sku_params]) if has_orders else pd.DataFrame(columns=['sku_key', 'total', 'total_sq', 'first_date'])
+    stock = pd.read_sql(f"SELECT sku_key, SUM(qty_on_hand) AS on_hand FROM stock WHERE 1 {sku_filter} GROUP BY sku_key",
+                        con, params=sku_params) if has_stock else pd.DataFrame(columns=['sku_key', 'on_hand'])
+    purchases = pd.read_sql(f"""
+        SELECT sku_key,
+               AVG(julianday(arrival_date) - julianday(order_date)) AS lead_mean,
+               AVG((julianday(arrival_date) - julianday(order_date)) * (julianday(arrival_date) - julianday(order_date))) AS lead_sq,
+               SUM(CASE WHEN arrival_date > ? AND order_date <= ? THEN qty ELSE 0 END) AS on_order
+        FROM purchases
+        WHERE arrival_date IS NOT NULL AND order_date IS NOT NULL {sku_filter}
+        GROUP BY sku_key
+    """, con, params=[as_of, as_of, *sku_params]) if has_purchases else pd.DataFrame(columns=['sku_key', 'lead_mean', 'lead_sq', 'on_order'])
+    settings = pd.read_sql(f"SELECT * FROM replenishment_settings WHERE 1 {sku_filter}", con, params=sku_params)
+
+    keys = pd.Index(pd.concat([stock['sku_key'], sales['sku_key'], purchases['sku_key'],
+                               settings['sku_key']]).dropna().unique())
+    n = len(keys)
+    if not n:
+        return pd.DataFrame(columns=RESULT_COLUMNS)
+
+    def column(frame: pd.DataFrame, name: str) -> np.ndarray:
+        return frame.set_index('sku_key')[name].reindex(keys).to_numpy(float)
+
+    first_day = (np.datetime64(as_of, 'D')
+                 - pd.to_datetime(sales['first_date']).to_numpy('datetime64[D]')).astype(int)
+    first_day = pd.Series(first_day, index=sales['sku_key']).reindex(keys, fill_value=-1).to_numpy()
+    observed, mean, std = demand_stats(np.nan_to_num(column(sales, 'total')),
+                                       np.nan_to_num(column(sales, 'total_sq')), first_day, window_days)
+
+    lead_hist = column(purchases, 'lead_mean')
+    lead_std = np.sqrt(np.maximum(column(purchases, 'lead_sq') - lead_hist ** 2, 0.0))
+    lead = np.where(np.isnan(column(settings, 'lead_days')),
+                    np.where(np.isnan(lead_hist), lead_days, lead_hist), column(settings, 'lead_days'))
+    lead_std = np.where(np.isnan(column(settings, 'lead_days')), np.nan_to_num(lead_std), 0.0)
+    service = np.nan_to_num(column(settings, 'service_level'), nan=service_level)
+    review = np.nan_to_num(column(settings, 'review_days'), nan=review_days)
+    on_hand = np.nan_to_num(column(stock, 'on_hand'))
+    on_order = np.nan_to_num(column(purchases, 'on_order'))
+
+    result = levels(mean, std, lead, lead_std, z_scores(service), review, on_hand, on_order)
+    return pd.DataFrame({
+        'sku_key': keys, 'as_of': as_of, 'demand_days': observed, 'demand_mean': mean, 'demand_std': std,
+        'lead_days': lead, 'lead_std': lead_std, 'service_level': service, 'review_days': review,
+        'safety_stock': result['safety_stock'], 'reorder_point': result['reorder_point'],
+        'order_up_to': result['order_up_to'], 'on_hand': on_hand.astype(int), 'on_order': on_order.astype(int),
+        'order_qty': result['order_qty'], 'need_reorder': result['need_reorder'],
+    })[RESULT_COLUMNS]
+
+
+def write_replenishment(con: sqlite3.Connection, frame: pd.DataFrame) -> None:
+    """Replace the replenishment table with `frame` in one transaction"""
+    create_replenishment_tables(con)
+    rows = frame[RESULT_COLUMNS].astype(object).where(frame[RESULT_COLUMNS].notna(), None)
+    with con:
+        con.execute("DELETE FROM replenishment")
+        con.executemany(f"INSERT INTO replenishment ({', '.join(RESULT_COLUMNS)}) "
+                        f"VALUES ({', '.join('?' * len(RESULT_COLUMNS))})",
+                        rows.itertuples(index=False, name=None))
+        record_load(con, "replenishment", rows=len(frame))
+
+
+def load_replenishment(con: sqlite3.Connection, skus: Optional[Sequence[str]] = None) -> pd.DataFrame:
+    """Stored levels, SKUs to reorder first"""
+    if not _table_exists(con, 'replenishment'):
+        return pd.DataFrame(columns=RESULT_COLUMNS)
+    where = f"WHERE sku_key IN ({','.join('?' * len(skus))})" if skus else ""
+    return pd.read_sql(f"SELECT {', '.join(RESULT_COLUMNS)} FROM replenishment {where} "
+                       f"ORDER BY need_reorder DESC, order_qty DESC, sku_key", con, params=list(skus or []))
+
+
+def set_sku(con: sqlite3.Connection, sku_key: str, lead_days: Optional[float] = None,
+            service_level: Optional[float] = None, review_days: Optional[float] = None) -> None:
+    """Override lead time / service level / review period for one SKU (None keeps the current value)"""
+    create_replenishment_tables(con)
+    with con:
+        con.execute("""
+            INSERT INTO replenishment_settings (sku_key, lead_days, service_level, review_days)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(sku_key) DO UPDATE SET
+                lead_days = COALESCE(excluded.lead_days, lead_days),
+                service_level = COALESCE(excluded.service_level, service_level),
+                review_days = COALESCE(excluded.review_days, review_days)
+        """, (sku_key, lead_days, service_level, review_days))
+
+
+def run(con: sqlite3.Connection, as_of: Optional[str] = None, window_days: int = WINDOW_DAYS) -> pd.DataFrame:
+    start = time.perf_counter()
+    frame = compute(con, as_of, window_days)
+    write_replenishment(con, frame)
+    logger.info(f"📦 Replenishment for {len(frame):,} SKUs as of {frame['as_of'].iloc[0] if len(frame) else '–'}: "
+                f"{int(frame['need_reorder'].sum()) if len(frame) else 0} to reorder "
+                f"({time.perf_counter() - start:.2f}s)")
+    return frame
+
+
+def benchmark(skus: int, window_days: int = WINDOW_DAYS) -> None:
+    """compute + write for `skus` synthetic SKUs with a year of daily sales"""
+    rng = np.random.default_rng(0)
+    days = pd.date_range(end="2025-07-31", periods=365).strftime("%Y-%m-%d")
+    rate = rng.gamma(0.6, 2.0, skus)
+    counts = rng.poisson(rate[:, None], (skus, len(days)))
+    sku_index, day_index = np.nonzero(counts)
+    orders = pd.DataFrame({'order_date': days[day_index], 'sku_key': [f"SKU{i:05d}" for i in sku_index],
+                           'qty': counts[sku_index, day_index], 'gross_price_kzt': 10000,
+                           'kaspi_fee_pct': 0.12, 'delivery_cost_kzt': 699})
+    with tempfile.TemporaryDirectory() as tmp:
+        con = sqlite3.connect(pathlib.Path(tmp) / "replenishment.db")
+        orders.to_sql("orders", con, index=False)
+        pd.DataFrame({'sku_key': [f"SKU{i:05d}" for i in range(skus)],
+                      'qty_on_hand': rng.integers(0, 200, skus)}).to_sql("stock", con, index=False)
+        create_order_indexes(con)
+        con.commit()
+
+        start = time.perf_counter()
+        frame = compute(con, window_days=window_days)
+        computed = time.perf_counter() - start
+        write_replenishment(con, frame)
+        total = time.perf_counter() - start
+        con.close()
+    error = np.abs(frame['demand_mean'].to_numpy() - rate).mean()
+    print(f"   {skus:,} SKUs, {len(orders):,} order rows: compute {computed * 1000:.0f} ms, "
+          f"with write {total * 1000:.0f} ms")
+    print(f"   mean |demand − true rate| {error:.3f}/day; {int(frame['need_reorder'].sum()):,} to reorder")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-SKU reorder points and order-up-to levels")
+    parser.add_argument("--as-of", help="last day of demand history (default: latest order)")
+    parser.add_argument("--window", type=int, default=WINDOW_DAYS, help="days of demand history")
+    parser.add_argument("--set", metavar="SKU", help="store per-SKU settings instead of computing")
+    parser.add_argument("--lead", type=float, help="lead time in days for --set")
+    parser.add_argument("--service", type=float, help="service level (e.g. 0.95) for --set")
+    parser.add_argument("--review", type=float, help="review period in days for --set")
+    parser.add_argument("--benchmark", type=int, metavar="SKUS", help="time a synthetic run")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.benchmark, args.window)
+        return
+
+    con = sqlite3.connect(DB_PATH)
+    try:
+        if args.set:
+            set_sku(con, args.set.strip().upper(), args.lead, args.service, args.review)
+            logger.info(f"⚙️ {args.set}: lead {args.lead}, service {args.service}, review {args.review}")
+            return
+        frame = run(con, args.as_of, args.window)
+        if len(frame):
+            print(frame[frame['need_reorder']].head(30).to_string(index=False))
+    finally:
+        con.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+"""
+Size charts stored in SQLite per product type, sub-category and brand
+Each chart entry is a row of size_charts; triggers bump size_chart_version on
+every change, so ChartStore only reads a single integer to notice new charts
+and recompiles (size_grid) just the charts whose entries changed. ChartStore
+only reads erp.db; charts are stored from the command line
+
+    python scripts/size_charts.py --seed             # store the built-in charts if the table is empty
+    python scripts/size_charts.py --from-catalog     # per-brand charts cut to the sizes the catalog stocks
+    python scripts/size_charts.py --import charts.csv
+    python scripts/size_charts.py --list
+"""
+import argparse
+import logging
+import math
+import pathlib
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+import size_grid
+
+DB_PATH = pathlib.Path(__file__).resolve().parents[1] / "db" / "erp.db"
+
+RELOAD_INTERVAL = 5.0  # seconds between version checks
+
+ANY = ""  # sub_category / brand of a chart that applies to the whole product type
+
+# matrix → chart dict key and the range columns of its entries, in tuple order
+MATRICES = {
+    'height_weight': ('height_weight_matrix', ['height_min', 'height_max', 'weight_min', 'weight_max']),
+    'age_height': ('age_height_matrix', ['age_min', 'age_max', 'height_min', 'height_max']),
+    'height': ('height_sizes', ['height_min', 'height_max']),
+}
+CHART_COLUMNS = ['product_type', 'sub_category', 'brand', 'gender', 'matrix', 'size',
+                 'height_min', 'height_max', 'weight_min', 'weight_max', 'age_min', 'age_max', 'position']
+
+ChartKey = Tuple[str, str, str, str]  # product_type, sub_category, brand, gender
+
+logger = logging.getLogger(__name__)
+
+
+def create_size_chart_tables(con: sqlite3.Connection) -> None:
+    con.executescript("""
+    CREATE TABLE IF NOT EXISTS size_charts (
+        id              INTEGER PRIMARY KEY AUTOINCREMENT,
+        product_type    TEXT NOT NULL,
+        sub_category    TEXT NOT NULL DEFAULT '',
+        brand           TEXT NOT NULL DEFAULT '',
+        gender          TEXT NOT NULL,
+        matrix          TEXT NOT NULL CHECK (matrix IN ('height_weight', 'age_height', 'height')),
+        size            TEXT NOT NULL,
+        height_min      REAL,
+        height_max      REAL,
+        weight_min      REAL,
+        weight_max      REAL,
+        age_min         REAL,
+        age_max         REAL,
+        position        INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE INDEX IF NOT EXISTS idx_size_charts_key
+        ON size_charts(product_type, sub_category, brand, gender);
+
+    CREATE TABLE IF NOT EXISTS size_chart_version (
+        id              INTEGER PRIMARY KEY CHECK (id = 1),
+        version         INTEGER NOT NULL
+    );
+    INSERT OR IGNORE INTO size_chart_version (id, version) VALUES (1, 0);
+
+    CREATE TRIGGER IF NOT EXISTS size_charts_insert AFTER INSERT ON size_charts
+    BEGIN UPDATE size_chart_version SET version = version + 1; END;
+    CREATE TRIGGER IF NOT EXISTS size_charts_update AFTER UPDATE ON size_charts
+    BEGIN UPDATE size_chart_version SET version = version + 1; END;
+    CREATE TRIGGER IF NOT EXISTS size_charts_delete AFTER DELETE ON size_charts
+    BEGIN UPDATE size_chart_version SET version = version + 1; END;
+    """)
+
+
+def chart_version(con: sqlite3.Connection) -> int:
+    return con.execute("SELECT version FROM size_chart_version WHERE id = 1").fetchone()[0]
+
+
+def chart_rows(charts: Dict) -> "pd.DataFrame":
+    """Nested {product_type: {gender: chart}} (SIZE_CHARTS layout) → size_charts rows"""
+    import pandas as pd
+
+    rows = []
+    for product_type, genders in charts.items():
+        for gender, chart in genders.items():
+            for matrix, (key, columns) in MATRICES.items():
+                entries = chart.get(key, {})
+                for position, (ranges, size) in enumerate(entries.items()):
+                    if matrix == 'height':  # size → (height_min, height_max)
+                        ranges, size = size, ranges
+                    rows.append({'product_type': product_type, 'sub_category': ANY, 'brand': ANY,
+                                 'gender': gender, 'matrix': matrix, 'size': size,
+                                 'position': position, **dict(zip(columns, ranges))})
+    return pd.DataFrame(rows).reindex(columns=CHART_COLUMNS)
+
+
+def replace_charts(con: sqlite3.Connection, rows: "pd.DataFrame") -> int:
+    """Store `rows` in place of every chart (key) they belong to (caller commits)"""
+    create_size_chart_tables(con)
+    rows = rows.reindex(columns=CHART_COLUMNS).copy()
+    rows[['sub_category', 'brand']] = rows[['sub_category', 'brand']].fillna(ANY)
+    rows['position'] = rows['position'].fillna(rows.groupby(['product_type', 'sub_category', 'brand',
+                                                             'gender', 'matrix']).cumcount())
+    keys = rows[['product_type', 'sub_category', 'brand', 'gender']].drop_duplicates()
+    con.executemany("DELETE FROM size_charts WHERE product_type=? AND sub_category=? AND brand=? "
+                    "AND gender=?", keys.values.tolist())
+    values = rows.astype(object).where(rows.notna(), None)
+    con.executemany(f"INSERT INTO size_charts ({', '.join(CHART_COLUMNS)}) "
+                    f"VALUES ({', '.join('?' * len(CHART_COLUMNS))})", values.values.tolist())
+    return len(rows)
+
+
+def seed_size_charts(con: sqlite3.Connection, charts: Dict) -> int:
+    """Store the built-in charts when the table is still empty (caller commits)"""
+    create_size_chart_tables(con)
+    if con.execute("SELECT 1 FROM size_charts LIMIT 1").fetchone():
+        return 0
+    return replace_charts(con, chart_rows(charts))
+
+
+def catalog_chart_rows(catalog_df: "pd.DataFrame", charts: Dict) -> "pd.DataFrame":
+    """size_charts rows for every catalog Product_Type / Sub_Category / Brend / Gender
+
+    Each group gets the built-in chart of its product type and gender cut down to
+    the sizes the catalog lists for it (MY_SIZE), so a brand is never recommended
+    a size it does not make. Groups stocking every size keep the general chart.
+    """
+    import pandas as pd
+
+    base = chart_rows(charts)
+    columns = ['Product_Type', 'Sub_Category', 'Brend', 'Gender', 'MY_SIZE']
+    catalog = catalog_df.reindex(columns=columns).fillna('').astype(str).apply(lambda col: col.str.strip())
+    frames = []
+    for (product_type, sub_category, brand, gender), sizes in catalog.groupby(columns[:4])['MY_SIZE']:
+        if not (sub_category or brand):
+            continue
+        general = base[base['product_type'].eq(product_type) & base['gender'].eq(gender)]
+        stocked = general[general['size'].isin(set(sizes))]
+        if stocked.empty or len(stocked) == len(general):
+            continue
+        frames.append(stocked.assign(sub_category=sub_category, brand=brand, position=None))
+    if not frames:
+        return pd.DataFrame(columns=CHART_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
+
+
+def load_charts(con: sqlite3.Connection) -> Dict[ChartKey, Dict]:
+    """Every stored chart as a dict in the SIZE_CHARTS chart layout, entries in position order
+
+    Plain sqlite3 rows – the recommendation service loads charts without pandas.
+    """
+    rows = con.execute(f"SELECT {', '.join(CHART_COLUMNS)} FROM size_charts "
+                       f"ORDER BY product_type, sub_category, brand, gender, matrix, position, id")
+    charts: Dict[ChartKey, Dict] = {}
+    for values in rows:
+        row = dict(zip(CHART_COLUMNS, values))
+        chart = charts.setdefault((row['product_type'], row['sub_category'], row['brand'], row['gender']), {})
+        name, columns = MATRICES[row['matrix']]
+        ranges = tuple(row[column] for column in columns)
+        if row['matrix'] == 'height':
+            chart.setdefault(name, {})[row['size']] = ranges
+        else:
+            chart.setdefault(name, {})[ranges] = row['size']
+    for chart in charts.values():
+        if 'height_weight_matrix' not in chart:  # kids charts need both parts
+            chart.setdefault('age_height_matrix', {})
+            chart.setdefault('height_sizes', {})
+    return charts
+
+
+def _blank(value) -> str:
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return ANY
+    return str(value)
+
+
+class ChartSnapshot:
+    """Charts of one version with their compiled grids; hashes / compares by version"""
+
+    def __init__(self, version: int, charts: Dict[ChartKey, Tuple[Dict, object]]):
+        self.version = version
+        self.charts = charts
+        self.product_types = {key[0] for key in charts}
+
+    def resolve(self, product_type, gender, sub_category=None, brand=None) -> Optional[Tuple[Dict, object]]:
+        """(chart, grid) for the most specific chart: sub-category + brand, sub-category,
+        brand, then the product type's general chart"""
+        if sub_category is None and brand is None:
+            return self.charts.get((product_type, ANY, ANY, gender))
+        sub_category, brand = _blank(sub_category), _blank(brand)
+        for sub, br in ((sub_category, brand), (sub_category, ANY), (ANY, brand), (ANY, ANY)):
+            found = self.charts.get((product_type, sub, br, gender))
+            if found is not None:
+                return found
+        return None
+
+    def __hash__(self) -> int:
+        return hash(self.version)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, ChartSnapshot) and other.version == self.version
+
+
+class ChartStore:
+    """Compiled charts from size_charts, reloaded when the table's version moves
+
+    The version is checked at most every `reload_interval` seconds. One thread
+    reloads while the others keep answering from the previous snapshot, so a
+    chart change never makes callers queue up behind the compile. With no
+    db_path the built-in `fallback` charts are used as they are.
+    """
+
+    def __init__(self, db_path: Optional[pathlib.Path] = DB_PATH, fallback: Optional[Dict] = None,
+                 reload_interval: float = RELOAD_INTERVAL):
+        self.db_path = db_path
+        self.fallback = fallback or {}
+        self.reload_interval = reload_interval
+        self._snapshot: Optional[ChartSnapshot] = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+        self._grids: Dict[str, object] = {}  # repr(chart) → compiled grid, reused across versions
+
+    def due(self) -> bool:
+        """True when the next snapshot() checks the table (and may recompile) instead
+        of returning the current snapshot – lets async callers do that off the loop"""
+        return self._snapshot is None or time.monotonic() >= self._next_check
+
+    def snapshot(self) -> ChartSnapshot:
+        snapshot = self._snapshot
+        if snapshot is not None and time.monotonic() < self._next_check:
+            return snapshot
+        if snapshot is None:
+            with self._lock:  # first load: everyone waits for it once
+                if self._snapshot is None:
+                    self._reload()
+        elif self._lock.acquire(blocking=False):
+            try:
+                if time.monotonic() >= self._next_check:
+                    self._reload()
+            finally:
+                self._lock.release()
+        return self._snapshot
+
+    def _compile(self, charts: Dict[ChartKey, Dict]) -> Dict[ChartKey, Tuple[Dict, object]]:
+        grids, compiled = {}, {}
+        for key, chart in charts.items():
+            signature = repr(chart)
+            grid = self._grids.get(signature) or grids.get(signature)
+            if grid is None:
+                grid = size_grid.compile_chart(chart)
+            grids[signature] = grid
+            compiled[key] = (chart, grid)
+        self._grids = grids
+        return compiled
+
+    def _fallback_charts(self) -> Dict[ChartKey, Dict]:
+        return {(product_type, ANY, ANY, gender): chart
+                for product_type, genders in self.fallback.items() for gender, chart in genders.items()}
+
+    def _reload(self) -> None:
+        self._next_check = time.monotonic() + self.reload_interval
+        if self.db_path is None:
+            if self._snapshot is None:
+                self._snapshot = ChartSnapshot(0, self._compile(self._fallback_charts()))
+            return
+        try:
+            # Read-only: answering recommendations never creates or seeds tables
+            con = sqlite3.connect(f"{pathlib.Path(self.db_path).resolve().as_uri()}?mode=ro",
+                                  uri=True, timeout=30)
+            try:
+                if not con.execute("SELECT 1 FROM sqlite_master WHERE type='table' "
+                                   "AND name='size_chart_version'").fetchone():
+                    if self._snapshot is None:
+                        logger.info("📏 No size_charts table – using the built-in charts "
+                                    "(store them with size_charts.py --seed)")
+                        self._snapshot = ChartSnapshot(-1, self._compile(self._fallback_charts()))
+                    return
+                version = chart_version(con)
+                if self._snapshot is not None and self._snapshot.version == version:
+                    return
+                charts = load_charts(con) or self._fallback_charts()
+            finally:
+                con.close()
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Could not load size charts: {e}")
+            if self._snapshot is None:
+                self._snapshot = ChartSnapshot(-1, self._compile(self._fallback_charts()))
+            return
+
+        started = time.perf_counter()
+        try:
+            compiled = self._compile(charts)
+        except Exception as e:
+            logger.error(f"❌ Size charts v{version} could not be compiled, keeping the previous ones: {e}")
+            if self._snapshot is None:
+                self._snapshot = ChartSnapshot(-1, self._compile(self._fallback_charts()))
+            return
+        self._snapshot = ChartSnapshot(version, compiled)
+        logger.info(f"📏 Size charts v{version}: {len(charts)} charts ready "
+                    f"in {time.perf_counter() - started:.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Size charts stored in SQLite")
+    parser.add_argument("--seed", action="store_true", help="store the built-in charts if none are stored")
+    parser.add_argument("--from-catalog", nargs="?", const=True, type=pathlib.Path, metavar="CSV",
+                        help="store per-brand charts cut to the sizes the product catalog lists")
+    parser.add_argument("--import", dest="import_csv", type=pathlib.Path, metavar="CSV",
+                        help=f"replace the charts found in a CSV with columns {', '.join(CHART_COLUMNS)}")
+    parser.add_argument("--list", action="store_true", help="list the stored charts")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    import pandas as pd
+
+    con = sqlite3.connect(DB_PATH)
+    try:
+        create_size_chart_tables(con)
+        if args.seed:
+            from size_recommendation_engine import SizeRecommendationEngine
+            count = seed_size_charts(con, SizeRecommendationEngine.SIZE_CHARTS)
+            con.commit()
+            logger.info(f"✅ Seeded {count} chart entries" if count else "ℹ️ size_charts already filled")
+        if args.from_catalog:
+            from catalog_loader import CATALOG_PATH, load_products
+            from size_recommendation_engine import SizeRecommendationEngine
+            path = CATALOG_PATH if args.from_catalog is True else args.from_catalog
+            rows = catalog_chart_rows(load_products(path), SizeRecommendationEngine.SIZE_CHARTS)
+            count = replace_charts(con, rows)
+            con.commit()
+            charts = rows[['product_type', 'sub_category', 'brand', 'gender']].drop_duplicates()
+            logger.info(f"✅ Stored {len(charts)} catalog charts ({count} entries) from {path.name}")
+        if args.import_csv:
+            count = replace_charts(con, pd.read_csv(args.import_csv, dtype={'sub_category': str, 'brand': str,
+                                                                            'size': str}))
+            con.commit()
+            logger.info(f"✅ Imported {count} chart entries from {args.import_csv.name}")
+        if args.list or not (args.seed or args.from_catalog or args.import_csv):
+            print(f"📏 SIZE CHARTS v{chart_version(con)}")
+            print(pd.read_sql("""
+                SELECT product_type, sub_category, brand, gender, matrix, COUNT(*) AS entries
+                FROM size_charts GROUP BY product_type, sub_category, brand, gender, matrix
+            """, con).to_string(index=False))
+    finally:
+        con.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+Precompiled lookup grids for the size charts
+Each chart of SizeRecommendationEngine.SIZE_CHARTS is scored once for every
+whole-cm height and whole-kg weight (kids: whole-year age) with NumPy, so a
+recommendation becomes an array index. The vectorized scorer reproduces the
+engine's sequential scan exactly, including how alternatives are collected
+and ordered; points off the grid (fractions, out of range) go back to the scan.
+"""
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+MAX_HEIGHT_CM = 250
+MAX_WEIGHT_KG = 250
+MAX_AGE = 18
+
+N_ALTERNATIVES = 3
+ALT_THRESHOLD = 0.3     # scores above this are kept as alternatives
+
+# How a kids recommendation was reached (reasoning differs per kind)
+KIDS_AGE, KIDS_HEIGHT, KIDS_CLOSEST, KIDS_DEFAULT = range(4)
+
+
+def _fit(x: np.ndarray, lo: np.ndarray, hi: np.ndarray, scale: float) -> np.ndarray:
+    """0.5 inside [lo, hi], shrinking by distance / scale outside (never below 0)
+
+    NaN scores 0, as max(0, nan) does in the scan.
+    """
+    inside = (lo <= x) & (x <= hi)
+    distance = np.minimum(np.abs(x - lo), np.abs(x - hi))
+    return np.where(inside, 0.5, np.fmax(0, 0.5 - distance / scale))
+
+
+def score_adult(heights: np.ndarray, weights: np.ndarray,
+                ranges: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Best entry, its score and up to N_ALTERNATIVES ranked entries per point
+
+    `ranges` holds (h_min, h_max, w_min, w_max) per chart entry in chart order.
+    Entry index -1 means none: no best (every score 0) or an unused alternative.
+    """
+    h = np.asarray(heights, dtype=float)[:, None]
+    w = np.asarray(weights, dtype=float)[:, None]
+    scores = _fit(h, ranges[:, 0], ranges[:, 1], 20) + _fit(w, ranges[:, 2], ranges[:, 3], 10)
+    n, n_entries = scores.shape
+
+    # Replay the scan: an entry joins the alternatives when it is displaced as
+    # best or, at its own step, scores above ALT_THRESHOLD without beating the best
+    best = np.full(n, -1)
+    best_score = np.zeros(n)
+    joined = np.full((n, n_entries), n_entries)  # step at which each entry joined
+    rows = np.arange(n)
+    for j in range(n_entries):
+        score = scores[:, j]
+        better = score > best_score
+        displaced = better & (best >= 0)
+        joined[rows[displaced], best[displaced]] = j
+        joined[~better & (score > ALT_THRESHOLD), j] = j
+        best = np.where(better, j, best)
+        best_score = np.where(better, score, best_score)
+
+    # Stable sort by score, high first: ties keep the order they joined in
+    candidate = joined < n_entries
+    order = np.lexsort((joined, np.where(candidate, -scores, np.inf)), axis=-1)[:, :N_ALTERNATIVES]
+    alternatives = np.full((n, N_ALTERNATIVES), -1)  # charts with fewer entries leave slots unused
+    alternatives[:, :order.shape[1]] = np.where(np.take_along_axis(candidate, order, axis=1), order, -1)
+    return best, best_score, alternatives
+
+
+def score_kids(heights: np.ndarray, ages: np.ndarray, age_ranges: np.ndarray,
+               height_ranges: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(index, confidence, kind) per point
+
+    KIDS_AGE indexes age_ranges, KIDS_HEIGHT / KIDS_CLOSEST index height_ranges.
+    An age of 0 or NaN means no age.
+    """
+    h = np.asarray(heights, dtype=float)[:, None]
+    age = np.nan_to_num(np.asarray(ages, dtype=float), nan=0.0)[:, None]
+    n = len(h)
+
+    by_age = ((age != 0) & (age_ranges[:, 0] <= age) & (age <= age_ranges[:, 1])
+              & (age_ranges[:, 2] <= h) & (h <= age_ranges[:, 3]))
+    index = np.zeros(n, dtype=int)
+    confidence = np.full(n, 0.1)
+    kind = np.full(n, KIDS_DEFAULT)
+    if len(height_ranges):
+        distance = np.minimum(np.abs(h - height_ranges[:, 0]), np.abs(h - height_ranges[:, 1]))
+        distance = np.where(np.isnan(distance), np.inf, distance)  # NaN never counts as closer
+        closest = distance.argmin(axis=1)
+        nearest = distance[np.arange(n), closest]
+        index = closest
+        kind = np.where(np.isfinite(nearest), KIDS_CLOSEST, KIDS_DEFAULT)
+        confidence = np.where(np.isfinite(nearest), np.maximum(0.3, 1.0 - nearest / 20), 0.1)
+
+        by_height = (height_ranges[:, 0] <= h) & (h <= height_ranges[:, 1])
+        fits = by_height.any(axis=1)
+        index = np.where(fits, by_height.argmax(axis=1), index)
+        confidence = np.where(fits, 0.8, confidence)
+        kind = np.where(fits, KIDS_HEIGHT, kind)
+
+    if len(age_ranges):
+        matched = by_age.any(axis=1)
+        index = np.where(matched, by_age.argmax(axis=1), index)
+        confidence = np.where(matched, 0.9, confidence)
+        kind = np.where(matched, KIDS_AGE, kind)
+    return index, confidence, kind
+
+
+@dataclass
+class AdultGrid:
+    """best / confidence / alternatives per [height_cm, weight_kg]
+
+    The arrays serve batch lookups; `cells` holds the same answers as plain
+    tuples (size or None, confidence, alternative sizes) for single calls.
+    """
+    sizes: List[str]
+    ranges: np.ndarray
+    best: np.ndarray
+    confidence: np.ndarray
+    alternatives: np.ndarray
+    cells: List[List[Tuple]]
+
+    @classmethod
+    def compile(cls, matrix: Dict) -> "AdultGrid":
+        sizes = list(matrix.values())
+        ranges = np.array(list(matrix.keys()), dtype=float).reshape(-1, 4)
+        h, w = np.meshgrid(np.arange(MAX_HEIGHT_CM + 1), np.arange(MAX_WEIGHT_KG + 1), indexing='ij')
+        best, confidence, alternatives = score_adult(h.ravel(), w.ravel(), ranges)
+
+        labels = np.array(sizes + [None], dtype=object)  # index -1 → None
+        # Few distinct alternative lists – build each tuple once
+        packed = ((alternatives + 1) * (len(sizes) + 1) ** np.arange(N_ALTERNATIVES)).sum(axis=1)
+        _, first, which = np.unique(packed, return_index=True, return_inverse=True)
+        combo_sizes = [tuple(labels[i] for i in row if i >= 0) for row in alternatives[first].tolist()]
+        alt_sizes = [combo_sizes[i] for i in which.tolist()]
+        flat = list(zip(labels[best].tolist(), confidence.tolist(), alt_sizes))
+        width = MAX_WEIGHT_KG + 1
+        cells = [flat[i:i + width] for i in range(0, len(flat), width)]
+
+        shape = h.shape
+        return cls(sizes, ranges, best.reshape(shape).astype(np.int16), confidence.reshape(shape),
+                   alternatives.reshape(*shape, N_ALTERNATIVES).astype(np.int16), cells)
+
+    def lookup(self, height_cm, weight_kg) -> Optional[Tuple]:
+        """(size or None, confidence, alternative sizes); None off the grid"""
+        if type(height_cm) is int and type(weight_kg) is int:   # the common case – no float round trip
+            if 0 <= height_cm <= MAX_HEIGHT_CM and 0 <= weight_kg <= MAX_WEIGHT_KG:
+                return self.cells[height_cm][weight_kg]
+            return None
+        if _on_grid(height_cm, MAX_HEIGHT_CM) and _on_grid(weight_kg, MAX_WEIGHT_KG):
+            return self.cells[int(height_cm)][int(weight_kg)]
+        return None
+
+    def lookup_many(self, heights, weights) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """best / confidence / alternatives (entry indexes, -1 = none) per point
+
+        On-grid points are read from the arrays, the rest are scored directly.
+        """
+        h, w = np.asarray(heights, dtype=float), np.asarray(weights, dtype=float)
+        on = _on_grid_many(h, MAX_HEIGHT_CM) & _on_grid_many(w, MAX_WEIGHT_KG)
+        best = np.full(len(h), -1)
+        confidence = np.zeros(len(h))
+        alternatives = np.full((len(h), N_ALTERNATIVES), -1)
+        hi, wi = h[on].astype(int), w[on].astype(int)
+        best[on], confidence[on] = self.best[hi, wi], self.confidence[hi, wi]
+        alternatives[on] = self.alternatives[hi, wi]
+        if not on.all():
+            best[~on], confidence[~on], alternatives[~on] = score_adult(h[~on], w[~on], self.ranges)
+        return best, confidence, alternatives
+
+
+@dataclass
+class KidsGrid:
+    """index / confidence / kind per [height_cm, age] (age 0 = no age given)
+
+    `cells` holds (size or None, confidence, kind) tuples for single calls.
+    """
+    age_sizes: List[str]
+    height_sizes: List[str]
+    age_ranges: np.ndarray
+    height_ranges: np.ndarray
+    index: np.ndarray
+    confidence: np.ndarray
+    kind: np.ndarray
+    cells: List[List[Tuple]]
+
+    @classmethod
+    def compile(cls, age_height_matrix: Dict, height_sizes: Dict) -> "KidsGrid":
+        age_sizes, height_labels = list(age_height_matrix.values()), list(height_sizes.keys())
+        age_ranges = np.array(list(age_height_matrix.keys()), dtype=float).reshape(-1, 4)
+        height_ranges = np.array(list(height_sizes.values()), dtype=float).reshape(-1, 2)
+        h, a = np.meshgrid(np.arange(MAX_HEIGHT_CM + 1), np.arange(MAX_AGE + 1), indexing='ij')
+        index, confidence, kind = score_kids(h.ravel(), a.ravel(), age_ranges, height_ranges)
+
+        grid = cls(age_sizes, height_labels, age_ranges, height_ranges,
+                   index.reshape(h.shape).astype(np.int16), confidence.reshape(h.shape),
+                   kind.reshape(h.shape).astype(np.int8), [])
+        flat = [(grid.size_of(i, k), c, k)
+                for i, c, k in zip(index.tolist(), confidence.tolist(), kind.tolist())]
+        width = MAX_AGE + 1
+        grid.cells = [flat[i:i + width] for i in range(0, len(flat), width)]
+        return grid
+
+    def lookup(self, height_cm, age) -> Optional[Tuple]:
+        """(size or None, confidence, kind); None off the grid"""
+        age = age or 0
+        if type(height_cm) is int and type(age) is int:   # the common case – no float round trip
+            if 0 <= height_cm <= MAX_HEIGHT_CM and 0 <= age <= MAX_AGE:
+                return self.cells[height_cm][age]
+            return None
+        if _on_grid(height_cm, MAX_HEIGHT_CM) and _on_grid(age, MAX_AGE):
+            return self.cells[int(height_cm)][int(age)]
+        return None
+
+    def lookup_many(self, heights, ages) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """index / confidence / kind per point; missing ages (NaN) count as no age"""
+        h = np.asarray(heights, dtype=float)
+        age = np.nan_to_num(np.asarray(ages, dtype=float), nan=0.0)
+        on = _on_grid_many(h, MAX_HEIGHT_CM) & _on_grid_many(age, MAX_AGE)
+        index = np.zeros(len(h), dtype=int)
+        confidence = np.zeros(len(h))
+        kind = np.full(len(h), KIDS_DEFAULT)
+        hi, ai = h[on].astype(int), age[on].astype(int)
+        index[on], confidence[on], kind[on] = self.index[hi, ai], self.confidence[hi, ai], self.kind[hi, ai]
+        if not on.all():
+            index[~on], confidence[~on], kind[~on] = score_kids(h[~on], age[~on], self.age_ranges,
+                                                                self.height_ranges)
+        return index, confidence, kind
+
+    def sizes_of(self, index: np.ndarray, kind: np.ndarray) -> np.ndarray:
+        """Vectorized size_of (object array, None for KIDS_DEFAULT)"""
+        by_age = np.array(self.age_sizes + [None], dtype=object)
+        by_height = np.array(self.height_sizes + [None], dtype=object)
+        sizes = np.full(len(index), None, dtype=object)
+        age_kind = kind == KIDS_AGE
+        height_kind = (kind == KIDS_HEIGHT) | (kind == KIDS_CLOSEST)
+        sizes[age_kind] = by_age[index[age_kind]]
+        sizes[height_kind] = by_height[index[height_kind]]
+        return sizes
+
+    def size_of(self, index: int, kind: int) -> Optional[str]:
+        if kind == KIDS_AGE:
+            return self.age_sizes[index]
+        if kind in (KIDS_HEIGHT, KIDS_CLOSEST):
+            return self.height_sizes[index]
+        return None
+
+
+def _on_grid(value, upper: int) -> bool:
+    """Whole numbers in [0, upper] index the grid directly"""
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return False
+    return value.is_integer() and 0 <= value <= upper
+
+
+def _on_grid_many(values: np.ndarray, upper: int) -> np.ndarray:
+    """Vectorized _on_grid for a float array (NaN is off the grid)"""
+    return (values == np.floor(values)) & (values >= 0) & (values <= upper)
+
+
+def compile_chart(chart: Dict):
+    """AdultGrid for a height/weight chart, KidsGrid for an age/height one"""
+    if 'height_weight_matrix' in chart:
+        return AdultGrid.compile(chart['height_weight_matrix'])
+    return KidsGrid.compile(chart.get('age_height_matrix', {}), chart.get('height_sizes', {}))
+
+
+def compile_charts(charts: Dict) -> Dict[Tuple[str, str], object]:
+    """(product_type, gender) → AdultGrid / KidsGrid for every chart"""
+    return {(product_type, gender): compile_chart(chart)
+            for product_type, genders in charts.items()
+            for gender, chart in genders.items()}
@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+"""
+Nearest-neighbour size model trained on confirmed size_recommendations
+Confirmed (height, weight) → final_size outcomes are kept in a spatial hash
+grid per (product_type, gender, brand) and per (product_type, gender). A query
+votes among the k nearest confirmed customers within RADIUS and falls back to
+the chart engine when fewer than MIN_NEIGHBOURS are that close. refresh() only
+reads confirmations from the last one it has seen on and swaps the updated
+index in whole
+
+    python scripts/size_knn.py --stats
+    python scripts/size_knn.py --benchmark 20000   # synthetic confirmations in a temp DB
+"""
+import argparse
+import functools
+import logging
+import math
+import pathlib
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from operator import itemgetter
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from recommendation_writer import RecommendationWriter, create_recommendations_table
+from size_charts import ChartStore
+from size_recommendation_engine import SizeRecommendation, SizeRecommendationEngine
+
+DB_PATH = pathlib.Path(__file__).resolve().parents[1] / "db" / "erp.db"
+
+K = 15
+MIN_NEIGHBOURS = 5
+# Distances use the chart scorer's scales: 20 cm of height weigh as much as 10 kg
+HEIGHT_UNIT = 20.0
+WEIGHT_UNIT = 10.0
+RADIUS = 0.5                # 10 cm / 5 kg – farther customers do not vote
+CELLS_PER_RADIUS = 4        # grid cell side = RADIUS / CELLS_PER_RADIUS
+REFRESH_INTERVAL = 30.0     # seconds between incremental refreshes
+MEMO_SIZE = 65536           # predictions remembered per index version
+
+Segment = Tuple[str, str, Optional[str]]  # product_type, gender, brand (None = every brand)
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+TRAINING_SQL = """
+    SELECT rowid, customer_height, customer_weight, gender, product_type, brand,
+           final_size, confirmed_at
+    FROM size_recommendations
+    WHERE customer_confirmed AND final_size IS NOT NULL
+      AND gender IS NOT NULL AND product_type IS NOT NULL
+      AND customer_height IS NOT NULL AND customer_weight IS NOT NULL
+"""
+
+
+def _brand(value) -> Optional[str]:
+    if value is None or (isinstance(value, float) and math.isnan(value)) or value == "":
+        return None
+    return str(value)
+
+
+class KnnSizeModel:
+    """k-NN votes over confirmed sizes, chart engine for sparse neighbourhoods"""
+
+    def __init__(self, engine: Optional[SizeRecommendationEngine] = None,
+                 db_path: Optional[pathlib.Path] = DB_PATH, k: int = K,
+                 min_neighbours: int = MIN_NEIGHBOURS, radius: float = RADIUS,
+                 refresh_interval: float = REFRESH_INTERVAL):
+        self.engine = engine or SizeRecommendationEngine()
+        self.db_path = db_path
+        self.k = k
+        self.min_neighbours = min_neighbours
+        self.radius = radius
+        self.cell = radius / CELLS_PER_RADIUS
+        self.refresh_interval = refresh_interval
+        self.cells: Dict[Segment, Dict[Tuple[int, int], Dict[Tuple[float, float], Counter]]] = {}
+        self.points: Dict[int, Tuple] = {}  # rowid → (segments, cell, point, size) for replacing outcomes
+        self.watermark: Optional[str] = None  # latest confirmed_at loaded
+        self.loaded = False
+        self.version = 0  # bumped by every published change of the index; part of the memo key
+        self._draft: Optional[Tuple[Dict, set, set]] = None  # index being edited, see _editing
+        self._dirty = False
+        self._memo = functools.lru_cache(maxsize=MEMO_SIZE)(self._predict)
+        self._next_refresh = 0.0
+        self._lock = threading.Lock()
+        # Cells by ring (Chebyshev distance from the query's cell), searched nearest first
+        self._rings = [[(dx, dy) for dx in range(-r, r + 1) for dy in range(-r, r + 1)
+                        if max(abs(dx), abs(dy)) == r] for r in range(CELLS_PER_RADIUS + 1)]
+
+    # --- index --------------------------------------------------------------
+    # The published `cells` is never changed in place: edits go to a draft that
+    # copies each segment and cell on first write, and is swapped in whole, so
+    # queries on other threads keep reading a consistent index.
+
+    @contextmanager
+    def _editing(self):
+        if self._draft is not None:  # already inside an edit
+            yield
+            return
+        self._draft, self._dirty = (dict(self.cells), set(), set()), False
+        try:
+            yield
+        finally:
+            cells, self._draft = self._draft[0], None
+            if self._dirty:
+                self.cells = cells
+                self.version += 1
+
+    def _writable(self, segment: Segment, cell: Tuple[int, int]) -> Dict[Tuple[float, float], Counter]:
+        """Points of one cell in the draft, copied from the published index on first write"""
+        cells, copied_segments, copied_cells = self._draft
+        if segment not in copied_segments:
+            cells[segment] = dict(cells.get(segment, {}))
+            copied_segments.add(segment)
+        if (segment, cell) not in copied_cells:
+            cells[segment][cell] = {point: Counter(counts)
+                                    for point, counts in cells[segment].get(cell, {}).items()}
+            copied_cells.add((segment, cell))
+        return cells[segment][cell]
+
+    def add(self, rowid: int, height_cm: float, weight_kg: float, gender: str,
+            product_type: str, brand, size: str) -> bool:
+        """Index one confirmed outcome (replaces the earlier outcome of the same row);
+        False when the row is already indexed as it is
+
+        Outcomes at the same height and weight share one point holding size counts,
+        so dense neighbourhoods of whole-cm / whole-kg customers stay small.
+        """
+        point = (height_cm / HEIGHT_UNIT, weight_kg / WEIGHT_UNIT)
+        cell = (int(point[0] // self.cell), int(point[1] // self.cell))
+        segments = [(product_type, gender, None)]
+        if _brand(brand) is not None:
+            segments.append((product_type, gender, _brand(brand)))
+        placed = (segments, cell, point, size)
+        if self.points.get(rowid) == placed:
+            return False
+        with self._editing():
+            self.remove(rowid)
+            for segment in segments:
+                self._writable(segment, cell).setdefault(point, Counter())[size] += 1
+            self.points[rowid] = placed
+            self._dirty = True
+        return True
+
+    def remove(self, rowid: int) -> bool:
+        if rowid not in self.points:
+            return False
+        with self._editing():
+            segments, cell, point, size = self.points.pop(rowid)
+            for segment in segments:
+                points = self._writable(segment, cell)
+                counts = points[point]
+                counts[size] -= 1
+                if counts[size] <= 0:
+                    del counts[size]
+                if not counts:
+                    del points[point]
+            self._dirty = True
+        return True
+
+    def refresh(self, con: Optional[sqlite3.Connection] = None) -> int:
+        """Load outcomes confirmed since the last refresh (all of them the first time);
+        returns how many changed the index"""
+        with self._lock:
+            return self._refresh(con)
+
+    def _refresh(self, con: Optional[sqlite3.Connection] = None) -> int:
+        own = con is None
+        if own:
+            con = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            create_recommendations_table(con)
+            if not self.loaded:
+                rows = con.execute(TRAINING_SQL).fetchall()
+            else:
+                # Same-timestamp confirmations are read again; add() skips those already indexed
+                rows = con.execute(TRAINING_SQL + " AND confirmed_at >= ?",
+                                   (self.watermark or "",)).fetchall()
+        finally:
+            if own:
+                con.close()
+        changed = 0
+        with self._editing():
+            for rowid, height, weight, gender, product_type, brand, size, confirmed_at in rows:
+                changed += self.add(rowid, height, weight, gender, product_type, brand, size)
+                if confirmed_at is not None and (self.watermark is None or confirmed_at > self.watermark):
+                    self.watermark = confirmed_at
+        self.loaded = True
+        self._next_refresh = time.monotonic() + self.refresh_interval
+        return changed
+
+    def _maybe_refresh(self) -> None:
+        if self.db_path is None or time.monotonic() < self._next_refresh:
+            return
+        if self._lock.acquire(blocking=False):  # other callers keep using the current index
+            try:
+                self._next_refresh = time.monotonic() + self.refresh_interval
+                loaded = self._refresh()
+                if loaded:
+                    logger.info(f"🧠 Size model: {loaded} confirmed outcomes loaded, "
+                                f"{len(self.points)} indexed")
+            except sqlite3.Error as e:
+                logger.warning(f"⚠️ Could not refresh the size model: {e}")
+            finally:
+                self._lock.release()
+
+    # --- queries ------------------------------------------------------------
+
+    def nearest(self, segment: Segment, height_cm: float, weight_kg: float) -> List[Tuple[float, Counter]]:
+        """(squared distance, size counts) of the closest points within the radius,
+        nearest first, until they hold k outcomes"""
+        cells = self.cells.get(segment)
+        if not cells:
+            return []
+        x, y = height_cm / HEIGHT_UNIT, weight_kg / WEIGHT_UNIT
+        cx, cy = int(x // self.cell), int(y // self.cell)
+        limit = self.radius * self.radius
+        found, total = [], 0
+        for ring, offsets in enumerate(self._rings):
+            for dx, dy in offsets:
+                points = cells.get((cx + dx, cy + dy))
+                if not points:
+                    continue
+                for (px, py), counts in points.items():
+                    d2 = (px - x) * (px - x) + (py - y) * (py - y)
+                    if d2 <= limit:
+                        found.append((d2, counts))
+                        total += sum(counts.values())
+            # Every outcome closer than ring * cell has been seen by now
+            if total >= self.k:
+                closest = self._first_k(found)
+                if closest[-1][0] < (ring * self.cell) ** 2:
+                    return closest
+        return self._first_k(found)
+
+    def _first_k(self, found: List[Tuple[float, Counter]]) -> List[Tuple[float, Counter]]:
+        found.sort(key=itemgetter(0))
+        taken = 0
+        for i, (_, counts) in enumerate(found):
+            taken += sum(counts.values())
+            if taken >= self.k:
+                return found[:i + 1]
+        return found
+
+    def predict(self, height_cm: float, weight_kg: float, gender: str, product_type: str,
+                brand=None) -> Optional[Tuple[str, float, List[str], int, int]]:
+        """(size, confidence, alternatives, votes, neighbours), None when data is too sparse
+
+        The brand's own outcomes are asked first, then every brand of the product type.
+        """
+        brand = _brand(brand)
+        segments = [(product_type, gender, brand)] if brand is not None else []
+        segments.append((product_type, gender, None))
+        for segment in segments:
+            votes, first = Counter(), {}
+            for i, (_, counts) in enumerate(self.nearest(segment, height_cm, weight_kg)):
+                votes.update(counts)
+                for size in counts:
+                    first.setdefault(size, i)
+            neighbours = sum(votes.values())
+            if neighbours < self.min_neighbours:
+                continue
+            # Most votes wins; ties go to the size of the closest customer
+            ranked = sorted(votes, key=lambda size: (-votes[size], first[size]))
+            confidence = votes[ranked[0]] / neighbours * min(1.0, neighbours / self.k)
+            return ranked[0], confidence, ranked[1:4], votes[ranked[0]], neighbours
+        return None
+
+    def _predict(self, version: int, height_cm, weight_kg, gender, product_type, brand):
+        return self.predict(height_cm, weight_kg, gender, product_type, brand)
+
+    def recommend_size(self, height_cm, weight_kg, gender: str, product_type: str,
+                       age: Optional[int] = None, sub_category: Optional[str] = None,
+                       brand: Optional[str] = None) -> SizeRecommendation:
+        """Same call as SizeRecommendationEngine.recommend_size, answered from confirmed outcomes"""
+        self._maybe_refresh()
+        try:
+            height, weight = float(height_cm), float(weight_kg)
+        except (TypeError, ValueError):
+            height = weight = math.nan
+        prediction = None
+        if not (math.isnan(height) or math.isnan(weight)):
+            prediction = self._memo(self.version, height, weight, gender, product_type, _brand(brand))
+        if prediction is None:
+            return self.engine.recommend_size(height_cm, weight_kg, gender, product_type,
+                                              age, sub_category, brand)
+        size, confidence, alternatives, votes, neighbours = prediction
+        return SizeRecommendation(
+            recommended_size=size,
+            confidence_score=confidence,
+            reasoning=f"{votes} of {neighbours} confirmed customers close to height {height_cm}cm "
+                      f"and weight {weight_kg}kg kept size {size}",
+            alternative_sizes=list(alternatives)
+        )
+
+    def stats(self) -> Dict[Segment, int]:
+        return {segment: sum(sum(counts.values()) for points in cells.values() for counts in points.values())
+                for segment, cells in self.cells.items()}
+
+
+def benchmark(n: int) -> None:
+    """Synthetic shoppers whose true size is one up from the chart for brand 'Oversize':
+    build time, incremental refresh, per-call latency and hit rate on held-out shoppers"""
+    rng = np.random.default_rng(0)
+    engine = SizeRecommendationEngine(charts=ChartStore(db_path=None, fallback=SizeRecommendationEngine.SIZE_CHARTS))
+    order = ['S', 'M', 'L', 'XL', '2XL', '3XL', '4XL']
+
+    def true_size(h, w, brand):
+        size = engine.recommend_size(h, w, 'Men', 'CL').recommended_size
+        if brand == 'Oversize' and size in order[:-1]:
+            size = order[order.index(size) + 1]
+        return size
+
+    def shoppers(count):
+        heights = rng.normal(178, 7, count).round().astype(int).tolist()
+        weights = rng.normal(82, 10, count).round().astype(int).tolist()
+        brands = rng.choice(['Oversize', 'Basic'], count).tolist()
+        return list(zip(heights, weights, brands))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = pathlib.Path(tmp) / "bench.db"
+        history = shoppers(n)
+        with RecommendationWriter(db, flush_interval=None) as writer:
+            for i, (h, w, brand) in enumerate(history):
+                rec = engine.recommend_size(h, w, 'Men', 'CL', brand=brand)
+                writer.add(i, rec, h, w, 'Men', 'CL', brand)
+            writer.confirm_sizes((i, true_size(h, w, brand)) for i, (h, w, brand) in enumerate(history))
+
+        model = KnnSizeModel(engine, db, refresh_interval=math.inf)
+        start = time.perf_counter()
+        model.refresh()
+        build_ms = (time.perf_counter() - start) * 1000
+
+        # New confirmations arrive: only those are read
+        extra = shoppers(100)
+        with RecommendationWriter(db, flush_interval=None) as writer:
+            for i, (h, w, brand) in enumerate(extra, start=n):
+                writer.add(i, engine.recommend_size(h, w, 'Men', 'CL'), h, w, 'Men', 'CL', brand)
+            writer.confirm_sizes((i, true_size(h, w, brand)) for i, (h, w, brand) in enumerate(extra, start=n))
+        start = time.perf_counter()
+        loaded = model.refresh()
+        refresh_ms = (time.perf_counter() - start) * 1000
+
+    held_out = shoppers(2000)
+    truth = [true_size(h, w, brand) for h, w, brand in held_out]
+    start = time.perf_counter()
+    knn = [model.recommend_size(h, w, 'Men', 'CL', brand=brand) for h, w, brand in held_out]
+    first_us = (time.perf_counter() - start) / len(held_out) * 1e6
+    start = time.perf_counter()
+    for h, w, brand in held_out:
+        model.recommend_size(h, w, 'Men', 'CL', brand=brand)
+    repeat_us = (time.perf_counter() - start) / len(held_out) * 1e6
+    chart = [engine.recommend_size(h, w, 'Men', 'CL', brand=brand) for h, w, brand in held_out]
+    from_model = sum(model.predict(h, w, 'Men', 'CL', brand) is not None for h, w, brand in held_out)
+    chart_hits = np.mean([rec.recommended_size == size for rec, size in zip(chart, truth)])
+    model_hits = np.mean([rec.recommended_size == size for rec, size in zip(knn, truth)])
+
+    print("🧠 SIZE MODEL BENCHMARK")
+    print("=" * 50)
+    print(f"   build from {n} confirmations: {build_ms:.0f} ms; "
+          f"refresh of {loaded} new ones: {refresh_ms:.1f} ms")
+    print(f"   {first_us:.1f} µs per call ({repeat_us:.1f} µs repeated), "
+          f"{from_model / len(held_out):.0%} answered by neighbours")
+    print(f"   size kept by held-out shoppers: chart {chart_hits:.0%}, model {model_hits:.0%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Nearest-neighbour size model from confirmed sizes")
+    parser.add_argument("--stats", action="store_true", help="confirmed outcomes per segment")
+    parser.add_argument("--benchmark", type=int, metavar="N", help="synthetic benchmark with N confirmations")
+    args = parser.parse_args()
+    if args.benchmark:
+        benchmark(args.benchmark)
+        return
+
+    model = KnnSizeModel(refresh_interval=math.inf)
+    model.refresh()
+    print(f"🧠 {len(model.points)} confirmed outcomes indexed")
+    for (product_type, gender, brand), count in sorted(model.stats().items(), key=lambda item: -item[1]):
+        print(f"   {product_type:<6} {gender:<6} {brand or '(all brands)':<20} {count:>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+"""
+Outbox for size-confirmation WhatsApp messages
+Unconfirmed size recommendations are rendered in bulk from one precompiled
+template and queued in message_outbox (one row per recipient and order, so
+re-queueing never double-sends). An async sender drains the outbox with
+bounded concurrency, one in-flight message per recipient and exponential
+retry, against a pluggable transport – the WhatsApp HTTP API or a local stub.
+Queueing is a single insert, so the ETL and the recommender never wait on
+delivery
+
+    python scripts/size_outbox.py --queue            # render pending recommendations
+    python scripts/size_outbox.py --send             # drain once (WHATSAPP_API_URL / WHATSAPP_TOKEN)
+    python scripts/size_outbox.py --watch 10 --stub  # keep draining, log instead of sending
+    python scripts/size_outbox.py --benchmark 2000   # stub transport throughput
+"""
+import argparse
+import asyncio
+import logging
+import os
+import pathlib
+import sqlite3
+import tempfile
+import time
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DB_PATH = pathlib.Path(__file__).resolve().parents[1] / "db" / "erp.db"
+
+KIND_SIZE_CONFIRMATION = 'size_confirmation'
+
+CONCURRENCY = 8        # messages in flight
+BATCH_SIZE = 200       # messages claimed per round
+MAX_ATTEMPTS = 5
+RETRY_BASE = 30.0      # seconds before the first retry, doubled per attempt
+RETRY_MAX = 3600.0
+STALE_CLAIM = 300.0    # a 'sending' row older than this belongs to a crashed sender
+
+WHATSAPP_API_URL = os.getenv("WHATSAPP_API_URL")
+WHATSAPP_TOKEN = os.getenv("WHATSAPP_TOKEN")
+
+# Same text as SizeRecommendationEngine.get_size_confirmation_message has always produced;
+# the conditional lines are precomputed so a message is one format call
+CONFIRMATION_TEMPLATE = (
+    "Привет {name}! 👋\n\n"
+    "Для товара '{product}' мы рекомендуем размер: *{size}*\n\n"
+    "Обоснование: {reasoning}\n"
+    "{confidence}"
+    "{alternatives}"
+    "\nПожалуйста, подтвердите размер или сообщите ваши предпочтения! 📏"
+)
+_render = CONFIRMATION_TEMPLATE.format
+CONFIDENCE_LINES = (  # (lower bound, line), first match wins
+    (0.8, "✅ Мы уверены в этом размере!\n"),
+    (0.6, "👍 Хороший выбор размера\n"),
+)
+LOW_CONFIDENCE_LINE = "⚠️ Приблизительный размер, пожалуйста проверьте\n"
+
+logger = logging.getLogger(__name__)
+
+
+class PermanentSendError(Exception):
+    """The transport rejected the message for good (bad number, bad payload) – no retry"""
+
+
+# --- rendering ------------------------------------------------------------------
+
+def _confidence_line(score: float) -> str:
+    for bound, line in CONFIDENCE_LINES:
+        if score > bound:
+            return line
+    return LOW_CONFIDENCE_LINE
+
+
+def render_confirmation(name: str, product: str, size: str, confidence: float,
+                        reasoning: str, alternatives: Sequence[str] = ()) -> str:
+    return _render(name=name, product=product, size=size, reasoning=reasoning,
+                   confidence=_confidence_line(confidence),
+                   alternatives=f"\nАльтернативные размеры: {', '.join(alternatives)}\n" if alternatives else "")
+
+
+def render_confirmations(rows: Iterable[Tuple]) -> List[str]:
+    """(name, product, size, confidence, reasoning, alternatives) rows → messages"""
+    return [render_confirmation(*row) for row in rows]
+
+
+def confirmation_message(customer_name: str, product_name: str, recommendation) -> str:
+    """Message for one SizeRecommendation"""
+    return render_confirmation(customer_name, product_name, recommendation.recommended_size,
+                               recommendation.confidence_score, recommendation.reasoning,
+                               recommendation.alternative_sizes)
+
+
+# --- outbox table -----------------------------------------------------------------
+
+def create_outbox_table(con: sqlite3.Connection) -> None:
+    con.executescript("""
+    CREATE TABLE IF NOT EXISTS message_outbox (
+        id               INTEGER PRIMARY KEY,
+        kind             TEXT NOT NULL,
+        order_id         TEXT NOT NULL,
+        phone            TEXT NOT NULL,
+        body             TEXT NOT NULL,
+        status           TEXT NOT NULL DEFAULT 'pending',  -- pending / sending / sent / failed
+        attempts         INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at  REAL NOT NULL DEFAULT 0,          -- epoch seconds
+        claimed_at       REAL,
+        provider_id      TEXT,
+        last_error       TEXT,
+        created_at       TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        sent_at          TIMESTAMP
+    );
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_message_outbox_recipient
+        ON message_outbox(kind, order_id, phone);
+    CREATE INDEX IF NOT EXISTS idx_message_outbox_status
+        ON message_outbox(status, phone);
+    """)
+
+
+def enqueue(con: sqlite3.Connection, messages: Iterable[Tuple[str, str, str]],
+            kind: str = KIND_SIZE_CONFIRMATION) -> int:
+    """Queue (order_id, phone, body) messages (caller commits); returns rows added –
+    a message already queued for that order and recipient is left alone"""
+    before = con.total_changes
+    con.executemany("INSERT OR IGNORE INTO message_outbox (kind, order_id, phone, body) "
+                    "VALUES (?, ?, ?, ?)",
+                    [(kind, str(order_id), phone, body) for order_id, phone, body in messages])
+    return con.total_changes - before
+
+
+def _has_tables(con: sqlite3.Connection, *names: str) -> bool:
+    found = {r[0] for r in con.execute(
+        f"SELECT name FROM sqlite_master WHERE type='table' AND name IN ({','.join('?' * len(names))})", names)}
+    return found == set(names)
+
+
+def queue_confirmations(con: sqlite3.Connection, default_product: str = "ваш заказ") -> int:
+    """Render and queue a confirmation for every unconfirmed recommendation whose
+    order has a customer phone and nothing queued yet; returns messages queued"""
+    create_outbox_table(con)
+    if not _has_tables(con, 'size_recommendations', 'order_customers', 'customers'):
+        logger.warning("⚠️ size_recommendations / customers not loaded yet – nothing to queue")
+        return 0
+    product = ("(SELECT o.sku_name_raw FROM orders o WHERE o.order_id = oc.order_id LIMIT 1)"
+               if _has_tables(con, 'orders') else "NULL")
+    rows = con.execute(f"""
+        SELECT r.order_id, oc.phone, COALESCE(c.first_name, ''), COALESCE({product}, ?),
+               r.recommended_size, r.confidence_score, COALESCE(r.reasoning, ''), r.alternative_sizes
+        FROM size_recommendations r
+        JOIN order_customers oc ON oc.order_id = CAST(r.order_id AS INTEGER)
+        JOIN customers c ON c.phone = oc.phone
+        WHERE r.rowid IN (SELECT MAX(rowid) FROM size_recommendations GROUP BY order_id)
+          AND NOT COALESCE(r.customer_confirmed, 0)
+          AND NOT EXISTS (SELECT 1 FROM message_outbox m
+                          WHERE m.kind = ? AND m.order_id = r.order_id AND m.phone = oc.phone)
+    """, (default_product, KIND_SIZE_CONFIRMATION)).fetchall()
+    bodies = render_confirmations(
+        (name, product_name, size, confidence or 0.0, reasoning,
+         [a for a in (alternatives or '').split(',') if a])
+        for _, _, name, product_name, size, confidence, reasoning, alternatives in rows)
+    queued = enqueue(con, ((order_id, phone, body) for (order_id, phone, *_), body in zip(rows, bodies)))
+    con.commit()
+    logger.info(f"📨 Queued {queued} size confirmations")
+    return queued
+
+
+def outbox_summary(con: sqlite3.Connection) -> Dict[str, int]:
+    create_outbox_table(con)
+    return dict(con.execute("SELECT status, COUNT(*) FROM message_outbox GROUP BY status").fetchall())
+
+
+# --- transports -------------------------------------------------------------------
+
+class StubTransport:
+    """Records messages instead of sending them; `fail_every` > 0 makes every
+    n-th call raise so retries can be exercised"""
+
+    def __init__(self, latency: float = 0.0, fail_every: int = 0):
+        self.latency = latency
+        self.fail_every = fail_every
+        self.calls = 0
+        self.sent: List[Tuple[str, str]] = []
+
+    async def send(self, phone: str, body: str) -> str:
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.fail_every and self.calls % self.fail_every == 0:
+            raise ConnectionError("stub transport failure")
+        self.sent.append((phone, body))
+        logger.debug(f"📤 [stub] {phone}: {body[:40]!r}")
+        return f"stub-{self.calls}"
+
+    async def close(self) -> None:
+        pass
+
+
+class WhatsAppTransport:
+    """360dialog WhatsApp Business API (Cloud API `messages` payload)"""
+
+    def __init__(self, base_url: str, token: str, timeout: float = 20.0):
+        import httpx
+
+        self._client = httpx.AsyncClient(base_url=base_url.rstrip('/'), timeout=timeout,
+                                         headers={"D360-API-KEY": token})
+
+    async def send(self, phone: str, body: str) -> str:
+        import httpx
+        from kaspi_rate import is_retryable
+
+        try:
+            response = await self._client.post("/messages", json={
+                "messaging_product": "whatsapp", "recipient_type": "individual",
+                "to": phone.lstrip('+'), "type": "text", "text": {"body": body}})
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            if is_retryable(e):
+                raise
+            raise PermanentSendError(str(e)) from e
+        messages = response.json().get("messages") or [{}]
+        return str(messages[0].get("id", ""))
+
+    async def close(self) -> None:
+        await self._client.aclose()
+
+
+# --- sender -----------------------------------------------------------------------
+
+class OutboxSender:
+    """Drains message_outbox through a transport
+
+    Each round claims each recipient's oldest pending message if it is due –
+    a message waiting for a retry holds back the ones queued after it, so a
+    customer gets their messages in order – sends them with at most `concurrency` in
+    flight and records the outcomes in one transaction. Failures are retried
+    with exponential backoff up to `max_attempts`; database work runs off the
+    event loop.
+    """
+
+    def __init__(self, transport, db_path: pathlib.Path = DB_PATH, concurrency: int = CONCURRENCY,
+                 batch_size: int = BATCH_SIZE, max_attempts: int = MAX_ATTEMPTS):
+        self.transport = transport
+        self.db_path = db_path
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self._con: Optional[sqlite3.Connection] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._con is None:
+            self._con = sqlite3.connect(self.db_path, timeout=30, isolation_level=None,
+                                        check_same_thread=False)
+            create_outbox_table(self._con)
+        return self._con
+
+    def _claim(self) -> List[Tuple[int, str, str, int]]:
+        con = self._connection()
+        now = time.time()
+        con.execute("BEGIN IMMEDIATE")  # concurrent senders never claim the same row
+        try:
+            # Claims left behind by a sender that died mid-round, checked every round so a
+            # long-running --watch sender also frees its recipients
+            con.execute("UPDATE message_outbox SET status='pending' "
+                        "WHERE status='sending' AND claimed_at < ?", (now - STALE_CLAIM,))
+            rows = con.execute("""
+                SELECT id, phone, body, attempts FROM message_outbox
+                WHERE id IN (SELECT MIN(id) FROM message_outbox WHERE status = 'pending' GROUP BY phone)
+                  AND next_attempt_at <= ?
+                  AND phone NOT IN (SELECT phone FROM message_outbox WHERE status = 'sending')
+                ORDER BY id LIMIT ?
+            """, (now, self.batch_size)).fetchall()
+            con.executemany("UPDATE message_outbox SET status='sending', claimed_at=? WHERE id=?",
+                            [(now, row[0]) for row in rows])
+            con.execute("COMMIT")
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+        return rows
+
+    def _record(self, results: List[Tuple[int, int, Optional[str], Optional[BaseException]]]) -> Dict[str, int]:
+        sent, retry, failed = [], [], []
+        now = time.time()
+        for message_id, attempts, provider_id, error in results:
+            attempts += 1
+            if error is None:
+                sent.append((attempts, provider_id, message_id))
+            elif isinstance(error, PermanentSendError) or attempts >= self.max_attempts:
+                failed.append((attempts, str(error)[:500], message_id))
+            else:
+                delay = min(RETRY_MAX, RETRY_BASE * 2 ** (attempts - 1))
+                retry.append((attempts, now + delay, str(error)[:500], message_id))
+        con = self._connection()
+        con.execute("BEGIN")
+        con.executemany("UPDATE message_outbox SET status='sent', attempts=?, provider_id=?, "
+                        "last_error=NULL, sent_at=CURRENT_TIMESTAMP WHERE id=?", sent)
+        con.executemany("UPDATE message_outbox SET status='pending', attempts=?, next_attempt_at=?, "
+                        "last_error=? WHERE id=?", retry)
+        con.executemany("UPDATE message_outbox SET status='failed', attempts=?, last_error=? "
+                        "WHERE id=?", failed)
+        con.execute("COMMIT")
+        return {'sent': len(sent), 'retry': len(retry), 'failed': len(failed)}
+
+    async def _send_all(self, rows: List[Tuple[int, str, str, int]]):
+        limit = asyncio.Semaphore(self.concurrency)
+
+        async def send(message_id: int, phone: str, body: str, attempts: int):
+            async with limit:
+                try:
+                    return message_id, attempts, await self.transport.send(phone, body), None
+                except Exception as e:
+                    logger.warning(f"⚠️ Message {message_id} to {phone} failed (attempt {attempts + 1}): {e}")
+                    return message_id, attempts, None, e
+
+        return await asyncio.gather(*(send(*row) for row in rows))
+
+    async def drain(self) -> Dict[str, int]:
+        """Send everything that is due now; returns counts by outcome"""
+        totals = {'sent': 0, 'retry': 0, 'failed': 0}
+        while True:
+            rows = await asyncio.to_thread(self._claim)
+            if not rows:
+                break
+            counts = await asyncio.to_thread(self._record, await self._send_all(rows))
+            for outcome, count in counts.items():
+                totals[outcome] += count
+        if any(totals.values()):
+            logger.info(f"✅ Outbox: {totals['sent']} sent, {totals['retry']} to retry, "
+                        f"{totals['failed']} failed")
+        return totals
+
+    async def watch(self, interval: float) -> None:
+        """Drain every `interval` seconds until cancelled"""
+        while True:
+            await self.drain()
+            await asyncio.sleep(interval)
+
+    async def close(self) -> None:
+        await self.transport.close()
+        if self._con is not None:
+            self._con.close()
+            self._con = None
+
+
+def benchmark(messages: int, latency: float, concurrency: int) -> None:
+    """Render + queue + drain `messages` through a stub transport with `latency` per send"""
+    with tempfile.TemporaryDirectory() as tmp:
+        db = pathlib.Path(tmp) / "outbox.db"
+        con = sqlite3.connect(db)
+        create_outbox_table(con)
+        start = time.perf_counter()
+        bodies = render_confirmations(("Али", "Футболка черная", "L", 0.9, "benchmark", ["M", "XL"])
+                                      for _ in range(messages))
+        queued = enqueue(con, ((i, f"+7700{i:07d}", body) for i, body in enumerate(bodies)))
+        con.commit()
+        con.close()
+        queue_time = time.perf_counter() - start
+
+        async def run():
+            sender = OutboxSender(StubTransport(latency), db, concurrency=concurrency)
+            try:
+                return await sender.drain()
+            finally:
+                await sender.close()
+
+        start = time.perf_counter()
+        counts = asyncio.run(run())
+        send_time = time.perf_counter() - start
+    print(f"   queued {queued:,} in {queue_time * 1000:.0f} ms")
+    print(f"   sent   {counts['sent']:,} in {send_time:.2f}s ({counts['sent'] / send_time:,.0f} msg/s, "
+          f"{concurrency} in flight, {latency * 1000:.0f} ms per send; serial ≈ {1 / latency if latency else 0:,.0f} msg/s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Size-confirmation message outbox")
+    parser.add_argument("--queue", action="store_true", help="queue messages for unconfirmed recommendations")
+    parser.add_argument("--send", action="store_true", help="drain the outbox once")
+    parser.add_argument("--watch", type=float, metavar="SECONDS", help="keep draining every SECONDS")
+    parser.add_argument("--stub", action="store_true", help="log messages instead of sending them")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--benchmark", type=int, metavar="N", help="stub-transport throughput for N messages")
+    parser.add_argument("--latency", type=float, default=0.05, help="stub send latency for --benchmark")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    if args.benchmark:
+        benchmark(args.benchmark, args.latency, args.concurrency)
+        return
+
+    if args.queue:
+        con = sqlite3.connect(DB_PATH)
+        try:
+            queue_confirmations(con)
+        finally:
+            con.close()
+
+    if args.send or args.watch:
+        if args.stub:
+            transport = StubTransport()
+        elif WHATSAPP_API_URL and WHATSAPP_TOKEN:
+            transport = WhatsAppTransport(WHATSAPP_API_URL, WHATSAPP_TOKEN)
+        else:
+            raise SystemExit("WHATSAPP_API_URL / WHATSAPP_TOKEN not set – pass --stub to dry-run")
+
+        async def run():
+            sender = OutboxSender(transport, concurrency=args.concurrency)
+            try:
+                if args.watch:
+                    await sender.watch(args.watch)
+                else:
+                    await sender.drain()
+            finally:
+                await sender.close()
+
+        try:
+            asyncio.run(run())
+        except KeyboardInterrupt:
+            logger.info("👋 Outbox sender stopped")
+
+    con = sqlite3.connect(DB_PATH)
+    try:
+        print(f"📬 Outbox: {outbox_summary(con) or 'empty'}")
+    finally:
+        con.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,21 +3,35 @@
 Size Recommendation Engine for Kaspi Orders
 Recommends clothing sizes based on customer height/weight and product type
 """
-import pandas as pd
-import sqlite3
-import pathlib
+import argparse
+import functools
 import logging
-from typing import Dict, Optional, Tuple
+import time
+from typing import Dict, List, Optional, Tuple
 from dataclasses import dataclass
 
-# Setup paths
-DB_PATH = pathlib.Path(__file__).resolve().parents[1] / "db" / "erp.db"
+import numpy as np
+
+import size_grid
+from recommendation_writer import RecommendationWriter, default_writer
+from size_outbox import confirmation_message
+from size_charts import ChartSnapshot, ChartStore
+
+MEMO_SIZE = 65536  # recommendations remembered per engine (repeat queries are common)
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 
+def _number(value) -> float:
+    """JSON / user input → float, NaN when missing or not a number (like pd.to_numeric coerce)"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float('nan')
+
+
 @dataclass
 class SizeRecommendation:
     """Size recommendation result"""
@@ -116,15 +130,30 @@ class SizeRecommendationEngine:
         }
     }
     
-    def __init__(self):
+    _charts: Optional[ChartStore] = None  # shared by every engine: compiled once, reloaded on change
+    
+    def __init__(self,
+                 writer: Optional[RecommendationWriter] = None,
+                 charts: Optional[ChartStore] = None,
+                 memo_size: int = MEMO_SIZE):
         self.logger = logging.getLogger(__name__)
+        self._writer = writer  # default: the process-wide writer, created on first save
+        if charts is None:
+            if SizeRecommendationEngine._charts is None:
+                SizeRecommendationEngine._charts = ChartStore(fallback=self.SIZE_CHARTS)
+            charts = SizeRecommendationEngine._charts
+        self.charts = charts
+        # Keyed by the chart snapshot (its version) and the query, so new charts never hit stale entries
+        self._memo = functools.lru_cache(maxsize=memo_size)(self._recommend)
     
     def recommend_size(self, 
                       height_cm: int, 
                       weight_kg: int, 
                       gender: str, 
                       product_type: str,
-                      age: Optional[int] = None) -> SizeRecommendation:
+                      age: Optional[int] = None,
+                      sub_category: Optional[str] = None,
+                      brand: Optional[str] = None) -> SizeRecommendation:
         """
         Recommend size based on customer measurements
         
@@ -134,12 +163,21 @@ class SizeRecommendationEngine:
             gender: 'Men', 'Women', or 'Kids'
             product_type: Product category (e.g., 'CL' for clothing)
             age: Age in years (required for kids)
+            sub_category: Catalog Sub_Category, for charts specific to it
+            brand: Catalog brand (Brend), for charts specific to it
             
         Returns:
             SizeRecommendation object with recommended size and details
         """
-        
-        if product_type not in self.SIZE_CHARTS:
+        recommendation = self._memo(self.charts.snapshot(), height_cm, weight_kg, gender,
+                                    product_type, age, sub_category, brand)
+        # Memoized objects are shared – hand out a copy callers may change
+        return SizeRecommendation(recommendation.recommended_size, recommendation.confidence_score,
+                                  recommendation.reasoning, list(recommendation.alternative_sizes))
+    
+    def _recommend(self, snapshot: ChartSnapshot, height_cm, weight_kg, gender, product_type,
+                   age, sub_category, brand) -> SizeRecommendation:
+        if product_type not in snapshot.product_types:
             return SizeRecommendation(
                 recommended_size="M",  # Default fallback
                 confidence_score=0.1,
@@ -147,7 +185,8 @@ class SizeRecommendationEngine:
                 alternative_sizes=["S", "L"]
             )
         
-        if gender not in self.SIZE_CHARTS[product_type]:
+        found = snapshot.resolve(product_type, gender, sub_category, brand)
+        if found is None:
             return SizeRecommendation(
                 recommended_size="M",  # Default fallback
                 confidence_score=0.1,
@@ -155,15 +194,157 @@ class SizeRecommendationEngine:
                 alternative_sizes=["S", "L"]
             )
         
-        size_chart = self.SIZE_CHARTS[product_type][gender]
+        chart, grid = found
+        if isinstance(grid, size_grid.KidsGrid):
+            cell = grid.lookup(height_cm, age)
+            if cell is None:
+                return self._recommend_kids_size(height_cm, age, chart)
+            return self._kids_from_cell(cell, height_cm, age)
+        else:
+            cell = grid.lookup(height_cm, weight_kg)
+            if cell is None:
+                return self._recommend_adult_size(height_cm, weight_kg, chart)
+            return self._adult_from_cell(cell, height_cm, weight_kg)
+    
+    def recommend_sizes(self, df: "pd.DataFrame") -> "pd.DataFrame":
+        """
+        Batch form of recommend_size for a whole DataFrame of customers
+        
+        Args:
+            df: height_cm, weight_kg, gender and product_type columns;
+                age, sub_category and brand are optional
+            
+        Returns:
+            DataFrame on df's index with recommended_size, confidence_score and
+            alternative_sizes – the same values recommend_size gives per row
+        """
+        import pandas as pd
         
-        if gender == 'Kids':
-            return self._recommend_kids_size(height_cm, age, size_chart)
+        heights = pd.to_numeric(df['height_cm'], errors='coerce').to_numpy(dtype=float)
+        weights = pd.to_numeric(df['weight_kg'], errors='coerce').to_numpy(dtype=float)
+        if 'age' in df:
+            ages = pd.to_numeric(df['age'], errors='coerce').to_numpy(dtype=float)
+        else:
+            ages = np.zeros(len(df))
+        keys = ['product_type', 'gender'] + [c for c in ('sub_category', 'brand') if c in df]
+        groups = [(dict(zip(keys, key)), rows)
+                  for key, rows in df.groupby(keys, sort=False, dropna=False).indices.items()]
+        sizes, confidence, alternatives = self._recommend_groups(heights, weights, ages, groups)
+        return pd.DataFrame({
+            'recommended_size': sizes,
+            'confidence_score': confidence,
+            'alternative_sizes': alternatives,
+        }, index=df.index)
+    
+    def recommend_many(self, requests: List[Dict]) -> List[Dict]:
+        """
+        Batch form of recommend_size for plain dicts (no pandas needed)
+        
+        Args:
+            requests: dicts with recommend_size's argument names
+            
+        Returns:
+            One dict per request with recommended_size, confidence_score and alternative_sizes
+        """
+        heights = np.array([_number(r.get('height_cm')) for r in requests], dtype=float)
+        weights = np.array([_number(r.get('weight_kg')) for r in requests], dtype=float)
+        ages = np.array([_number(r.get('age')) for r in requests], dtype=float)
+        keys: Dict[Tuple, List[int]] = {}
+        for i, r in enumerate(requests):
+            key = (r.get('product_type'), r.get('gender'), r.get('sub_category'), r.get('brand'))
+            keys.setdefault(key, []).append(i)
+        groups = [(dict(zip(('product_type', 'gender', 'sub_category', 'brand'), key)), np.array(rows))
+                  for key, rows in keys.items()]
+        sizes, confidence, alternatives = self._recommend_groups(heights, weights, ages, groups)
+        return [{'recommended_size': size, 'confidence_score': conf, 'alternative_sizes': alts}
+                for size, conf, alts in zip(sizes.tolist(), confidence.tolist(), alternatives)]
+    
+    def _recommend_groups(self, heights: np.ndarray, weights: np.ndarray, ages: np.ndarray,
+                          groups: List[Tuple[Dict, np.ndarray]]) -> Tuple[np.ndarray, np.ndarray, List]:
+        """Vectorized pass shared by the batch APIs: rows of each chart key at once"""
+        n = len(heights)
+        # Unknown product type / gender keep the default
+        sizes = np.full(n, "M", dtype=object)
+        confidence = np.full(n, 0.1)
+        alternatives = [["S", "L"] for _ in range(n)]
+        
+        snapshot = self.charts.snapshot()
+        for key, rows in groups:
+            found = snapshot.resolve(**key)
+            if found is None:
+                continue
+            grid = found[1]
+            if isinstance(grid, size_grid.KidsGrid):
+                index, conf, kind = grid.lookup_many(heights[rows], ages[rows])
+                matched = kind != size_grid.KIDS_DEFAULT
+                sizes[rows] = np.where(matched, grid.sizes_of(index, kind), "26")
+                confidence[rows] = np.where(matched, conf, 0.1)
+                for row, ok in zip(rows.tolist(), matched.tolist()):
+                    alternatives[row] = [] if ok else ["24", "28"]
+            else:
+                best, conf, alts = grid.lookup_many(heights[rows], weights[rows])
+                matched = best >= 0
+                labels = np.array(grid.sizes + [None], dtype=object)
+                sizes[rows] = np.where(matched, labels[best], "M")
+                confidence[rows] = np.where(matched, conf, 0.2)
+                for row, ok, alt in zip(rows.tolist(), matched.tolist(), alts.tolist()):
+                    alternatives[row] = [grid.sizes[i] for i in alt if i >= 0] if ok else ["S", "L", "XL"]
+        return sizes, confidence, alternatives
+    
+    def _adult_from_cell(self, cell: Tuple, height_cm: int, weight_kg: int) -> SizeRecommendation:
+        """Same result as _recommend_adult_size, read from a precompiled grid cell"""
+        size, confidence, alternatives = cell
+        if size is None:
+            return SizeRecommendation(
+                recommended_size="M",
+                confidence_score=0.2,
+                reasoning=f"No exact match for height {height_cm}cm, weight {weight_kg}kg - using default",
+                alternative_sizes=["S", "L", "XL"]
+            )
+        
+        reasoning = f"Based on height {height_cm}cm and weight {weight_kg}kg"
+        if confidence > 0.8:
+            reasoning += " - excellent fit"
+        elif confidence > 0.6:
+            reasoning += " - good fit"
+        else:
+            reasoning += " - approximate fit"
+        
+        return SizeRecommendation(
+            recommended_size=size,
+            confidence_score=confidence,
+            reasoning=reasoning,
+            alternative_sizes=list(alternatives)
+        )
+    
+    def _kids_from_cell(self, cell: Tuple, height_cm: int, age: Optional[int]) -> SizeRecommendation:
+        """Same result as _recommend_kids_size, read from a precompiled grid cell"""
+        size, confidence, kind = cell
+        if kind == size_grid.KIDS_AGE:
+            reasoning = f"Perfect match for age {age} and height {height_cm}cm"
+        elif kind == size_grid.KIDS_HEIGHT:
+            reasoning = f"Good fit for height {height_cm}cm"
+        elif kind == size_grid.KIDS_CLOSEST:
+            reasoning = f"Approximate fit for height {height_cm}cm (closest available size)"
         else:
-            return self._recommend_adult_size(height_cm, weight_kg, size_chart)
+            return SizeRecommendation(
+                recommended_size="26",
+                confidence_score=0.1,
+                reasoning="Default kids size - please verify",
+                alternative_sizes=["24", "28"]
+            )
+        return SizeRecommendation(
+            recommended_size=size,
+            confidence_score=confidence,
+            reasoning=reasoning,
+            alternative_sizes=[]
+        )
     
     def _recommend_adult_size(self, height_cm: int, weight_kg: int, size_chart: Dict) -> SizeRecommendation:
-        """Recommend size for adults based on height/weight matrix"""
+        """Recommend size for adults based on height/weight matrix
+
+        Reference scan; recommend_size answers from the grid compiled from it.
+        """
         
         best_match = None
         best_score = 0
@@ -227,7 +408,10 @@ class SizeRecommendationEngine:
         )
     
     def _recommend_kids_size(self, height_cm: int, age: Optional[int], size_chart: Dict) -> SizeRecommendation:
-        """Recommend size for kids based on height and age"""
+        """Recommend size for kids based on height and age
+
+        Reference scan; recommend_size answers from the grid compiled from it.
+        """
         
         if age:
             # Try age-height matrix first
@@ -280,80 +464,121 @@ class SizeRecommendationEngine:
                                     customer_name: str,
                                     product_name: str,
                                     recommendation: SizeRecommendation) -> str:
-        """Generate WhatsApp message for size confirmation"""
-        
-        message = f"Привет {customer_name}! 👋\n\n"
-        message += f"Для товара '{product_name}' мы рекомендуем размер: *{recommendation.recommended_size}*\n\n"
-        message += f"Обоснование: {recommendation.reasoning}\n"
-        
-        if recommendation.confidence_score > 0.8:
-            message += "✅ Мы уверены в этом размере!\n"
-        elif recommendation.confidence_score > 0.6:
-            message += "👍 Хороший выбор размера\n"
-        else:
-            message += "⚠️ Приблизительный размер, пожалуйста проверьте\n"
-        
-        if recommendation.alternative_sizes:
-            message += f"\nАльтернативные размеры: {', '.join(recommendation.alternative_sizes)}\n"
-        
-        message += "\nПожалуйста, подтвердите размер или сообщите ваши предпочтения! 📏"
-        
-        return message
+        """Generate WhatsApp message for size confirmation (template shared with size_outbox)"""
+        return confirmation_message(customer_name, product_name, recommendation)
     
     def save_recommendation(self, 
                           order_id: str, 
                           recommendation: SizeRecommendation,
                           customer_height: int,
-                          customer_weight: int) -> None:
-        """Save recommendation to database for tracking"""
+                          customer_weight: int,
+                          gender: Optional[str] = None,
+                          product_type: Optional[str] = None,
+                          brand: Optional[str] = None) -> None:
+        """Queue recommendation for tracking (written in batches by the writer)"""
+        self.writer.add(order_id, recommendation, customer_height, customer_weight,
+                        gender, product_type, brand)
+    
+    def confirm_sizes(self, confirmations) -> None:
+        """Record the sizes customers confirmed: (order_id, final_size) pairs"""
+        self.writer.confirm_sizes(confirmations)
+    
+    @property
+    def writer(self) -> RecommendationWriter:
+        if self._writer is None:
+            self._writer = default_writer()
+        return self._writer
+
+
+def benchmark(samples: int = 20000) -> None:
+    """Check the compiled grids against the reference scan and time scan, grid and memo per call"""
+    import pandas as pd
+    
+    charts = ChartStore(db_path=None, fallback=SizeRecommendationEngine.SIZE_CHARTS)
+    engine = SizeRecommendationEngine(charts=charts, memo_size=0)
+    memoized = SizeRecommendationEngine(charts=charts)
+    rng = np.random.default_rng(0)
+    size_charts = engine.SIZE_CHARTS['CL']
+    
+    def scan(gender, height, weight, age):
+        if gender == 'Kids':
+            return engine._recommend_kids_size(height, age, size_charts[gender])
+        return engine._recommend_adult_size(height, weight, size_charts[gender])
+    
+    print("⏱️ SIZE RECOMMENDATION BENCHMARK")
+    print("=" * 50)
+    for gender in size_charts:
+        # Whole-number points on and off the grid, plus fractional ones (scorer path)
+        heights = np.concatenate([rng.integers(60, 230, samples), rng.uniform(60, 230, samples // 10),
+                                  rng.integers(251, 300, samples // 10)]).tolist()
+        n = len(heights)
+        weights = np.concatenate([rng.integers(10, 160, n - samples // 10),
+                                  rng.uniform(10, 160, samples // 10)]).tolist()
+        ages = [None if a == 0 else a for a in rng.integers(0, 14, n).tolist()]
+        points = list(zip(heights, weights, ages))
         
-        con = sqlite3.connect(DB_PATH)
-        try:
-            cur = con.cursor()
-            
-            # Create table if not exists
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS size_recommendations (
-                    order_id TEXT,
-                    recommended_size TEXT,
-                    confidence_score REAL,
-                    reasoning TEXT,
-                    customer_height INTEGER,
-                    customer_weight INTEGER,
-                    alternative_sizes TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    final_size TEXT,
-                    customer_confirmed BOOLEAN DEFAULT FALSE
-                )
-            """)
-            
-            # Insert recommendation
-            cur.execute("""
-                INSERT INTO size_recommendations 
-                (order_id, recommended_size, confidence_score, reasoning, 
-                 customer_height, customer_weight, alternative_sizes)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            """, (
-                order_id,
-                recommendation.recommended_size,
-                recommendation.confidence_score,
-                recommendation.reasoning,
-                customer_height,
-                customer_weight,
-                ','.join(recommendation.alternative_sizes)
-            ))
-            
-            con.commit()
-            self.logger.info(f"Saved size recommendation for order {order_id}")
-            
-        except Exception as e:
-            self.logger.error(f"Error saving recommendation: {e}")
-        finally:
-            con.close()
+        expected = [scan(gender, h, w, a) for h, w, a in points]
+        actual = [engine.recommend_size(h, w, gender, 'CL', a) for h, w, a in points]
+        mismatches = sum(e != a for e, a in zip(expected, actual))
+        
+        # Per-call latency on the grid (whole numbers in range)
+        on_grid = points[:samples]
+        start = time.perf_counter()
+        for h, w, a in on_grid:
+            scan(gender, h, w, a)
+        scan_us = (time.perf_counter() - start) / samples * 1e6
+        start = time.perf_counter()
+        for h, w, a in on_grid:
+            engine.recommend_size(h, w, gender, 'CL', a)
+        grid_us = (time.perf_counter() - start) / samples * 1e6
+        
+        # Repeat queries answered by the memo
+        for h, w, a in on_grid:
+            memoized.recommend_size(h, w, gender, 'CL', a)
+        start = time.perf_counter()
+        for h, w, a in on_grid:
+            memoized.recommend_size(h, w, gender, 'CL', a)
+        memo_us = (time.perf_counter() - start) / samples * 1e6
+        
+        status = "✅" if not mismatches else "❌"
+        print(f"   {status} {gender:<6} scan {scan_us:5.1f} µs, grid {grid_us:4.1f} µs, memo {memo_us:4.1f} µs "
+              f"per call ({scan_us / grid_us:.1f}x / {scan_us / memo_us:.1f}x); {mismatches}/{n} mismatches")
+    
+    # Batch API on a morning-sized mix of genders, product types and off-grid rows
+    n = 2000
+    batch = pd.DataFrame({
+        'height_cm': np.where(rng.random(n) < 0.9, rng.integers(60, 230, n), rng.uniform(60, 300, n)),
+        'weight_kg': rng.integers(10, 160, n).astype(float),
+        'gender': rng.choice(['Men', 'Women', 'Kids', 'Unisex'], n),
+        'product_type': rng.choice(['CL', 'CL', 'CL', 'SH'], n),
+        'age': rng.choice([np.nan, 3, 5, 8, 12], n),
+    })
+    records = [
+        engine.recommend_size(r.height_cm, r.weight_kg, r.gender, r.product_type,
+                              None if pd.isna(r.age) else int(r.age))
+        for r in batch.itertuples()
+    ]
+    start = time.perf_counter()
+    result = engine.recommend_sizes(batch)
+    batch_ms = (time.perf_counter() - start) * 1000
+    mismatches = sum(
+        (rec.recommended_size, rec.confidence_score, rec.alternative_sizes) != row
+        for rec, row in zip(records, result.itertuples(index=False, name=None))
+    )
+    status = "✅" if not mismatches else "❌"
+    print(f"   {status} Batch  {n} rows in {batch_ms:.1f} ms; {mismatches}/{n} mismatches")
 
 
 def main():
     """Test the size recommendation engine"""
+    ap = argparse.ArgumentParser(description="Size recommendation engine demo")
+    ap.add_argument("--benchmark", action="store_true",
+                    help="compare the compiled grids with the reference scan and time both")
+    args = ap.parse_args()
+    if args.benchmark:
+        benchmark()
+        return
+    
     engine = SizeRecommendationEngine()
     
     # Test cases
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+Local HTTP service for size recommendations
+Bot workers share one warm SizeRecommendationEngine instead of each importing
+it. Concurrent requests are collected into micro-batches (up to MAX_BATCH
+requests; everything that arrived while the previous pass ran, optionally
+waiting MAX_WAIT_MS for more) and answered by one vectorized recommend_many pass.
+Standard-library asyncio only; pandas is never imported on this path
+
+    python scripts/size_service.py --port 8765
+    curl -s localhost:8765/recommend -d '{"height_cm": 178, "weight_kg": 80, "gender": "Men", "product_type": "CL"}'
+    curl -s localhost:8765/metrics
+"""
+import time
+
+STARTED = time.perf_counter()
+
+import argparse
+import asyncio
+import json
+import logging
+import pathlib
+from collections import deque
+from typing import Deque, Dict, List, Tuple
+
+from size_charts import DB_PATH, ChartStore
+from size_recommendation_engine import SizeRecommendationEngine
+
+HOST = "127.0.0.1"
+PORT = 8765
+
+MAX_BATCH = 256        # requests answered by one recommend pass
+MAX_WAIT_MS = 0.0      # extra wait for company; 0 = whatever queued while the last pass ran
+MAX_ITEMS = 1000       # customers in one POST
+MEASUREMENTS = ('height_cm', 'weight_kg', 'age')  # optional, numbers (or numeric strings)
+LABELS = ('sub_category', 'brand')                # optional, strings
+LATENCY_WINDOW = 10000  # latest requests kept for the percentiles
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           500: "Internal Server Error"}
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+class Metrics:
+    """Request latency percentiles and batch sizes"""
+
+    def __init__(self):
+        self.latencies: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self.requests = 0
+        self.customers = 0
+        self.batches = 0
+        self.max_batch = 0
+        self.errors = 0
+        self.started = time.monotonic()
+
+    def observe(self, seconds: float) -> None:
+        self.requests += 1
+        self.latencies.append(seconds)
+
+    def batch(self, size: int) -> None:
+        self.batches += 1
+        self.customers += size
+        self.max_batch = max(self.max_batch, size)
+
+    def percentile(self, q: float) -> float:
+        values = sorted(self.latencies)
+        return values[min(len(values) - 1, int(q * len(values)))] * 1000 if values else 0.0
+
+    def snapshot(self) -> Dict:
+        return {
+            'requests': self.requests,
+            'customers': self.customers,
+            'errors': self.errors,
+            'batches': self.batches,
+            'avg_batch': round(self.customers / self.batches, 1) if self.batches else 0,
+            'max_batch': self.max_batch,
+            'p50_ms': round(self.percentile(0.50), 3),
+            'p99_ms': round(self.percentile(0.99), 3),
+            'uptime_s': round(time.monotonic() - self.started),
+        }
+
+
+class MicroBatcher:
+    """Queue of pending customers answered together by recommend_many"""
+
+    def __init__(self, engine: SizeRecommendationEngine, metrics: Metrics,
+                 max_batch: int = MAX_BATCH, max_wait_ms: float = MAX_WAIT_MS):
+        self.engine = engine
+        self.metrics = metrics
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.queue: asyncio.Queue = asyncio.Queue()
+
+    async def submit(self, customers: List[Dict]) -> List[Dict]:
+        loop = asyncio.get_running_loop()
+        futures = [loop.create_future() for _ in customers]
+        for customer, future in zip(customers, futures):
+            self.queue.put_nowait((customer, future))
+        return list(await asyncio.gather(*futures))
+
+    async def _collect(self) -> List[Tuple[Dict, asyncio.Future]]:
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        await asyncio.sleep(0)  # one loop turn: requests read alongside this one join the batch
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self.queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def run(self) -> None:
+        while True:
+            batch = await self._collect()
+            self.metrics.batch(len(batch))
+            await charts_snapshot(self.engine)  # a due chart reload compiles off the loop
+            try:
+                # Microseconds per customer – cheaper on the loop than a thread hop
+                results = self.engine.recommend_many([customer for customer, _ in batch])
+            except Exception as e:
+                logger.error(f"❌ Recommend pass failed for {len(batch)} customers, "
+                             f"answering them one by one: {e}")
+                results = None
+            for i, (customer, future) in enumerate(batch):
+                if future.done():
+                    continue
+                if results is not None:
+                    future.set_result(results[i])
+                    continue
+                # One bad customer must not fail the others in the batch
+                try:
+                    future.set_result(self.engine.recommend_many([customer])[0])
+                except Exception as e:
+                    future.set_exception(e)
+
+
+async def charts_snapshot(engine: SizeRecommendationEngine):
+    """The engine's chart snapshot; a due reload runs in a worker thread"""
+    if engine.charts.due():
+        return await asyncio.to_thread(engine.charts.snapshot)
+    return engine.charts.snapshot()
+
+
+def _is_number(value) -> bool:
+    if isinstance(value, str):
+        try:
+            float(value)
+        except ValueError:
+            return False
+        return True
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _validate(payload) -> List[Dict]:
+    customers = payload if isinstance(payload, list) else [payload]
+    if not customers or len(customers) > MAX_ITEMS:
+        raise ValueError(f"send 1 to {MAX_ITEMS} customers")
+    for customer in customers:
+        if not isinstance(customer, dict):
+            raise ValueError("every customer must be an object")
+        for key in ('gender', 'product_type'):
+            if not isinstance(customer.get(key), str) or not customer[key]:
+                raise ValueError(f"every customer needs {key} as a string")
+        for key in LABELS:
+            if customer.get(key) is not None and not isinstance(customer[key], str):
+                raise ValueError(f"{key} must be a string")
+        for key in MEASUREMENTS:
+            if customer.get(key) is not None and not _is_number(customer[key]):
+                raise ValueError(f"{key} must be a number")
+    return customers
+
+
+class SizeService:
+    def __init__(self, engine: SizeRecommendationEngine, max_batch: int = MAX_BATCH,
+                 max_wait_ms: float = MAX_WAIT_MS):
+        self.engine = engine
+        self.metrics = Metrics()
+        self.batcher = MicroBatcher(engine, self.metrics, max_batch, max_wait_ms)
+
+    async def route(self, method: str, path: str, body: bytes) -> Tuple[int, object]:
+        path = path.split('?', 1)[0]
+        if path == '/recommend':
+            if method != 'POST':
+                return 405, {'error': 'POST a customer or a list of customers'}
+            try:
+                payload = json.loads(body or b'null')
+                customers = _validate(payload)
+            except ValueError as e:  # JSONDecodeError included
+                return 400, {'error': str(e)}
+            try:
+                results = await self.batcher.submit(customers)
+            except Exception as e:
+                self.metrics.errors += 1
+                return 500, {'error': str(e)}
+            return 200, results if isinstance(payload, list) else results[0]
+        if path == '/metrics':
+            charts = await charts_snapshot(self.engine)
+            return 200, {**self.metrics.snapshot(), 'chart_version': charts.version}
+        if path == '/health':
+            return 200, {'status': 'ok'}
+        return 404, {'error': f'unknown path {path}'}
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """HTTP/1.1 with keep-alive: one request after another on the connection"""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                started = time.perf_counter()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                try:
+                    method, path, _ = request_line.decode('latin-1').split(' ', 2)
+                    body = await reader.readexactly(int(headers.get('content-length') or 0))
+                    status, payload = await self.route(method, path, body)
+                except ValueError:
+                    status, payload, path = 400, {'error': 'malformed request'}, ''
+                keep_alive = status != 400 and headers.get('connection', '').lower() != 'close'
+                data = json.dumps(payload, ensure_ascii=False).encode()
+                writer.write(f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                             f"Content-Type: application/json; charset=utf-8\r\n"
+                             f"Content-Length: {len(data)}\r\n"
+                             f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + data)
+                await writer.drain()
+                if path.startswith('/recommend'):
+                    self.metrics.observe(time.perf_counter() - started)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(host: str, port: int, max_batch: int, max_wait_ms: float,
+                db_path: pathlib.Path = DB_PATH) -> None:
+    engine = SizeRecommendationEngine(charts=ChartStore(db_path, fallback=SizeRecommendationEngine.SIZE_CHARTS))
+    engine.charts.snapshot()  # compile the charts before the first request
+    service = SizeService(engine, max_batch, max_wait_ms)
+    server = await asyncio.start_server(service.handle, host, port)
+    batcher = asyncio.create_task(service.batcher.run())
+    logger.info(f"🚀 Size service on http://{host}:{port} – ready {time.perf_counter() - STARTED:.2f}s "
+                f"after start (batches of up to {max_batch}, {max_wait_ms} ms wait)")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        batcher.cancel()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Size recommendation HTTP service")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH)
+    parser.add_argument("--max-wait-ms", type=float, default=MAX_WAIT_MS)
+    parser.add_argument("--db", type=pathlib.Path, default=DB_PATH, help="database holding size_charts")
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port, args.max_batch, args.max_wait_ms, args.db))
+    except KeyboardInterrupt:
+        logger.info("👋 Size service stopped")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Load test for size_service.py
+Fires --requests recommendations from --concurrency keep-alive clients and
+reports client-side p50 / p99 latency and throughput next to the service's own
+/metrics (batch sizes, server-side percentiles)
+
+    python scripts/size_service_load_test.py --requests 20000 --concurrency 64
+    python scripts/size_service_load_test.py --spawn --db /tmp/erp.db   # start a service for the run
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+HOST = "127.0.0.1"
+PORT = 8765
+GENDERS = ['Men', 'Women', 'Kids']
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def sample_customer(rng: random.Random) -> Dict:
+    gender = rng.choice(GENDERS)
+    if gender == 'Kids':
+        return {'height_cm': rng.randint(60, 160), 'weight_kg': rng.randint(5, 50),
+                'gender': gender, 'product_type': 'CL', 'age': rng.randint(0, 14)}
+    return {'height_cm': rng.randint(150, 200), 'weight_kg': rng.randint(45, 130),
+            'gender': gender, 'product_type': 'CL'}
+
+
+def percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] * 1000 if values else 0.0
+
+
+class Connection:
+    """One keep-alive HTTP/1.1 connection – httpx's per-request overhead would
+    make the load generator, not the service, the bottleneck"""
+
+    def __init__(self, host: str, port: int):
+        self.host, self.port = host, port
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+
+    async def request(self, method: str, path: str, payload=None) -> Tuple[int, object]:
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        body = json.dumps(payload).encode() if payload is not None else b''
+        self.writer.write(f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\n"
+                          f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body)
+        status = int((await self.reader.readline()).split()[1])
+        length = 0
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            name, _, value = line.partition(b':')
+            if name.strip().lower() == b'content-length':
+                length = int(value)
+        return status, json.loads(await self.reader.readexactly(length))
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+
+
+async def wait_ready(host: str, port: int, timeout: float = 30) -> None:
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        connection = Connection(host, port)
+        try:
+            if (await connection.request("GET", "/health"))[0] == 200:
+                return
+        except OSError:
+            await asyncio.sleep(0.05)
+        finally:
+            connection.close()
+    raise RuntimeError(f"service did not answer /health within {timeout}s")
+
+
+async def run(host: str, port: int, requests: int, concurrency: int, seed: int) -> Dict:
+    rng = random.Random(seed)
+    customers = [sample_customer(rng) for _ in range(requests)]
+    latencies: List[float] = []
+    failures = 0
+    await wait_ready(host, port)
+    pending = iter(customers)
+
+    async def worker():
+        nonlocal failures
+        connection = Connection(host, port)
+        try:
+            for customer in pending:
+                start = time.perf_counter()
+                try:
+                    status, _ = await connection.request("POST", "/recommend", customer)
+                except (OSError, asyncio.IncompleteReadError, ValueError):
+                    connection.close()
+                    connection = Connection(host, port)
+                    status = None
+                if status != 200:
+                    failures += 1
+                    continue
+                latencies.append(time.perf_counter() - start)
+        finally:
+            connection.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    metrics = Connection(host, port)
+    _, server = await metrics.request("GET", "/metrics")
+    metrics.close()
+    return {'requests': requests, 'failures': failures, 'elapsed': elapsed,
+            'rps': len(latencies) / elapsed, 'p50_ms': percentile(latencies, 0.50),
+            'p99_ms': percentile(latencies, 0.99), 'server': server}
+
+
+def spawn(port: int, db: Optional[Path]) -> subprocess.Popen:
+    command = [sys.executable, str(Path(__file__).with_name("size_service.py")), "--port", str(port)]
+    if db:
+        command += ["--db", str(db)]
+    return subprocess.Popen(command)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the size recommendation service")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--requests", type=int, default=10000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--spawn", action="store_true", help="start size_service.py for the run")
+    parser.add_argument("--db", type=Path, help="database for the spawned service")
+    args = parser.parse_args()
+
+    service = spawn(args.port, args.db) if args.spawn else None
+    try:
+        result = asyncio.run(run(args.host, args.port, args.requests, args.concurrency, args.seed))
+    finally:
+        if service is not None:
+            service.terminate()
+            service.wait()
+
+    server = result['server']
+    logger.info(f"📊 {result['requests']:,} requests, {args.concurrency} clients, "
+                f"{result['failures']} failed, {result['elapsed']:.1f}s")
+    print(f"   client  {result['rps']:>8,.0f} req/s   p50 {result['p50_ms']:.2f} ms   p99 {result['p99_ms']:.2f} ms")
+    print(f"   server  p50 {server['p50_ms']:.2f} ms   p99 {server['p99_ms']:.2f} ms   "
+          f"{server['batches']:,} batches, avg {server['avg_batch']} / max {server['max_batch']} customers")
+
+
+if __name__ == "__main__":
+    main()
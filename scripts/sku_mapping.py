@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+SKU mapping shared by the order loaders
+Maps raw Kaspi product names to sku_key/weight and prices delivery per line
+"""
+import pandas as pd
+import pathlib
+import logging
+
+from catalog_loader import load_catalog
+
+RAW_DIR  = pathlib.Path(__file__).resolve().parents[1] / "data_raw"
+MAP_PATH = RAW_DIR / "M02_SKU_CATALOG Sample for gpt.csv"
+
+KASPI_FEE_PCT = 0.12
+
+logger = logging.getLogger(__name__)
+
+
+def load_sku_map() -> pd.DataFrame:
+    """Load sku_name_raw → sku_key/weight_g mapping (semicolon CSV, robust)"""
+    empty = pd.DataFrame(columns=["sku_name_raw", "sku_key", "weight_g"])
+    if not MAP_PATH.exists():
+        return empty
+
+    raw = load_catalog(MAP_PATH)
+    if 'sku_name_raw' not in raw.columns:
+        logger.warning(f"⚠️  {MAP_PATH.name} has no sku_name_raw column – SKU mapping disabled")
+        return empty
+
+    return (
+        raw.rename(columns={'SKU_key': 'sku_key',
+                            'Weight_kg': 'weight_kg',
+                            'sku_name_raw': 'sku_name_raw'})
+        .assign(
+            sku_name_raw=lambda d: d['sku_name_raw'].str.strip(),
+            weight_g=lambda d: pd.to_numeric(
+                d['weight_kg'].str.replace(',', '.'),
+                errors='coerce') * 1000
+        )[["sku_name_raw", "sku_key", "weight_g"]]
+    )
+
+
+def calc_delivery(row) -> int:
+    """Delivery fee for one order line"""
+    price = row["gross_price_kzt"]
+    kg    = row.get("weight_g", 0) / 1000 if pd.notna(row.get("weight_g")) else 0
+    base = 0 if price >= 15000 else 699 if price >= 10000 else 799 if price >= 5000 else 999
+    extra = max(0, int(-(-kg // 1)) - 3) * 399   # charges after 3 kg
+    return base + extra
+
+
+def map_order_lines(df: pd.DataFrame, map_df: pd.DataFrame) -> pd.DataFrame:
+    """Attach sku_key, weight and delivery cost to order lines"""
+    df = df.copy()
+    df['kaspi_fee_pct'] = KASPI_FEE_PCT
+    df['sku_name_raw'] = df['sku_name_raw'].astype(str).str.strip()
+
+    df = df.merge(map_df, on='sku_name_raw', how='left')
+    df['sku_key'] = df['sku_key'].fillna(df['sku_name_raw'].str.upper())
+    df['delivery_cost_kzt'] = df.apply(calc_delivery, axis=1) if len(df) else pd.Series(dtype=int)
+    return df
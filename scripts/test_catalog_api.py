@@ -5,6 +5,8 @@ import pathlib
 import os
 from dotenv import load_dotenv
 
+from catalog_loader import bad_lines, load_catalog
+
 # Load environment variables
 load_dotenv()
 
@@ -21,8 +23,11 @@ def test_catalog_loading():
         return False
     
     try:
-        df = pd.read_csv(CATALOG_PATH, sep=';', engine='python', dtype=str, on_bad_lines='skip')
+        df = load_catalog(CATALOG_PATH)
         print(f"✅ Successfully loaded {len(df)} rows from catalog CSV")
+        skipped = bad_lines(CATALOG_PATH)
+        if skipped:
+            print(f"⚠️  {len(skipped)} malformed lines skipped, first: {skipped[0]}")
         
         # Check required columns
         required_cols = ['SKU_ID', 'Kaspi_name_core', 'Kaspi_art_1', 'Brend', 'Model', 'Color']
@@ -6,6 +6,8 @@ from dotenv import load_dotenv
 import asyncio
 import logging
 
+from etl_catalog_api import KaspiAPI
+
 # Load environment variables
 load_dotenv()
 
@@ -23,34 +25,24 @@ async def test_api_connection():
         logger.error("❌ KASPI_TOKEN not found in environment")
         return False
     
-    headers = {
-        "X-Auth-Token": KASPI_TOKEN,
-        "Content-Type": "application/json"
-    }
+    # No HTTP cache: a cached listing would report success without reaching the API
+    api = KaspiAPI(KASPI_TOKEN, BASE_URL, cache=None)
     
     try:
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            logger.info("🔗 Testing connection to Kaspi API...")
-            
-            # Try to get products (this should work if token is valid)
-            response = await client.get(
-                f"{BASE_URL}/products",
-                headers=headers
-            )
-            
-            if response.status_code == 200:
-                data = response.json()
-                products_count = len(data.get('data', []))
-                logger.info(f"✅ API connection successful!")
-                logger.info(f"   Found {products_count} existing products in your store")
-                return True
-            else:
-                logger.error(f"❌ API request failed with status {response.status_code}")
-                logger.error(f"   Response: {response.text}")
-                return False
+        logger.info("🔗 Testing connection to Kaspi API...")
+        
+        # Try to get products (this should work if token is valid)
+        products = await api.get_products()
+        logger.info(f"✅ API connection successful!")
+        logger.info(f"   Found {len(products)} existing products in your store")
+        return True
                 
+    except httpx.HTTPStatusError as e:
+        logger.error(f"❌ API request failed with status {e.response.status_code}")
+        logger.error(f"   Response: {e.response.text}")
+        return False
     except httpx.TimeoutException:
-        logger.error("❌ API request timed out (60 seconds)")
+        logger.error("❌ API request timed out")
         logger.info("   This might be due to slow internet or API being busy")
         return False
     except Exception as e: